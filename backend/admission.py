@@ -0,0 +1,168 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Per-user token bucket: sustained analyses per minute and burst size
+USER_ANALYSES_PER_MINUTE = float(os.environ.get('USER_ANALYSES_PER_MINUTE', '10'))
+USER_ANALYSIS_BURST = int(os.environ.get('USER_ANALYSIS_BURST', '20'))
+# Upstream model calls in flight at once, sized to the provider's rate limit
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+# Calls allowed to wait for a slot; past this, new analyses and further
+# model calls (map-reduce chunks, batch items) are turned away
+LLM_MAX_WAITING = int(os.environ.get('LLM_MAX_WAITING', '32'))
+
+# Idle buckets are pruned once this many users are tracked
+MAX_TRACKED_USERS = 10000
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float) -> float:
+        """
+        Take cost tokens; returns 0 on success, otherwise the seconds until
+        enough tokens will have accumulated (nothing is taken)
+        """
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """
+    Load shedding in front of the analysis pipeline:
+    - a token bucket per user caps how fast one user can start analyses
+    - a global semaphore caps upstream model calls in flight
+    - new analyses, and model calls that would have to queue, are rejected
+      while too many calls already wait for a slot
+    Rejections carry a Retry-After estimate so clients back off instead of
+    piling on.
+    """
+
+    def __init__(
+        self,
+        user_rate_per_minute: float = USER_ANALYSES_PER_MINUTE,
+        user_burst: int = USER_ANALYSIS_BURST,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_waiting: int = LLM_MAX_WAITING
+    ):
+        self.user_rate = user_rate_per_minute / 60.0
+        self.user_burst = user_burst
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of how long a call holds its slot, for Retry-After
+        self._average_hold = 5.0
+        self.admitted = 0
+        self.rejected_user = 0
+        self.rejected_overload = 0
+
+    def _bucket(self, user_id: str) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                # A full bucket is the same as a fresh one; forget them
+                self._buckets = {uid: b for uid, b in self._buckets.items() if not b.is_full()}
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _reject_if_overloaded(self):
+        if self.waiting >= self.max_waiting:
+            self.rejected_overload += 1
+            # Time for the queue ahead to drain through the available slots
+            retry_after = self._average_hold * (self.waiting / self.max_concurrency)
+            raise AdmissionRejected("Analysis service is busy. Please retry shortly.", retry_after)
+
+    def admit(self, user_id: str, cost: int = 1):
+        """
+        Admit `cost` analyses for a user or raise AdmissionRejected.
+        A request may spend at most the whole burst (e.g. a large batch).
+        """
+        self._reject_if_overloaded()
+
+        wait = self._bucket(user_id).take(min(cost, self.user_burst))
+        if wait:
+            self.rejected_user += 1
+            raise AdmissionRejected("Too many analysis requests. Please slow down.", wait)
+        self.admitted += 1
+
+    @asynccontextmanager
+    async def llm_slot(self):
+        """
+        Hold one of the global upstream-call slots for the duration of a call.
+        One admitted analysis can fan out into many calls, so the wait queue
+        is bounded here too: a call that would have to queue behind
+        max_waiting others raises AdmissionRejected instead.
+        """
+        if self._semaphore.locked():
+            self._reject_if_overloaded()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._average_hold = 0.9 * self._average_hold + 0.1 * (time.monotonic() - started)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_waiting": self.max_waiting,
+            "average_call_seconds": round(self._average_hold, 2),
+            "tracked_users": len(self._buckets),
+            "admitted": self.admitted,
+            "rejected_user_rate": self.rejected_user,
+            "rejected_overload": self.rejected_overload,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,529 @@
+import os
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from http_client import get_http_client
+from llm_client import get_llm_client
+from excel_extractor import summarize_workbook
+from csv_profiler import summarize_csv_file
+from idoc_parser import is_idoc_content, parse_idoc_file, parse_idoc_text, format_idoc_digest, read_head
+from xml_summarizer import summarize_xml_file, summarize_xml_text, format_xml_summary
+from pdf_extractor import extract_pdf_text
+from extraction_pool import get_extraction_pool
+from parsed_cache import get_parsed_cache
+from chunking import split_content
+from metrics import download_bytes, track_dependency, track_parse
+from storage import StoredFileMissing, get_storage
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = 'gpt-4o-mini'
+
+# Content beyond this size is analyzed in chunks (map) and merged (reduce)
+MAX_PROMPT_CHARS = 50000
+MAP_CONCURRENCY = int(os.environ.get('MAP_REDUCE_CONCURRENCY', '4'))
+MAX_MAP_CHUNKS = int(os.environ.get('MAP_REDUCE_MAX_CHUNKS', '50'))
+MAP_MAX_TOKENS = 800
+
+# Posted content inspected to recognize an IDoc
+IDOC_SNIFF_CHARS = 4096
+
+# on_progress(stage, completed, total)
+ProgressCallback = Callable[[str, int, int], Awaitable[None]]
+
+DEFAULT_SYSTEM_PROMPT = """You are an expert SAP consultant analyzing a document.
+Provide a comprehensive analysis including:
+1. Document type and content overview
+2. Key information extracted
+3. SAP-related processes or modules involved
+4. Recommendations and next steps
+5. Potential integration opportunities
+
+Focus on SAP-relevant insights and actionable recommendations."""
+
+IDOC_SYSTEM_PROMPT = """You are an expert SAP consultant analyzing an IDOC (Intermediate Document).
+Provide a detailed analysis including:
+1. Document type and purpose
+2. Key data fields and their meanings
+3. Business process context
+4. Potential issues or recommendations
+5. Integration points and dependencies
+
+Make your response clear and actionable for SAP professionals."""
+
+TABULAR_SYSTEM_PROMPT = """You are an expert SAP consultant analyzing a {file_type} file that may contain SAP data exports or integration data.
+Provide a detailed analysis including:
+1. File structure and data organization
+2. Key data fields and their SAP relevance
+3. Data quality assessment
+4. Potential SAP module associations (FI, CO, SD, MM, etc.)
+5. Integration opportunities (real-time vs batch)
+6. Recommendations for ASAPIO or similar integration tools if applicable
+7. Data transformation needs
+
+Focus on identifying if this data would benefit from real-time integration tools like ASAPIO vs batch file processing."""
+
+MAP_INSTRUCTIONS = """
+
+You are seeing one part of a larger document. Report concise findings for this part only;
+they will be merged with the findings for the other parts."""
+
+REDUCE_INSTRUCTIONS = """
+
+You are given partial analyses of consecutive parts of one document.
+Merge them into a single, de-duplicated analysis of the whole document."""
+
+
+def build_mock_analysis(upload: dict, filename: str, user_email: str) -> str:
+    """
+    Analysis text returned when OpenAI is not configured
+    """
+    return f"""
+File Analysis Results:
+====================
+
+📄 File: {filename}
+📊 Size: {upload.get('file_size', 0)} bytes
+👤 User: {user_email or 'Unknown'}
+📅 Upload Time: {upload.get('upload_timestamp', 'Unknown')}
+
+📋 Content Summary:
+OpenAI API key not configured. Please set OPENAI_API_KEY environment variable to enable AI analysis.
+
+✅ File uploaded successfully!
+            """
+
+
+@asynccontextmanager
+async def downloaded_file(file_path: str, filename: str):
+    """
+    Stream a stored file (Firebase Storage URL) to a temporary file and yield its path.
+    Only one network chunk is held in memory at a time.
+    """
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=Path(filename).suffix)
+    try:
+        with temp_file, track_dependency('storage', 'download'):
+            async with get_http_client().stream("GET", file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    temp_file.write(chunk)
+                    download_bytes.inc('analysis', amount=len(chunk))
+        yield temp_file.name
+    finally:
+        os.unlink(temp_file.name)
+
+
+def has_stored_file(upload: dict) -> bool:
+    return bool(upload.get('storage_key') or upload.get('local_path') or upload.get('file_path'))
+
+
+@asynccontextmanager
+async def stored_file(upload: dict, filename: str):
+    """
+    Yield a local path for an upload's file: from the storage backend for
+    files sent to /upload-file (on local storage, the stored file itself),
+    otherwise a download of file_path
+    """
+    storage_key = upload.get('storage_key')
+    if storage_key:
+        try:
+            async with get_storage().local_file(storage_key, Path(filename).suffix) as path:
+                yield path
+            return
+        except StoredFileMissing:
+            if not upload.get('file_path'):
+                raise
+            logger.warning(f"Stored copy of {filename} is missing; downloading file_path")
+    # Records from before the storage backend point at their spooled copy
+    local_path = upload.get('local_path')
+    if local_path and os.path.exists(local_path):
+        yield local_path
+        return
+    async with downloaded_file(upload['file_path'], filename) as downloaded_path:
+        yield downloaded_path
+
+
+async def summarize_with_snapshot(upload: dict, filename: str, file_type: str, summarize) -> str:
+    """
+    Summarize a tabular file on the extraction pool, reusing the parsed
+    snapshot of an earlier analysis when there is one. A fresh parse writes
+    an Arrow snapshot of every sheet in the same pass and caches it.
+    """
+    parsed_cache = get_parsed_cache()
+    cached_summary = parsed_cache.load_profile(upload)
+    if cached_summary is not None:
+        logger.info(f"Using parsed snapshot of {filename}; skipping download and parse")
+        return cached_summary
+
+    snapshot_dir = parsed_cache.new_snapshot_dir()
+    try:
+        async with stored_file(upload, filename) as local_path:
+            with track_parse(file_type):
+                summary = await get_extraction_pool().run(summarize, local_path, filename, snapshot_dir)
+    except BaseException:
+        parsed_cache.discard_build(snapshot_dir)
+        raise
+    try:
+        parsed_cache.store(upload, snapshot_dir, summary)
+    except OSError as cache_error:
+        logger.warning(f"Could not cache parsed snapshot of {filename}: {cache_error}")
+        parsed_cache.discard_build(snapshot_dir)
+    return summary
+
+
+async def extract_excel_content(upload: dict, filename: str) -> str:
+    """
+    Summarize an Excel workbook (Firebase Storage or local copy) on the extraction pool
+    """
+    logger.info(f"Extracting Excel file: {filename}")
+    # Sheets are streamed row by row; memory doesn't grow with sheet size
+    excel_summary = await summarize_with_snapshot(upload, filename, 'excel', summarize_workbook)
+    logger.info(f"Excel file parsed successfully. Content length: {len(excel_summary)}")
+    return excel_summary
+
+
+async def extract_csv_content(upload: dict, filename: str) -> str:
+    """
+    Summarize a CSV file (Firebase Storage or local copy) on the extraction pool
+    """
+    logger.info(f"Extracting CSV file: {filename}")
+    # Profiled in fixed-size chunks; peak memory doesn't grow with file size
+    csv_summary = await summarize_with_snapshot(upload, filename, 'csv', summarize_csv_file)
+    logger.info(f"CSV file parsed successfully. Content length: {len(csv_summary)}")
+    return csv_summary
+
+
+async def extract_idoc_content(upload: dict, file_content: str, filename: str) -> str:
+    """
+    Reduce an IDoc to a structural digest (control record values, segment
+    hierarchy, cardinalities, samples) instead of sending the raw records
+    """
+    if has_stored_file(upload):
+        async with stored_file(upload, filename) as local_path:
+            with track_parse('idoc'):
+                digest = await get_extraction_pool().run(parse_idoc_file, local_path)
+    else:
+        with track_parse('idoc'):
+            digest = await get_extraction_pool().run(parse_idoc_text, file_content)
+    if not digest.idoc_count and not digest.segments:
+        # Named like an IDoc but no IDoc records found: keep the raw text
+        return ""
+    idoc_summary = format_idoc_digest(digest, filename)
+    logger.info(f"IDoc parsed successfully: {digest.idoc_count} IDocs, {len(digest.segments)} segment types")
+    return idoc_summary
+
+
+async def extract_xml_content(upload: dict, file_content: str, filename: str) -> str:
+    """
+    Summarize an XML document's structure (tag paths, cardinalities,
+    attributes, sample values) in a single streaming pass
+    """
+    if has_stored_file(upload):
+        async with stored_file(upload, filename) as local_path:
+            with track_parse('xml'):
+                summary = await get_extraction_pool().run(summarize_xml_file, local_path)
+    else:
+        with track_parse('xml'):
+            summary = await get_extraction_pool().run(summarize_xml_text, file_content)
+    xml_summary = format_xml_summary(summary, filename)
+    logger.info(f"XML file parsed successfully: {summary.element_count} elements, {len(summary.paths)} tag paths")
+    return xml_summary
+
+
+async def extract_pdf_content(upload: dict, filename: str) -> str:
+    """
+    Extract a stored PDF's text and tables page by page on the process pool,
+    stopping once there is more text than map-reduce would analyze
+    """
+    logger.info(f"Extracting PDF file: {filename}")
+    async with stored_file(upload, filename) as local_path:
+        with track_parse('pdf'):
+            pdf_text = await extract_pdf_text(local_path, filename, max_chars=MAX_PROMPT_CHARS * MAX_MAP_CHUNKS)
+    logger.info(f"PDF file parsed successfully. Content length: {len(pdf_text)}")
+    return pdf_text
+
+
+def get_model_api_key() -> Optional[str]:
+    """
+    API key for model calls; None means analysis runs in mock mode
+    (the stub provider needs no key)
+    """
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if openai_api_key or get_llm_client().requires_api_key:
+        return openai_api_key
+    return ''
+
+
+async def call_openai(request_body: dict, openai_api_key: str) -> str:
+    """
+    Send a chat completion request and return the message text.
+    Transient upstream errors are retried by the LLM client.
+    """
+    return await get_llm_client().complete(request_body, openai_api_key)
+
+
+def stream_openai(request_body: dict, openai_api_key: str) -> AsyncIterator[str]:
+    """
+    Send a streaming chat completion request and yield content deltas as they arrive.
+    Closing the generator closes the upstream connection.
+    """
+    return get_llm_client().stream(request_body, openai_api_key)
+
+
+@dataclass
+class PreparedDocument:
+    content: str
+    system_prompt: str
+    label: str  # how the document is described to the model
+
+
+async def looks_like_idoc(upload: dict, file_content: str, filename: str) -> bool:
+    """
+    Structural IDoc check on the posted content, or, when nothing was
+    posted, on the first bytes of the stored file
+    """
+    if file_content:
+        return is_idoc_content(file_content[:IDOC_SNIFF_CHARS])
+    if not has_stored_file(upload):
+        return False
+    try:
+        async with stored_file(upload, filename) as local_path:
+            return is_idoc_content(await asyncio.to_thread(read_head, local_path))
+    except Exception as e:
+        logger.warning(f"Could not inspect {filename} for IDoc records: {e}")
+        return False
+
+
+async def prepare_document(upload: dict, file_content: str, filename: str) -> PreparedDocument:
+    """
+    Extract the document content and pick the system prompt for its type
+    """
+    file_content = file_content or ""
+    filename = filename or upload.get('filename', '')
+
+    # Determine document type
+    is_excel = filename.lower().endswith(('.xlsx', '.xls'))
+    is_csv = filename.lower().endswith('.csv')
+    is_pdf = filename.lower().endswith('.pdf')
+    # IDocs are recognized by their control records / elements, not their name
+    is_idoc = not (is_excel or is_csv or is_pdf) and await looks_like_idoc(upload, file_content, filename)
+    is_xml = (
+        filename.lower().endswith('.xml')
+        or upload.get('content_type') in ('text/xml', 'application/xml')
+        or upload.get('detected_type') == 'xml'
+    )
+
+    # For IDocs, send a structural digest rather than the raw segments
+    if is_idoc:
+        try:
+            file_content = await extract_idoc_content(upload, file_content, filename) or file_content
+        except Exception as idoc_error:
+            # Malformed IDocs are still analyzed from their raw text
+            logger.error(f"Error parsing IDoc file: {idoc_error}")
+
+    # For other XML, send its structural schema rather than the first characters
+    elif is_xml and (file_content or has_stored_file(upload)):
+        try:
+            file_content = await extract_xml_content(upload, file_content, filename)
+        except Exception as xml_error:
+            logger.error(f"Error parsing XML file: {xml_error}")
+
+    # For PDFs, extract the stored file server-side instead of trusting posted text
+    elif is_pdf and has_stored_file(upload):
+        try:
+            pdf_text = await extract_pdf_content(upload, filename)
+            if '=== Page ' in pdf_text:
+                file_content = pdf_text
+            else:
+                logger.warning(f"No text layer found in PDF {filename}; using posted content")
+        except Exception as pdf_error:
+            logger.error(f"Error parsing PDF file: {pdf_error}")
+
+    # For Excel files, parse the stored file (or reuse its parsed snapshot)
+    elif is_excel and has_stored_file(upload):
+        try:
+            file_content = await extract_excel_content(upload, filename)
+        except Exception as excel_error:
+            logger.error(f"Error parsing Excel file: {excel_error}")
+            # Fallback to basic info
+            file_content = f"Excel file: {filename}\n\nUnable to parse Excel file content. Error: {str(excel_error)}\n\nThis Excel file may contain SAP data exports or integration data. Please analyze based on filename and provide general recommendations."
+
+    # For CSV files, parse the stored file (or reuse its parsed snapshot)
+    elif is_csv and has_stored_file(upload):
+        try:
+            file_content = await extract_csv_content(upload, filename)
+        except Exception as csv_error:
+            logger.error(f"Error parsing CSV file: {csv_error}")
+            # Fallback to basic info
+            file_content = f"CSV file: {filename}\n\nUnable to parse CSV file content. Error: {str(csv_error)}\n\nThis CSV file may contain SAP data exports or integration data. Please analyze based on filename and provide general recommendations."
+
+    # Fallback if no content extracted
+    if not file_content and (is_excel or is_csv):
+        file_type = "Excel" if is_excel else "CSV"
+        file_content = f"{file_type} file: {filename}\n\nThis is a {file_type} file that may contain SAP data exports or integration data. Analyze the file structure and provide recommendations for integration approaches."
+
+    system_prompt = DEFAULT_SYSTEM_PROMPT
+    if is_idoc:
+        system_prompt = IDOC_SYSTEM_PROMPT
+    elif is_excel or is_csv:
+        system_prompt = TABULAR_SYSTEM_PROMPT.format(file_type="Excel" if is_excel else "CSV")
+
+    label = "SAP IDOC" if is_idoc else "Excel file" if is_excel else "CSV file" if is_csv else "XML document" if is_xml else "PDF document" if is_pdf else "document"
+    return PreparedDocument(content=file_content, system_prompt=system_prompt, label=label)
+
+
+def build_chat_request(system_prompt: str, user_message: str, max_tokens: int = 2000) -> dict:
+    return {
+        'model': OPENAI_MODEL,
+        'messages': [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_message}
+        ],
+        'max_tokens': max_tokens,
+        'temperature': 0.3,
+    }
+
+
+def build_analysis_request(document: PreparedDocument) -> dict:
+    """
+    Single-call request body for a document that fits in one prompt
+    """
+    return build_chat_request(
+        document.system_prompt,
+        f'Please analyze this {document.label}:\n\n{document.content[:MAX_PROMPT_CHARS]}'
+    )
+
+
+def needs_map_reduce(document: PreparedDocument) -> bool:
+    return len(document.content) > MAX_PROMPT_CHARS
+
+
+async def complete(request_body: dict, openai_api_key: str, cache=None) -> str:
+    """
+    Run one chat completion, going through the analysis cache when given
+    """
+    if cache is None:
+        return await call_openai(request_body, openai_api_key)
+    # Identical prompts are answered from the cache / collapsed into one call
+    return await cache.get_or_compute(
+        request_body,
+        lambda: call_openai(request_body, openai_api_key)
+    )
+
+
+async def map_document(
+    document: PreparedDocument,
+    openai_api_key: str,
+    cache=None,
+    on_progress: Optional[ProgressCallback] = None
+) -> List[str]:
+    """
+    Map phase: analyze each chunk of a large document concurrently
+    (bounded by MAP_CONCURRENCY) and return the partial findings in order
+    """
+    chunks = split_content(document.content, MAX_PROMPT_CHARS)
+    if len(chunks) > MAX_MAP_CHUNKS:
+        logger.warning(f"Document split into {len(chunks)} chunks; analyzing the first {MAX_MAP_CHUNKS}")
+        chunks = chunks[:MAX_MAP_CHUNKS]
+
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+    completed = 0
+
+    async def analyze_chunk(index: int, chunk: str) -> str:
+        nonlocal completed
+        async with semaphore:
+            request_body = build_chat_request(
+                document.system_prompt + MAP_INSTRUCTIONS,
+                f'Part {index + 1} of {len(chunks)} of a {document.label}:\n\n{chunk}',
+                max_tokens=MAP_MAX_TOKENS
+            )
+            finding = await complete(request_body, openai_api_key, cache)
+        completed += 1
+        if on_progress:
+            await on_progress("map", completed, len(chunks))
+        return finding
+
+    if on_progress:
+        await on_progress("map", 0, len(chunks))
+    tasks = [asyncio.ensure_future(analyze_chunk(i, chunk)) for i, chunk in enumerate(chunks)]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # Once one chunk fails (e.g. rejected while the model is overloaded)
+        # the analysis has failed; don't keep the other chunks' calls going
+        for task in tasks:
+            task.cancel()
+
+
+def build_reduce_request(document: PreparedDocument, findings: List[str]) -> dict:
+    """
+    Reduce phase: merge the partial findings into one analysis
+    """
+    parts = "\n\n".join(
+        f"--- Findings for part {i + 1} of {len(findings)} ---\n{finding}"
+        for i, finding in enumerate(findings)
+    )
+    return build_chat_request(
+        document.system_prompt + REDUCE_INSTRUCTIONS,
+        f'Partial analyses of a {document.label}:\n\n{parts}'
+    )
+
+
+async def analyze_prepared(
+    document: PreparedDocument,
+    openai_api_key: str,
+    cache=None,
+    on_progress: Optional[ProgressCallback] = None
+) -> str:
+    """
+    Model calls for a prepared document: one completion, or map-reduce for
+    documents larger than one prompt
+    """
+    if not needs_map_reduce(document):
+        return await complete(build_analysis_request(document), openai_api_key, cache)
+
+    findings = await map_document(document, openai_api_key, cache, on_progress)
+    if on_progress:
+        await on_progress("reduce", 0, 1)
+    result = await complete(build_reduce_request(document, findings), openai_api_key, cache)
+    if on_progress:
+        await on_progress("reduce", 1, 1)
+    return result
+
+
+async def run_analysis(
+    upload: dict,
+    file_content: str,
+    filename: str,
+    user_email: str = None,
+    cache=None,
+    on_progress: Optional[ProgressCallback] = None,
+    model_slots: Optional[asyncio.Semaphore] = None
+) -> str:
+    """
+    Run the full analysis pipeline for an upload and return the analysis text.
+    Documents larger than one prompt are analyzed chunk by chunk and merged.
+    When an AnalysisCache is given, completions are looked up / stored there.
+    When model_slots is given, the model calls (not the download and parse)
+    wait for a slot, bounding how many documents are with the model at once.
+    """
+    # Check if OpenAI API key is configured
+    openai_api_key = get_model_api_key()
+
+    if openai_api_key is None:
+        # Return mock analysis if OpenAI not configured
+        return build_mock_analysis(upload, filename or upload.get('filename', ''), user_email)
+
+    with span("prepare_document", filename=filename or upload.get('filename', '')):
+        document = await prepare_document(upload, file_content, filename)
+
+    if model_slots is None:
+        return await analyze_prepared(document, openai_api_key, cache, on_progress)
+    async with model_slots:
+        return await analyze_prepared(document, openai_api_key, cache, on_progress)
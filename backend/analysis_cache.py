@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Stores between recounts of the collection's total size from MongoDB (picks
+# up entries written or evicted by other processes)
+RECOUNT_EVERY_STORES = 500
+
+
+def cache_key(request_body: dict) -> str:
+    """
+    Content address of an LLM request: the extracted content, system prompt,
+    model and sampling parameters all live in the request body
+    """
+    canonical = json.dumps(request_body, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """
+    MongoDB-backed cache of analysis results keyed by the hash of the LLM
+    request. Identical concurrent requests share one upstream call, and the
+    collection is trimmed (least recently used first) to a total byte budget,
+    checked against a running total rather than a recount on every store.
+    """
+
+    def __init__(self, database, max_bytes: int = 256 * 1024 * 1024):
+        self.collection = database.analysis_cache
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # Bytes stored in the collection; None until first counted
+        self._total_bytes: Optional[int] = None
+        self._stores_since_count = 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("key", unique=True)
+        await self.collection.create_index("last_accessed")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "in_flight": len(self._in_flight),
+            "bytes": self._total_bytes,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    async def lookup(self, request_body: dict):
+        """
+        Cached result for a request, or None (counts as a hit/miss)
+        """
+        result = await self._lookup(cache_key(request_body))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    async def store(self, request_body: dict, result: str):
+        await self._store(cache_key(request_body), result)
+
+    async def get_or_compute(self, request_body: dict, compute: Callable[[], Awaitable[str]]) -> str:
+        key = cache_key(request_body)
+
+        # Join an identical request that is already running
+        pending = self._in_flight.get(key)
+        while pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    # This request itself was cancelled
+                    raise
+            # The request we joined was cancelled: join the next one or compute
+            pending = self._in_flight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._lookup(key)
+            if result is None:
+                self.misses += 1
+                result = await compute()
+                await self._store(key, result)
+            else:
+                self.hits += 1
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future doesn't log a warning
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled (client disconnect, cancelled batch task): the requests
+            # waiting on this one compute the result themselves instead of
+            # inheriting the cancellation
+            future.cancel()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _lookup(self, key: str):
+        try:
+            entry = await self.collection.find_one_and_update(
+                {"key": key},
+                {"$set": {"last_accessed": datetime.utcnow()}, "$inc": {"hit_count": 1}},
+                projection={"_id": 0, "result": 1}
+            )
+        except Exception as e:
+            logger.error(f"Analysis cache lookup failed: {e}")
+            return None
+        return entry["result"] if entry else None
+
+    async def _store(self, key: str, result: str):
+        now = datetime.utcnow()
+        size = len(result.encode('utf-8'))
+        try:
+            # Returns the replaced entry, if any, to keep the running total exact
+            previous = await self.collection.find_one_and_update(
+                {"key": key},
+                {"$set": {
+                    "result": result,
+                    "size": size,
+                    "created_at": now,
+                    "last_accessed": now,
+                    "hit_count": 0
+                }},
+                projection={"_id": 0, "size": 1},
+                upsert=True
+            )
+            self._stores_since_count += 1
+            if self._total_bytes is None or self._stores_since_count >= RECOUNT_EVERY_STORES:
+                await self._count_bytes()
+            else:
+                self._total_bytes += size - (previous or {}).get("size", 0)
+            if self._total_bytes > self.max_bytes:
+                await self._evict()
+        except Exception as e:
+            # A cache write failure must never fail the analysis
+            logger.error(f"Analysis cache store failed: {e}")
+
+    async def _count_bytes(self):
+        totals = await self.collection.aggregate([
+            {"$group": {"_id": None, "bytes": {"$sum": "$size"}}}
+        ]).to_list(1)
+        self._total_bytes = totals[0]["bytes"] if totals else 0
+        self._stores_since_count = 0
+
+    async def _evict(self):
+        """
+        Drop least recently used entries until back under budget
+        """
+        excess = self._total_bytes - self.max_bytes
+        victims = []
+        freed = 0
+        cursor = self.collection.find({}, {"_id": 1, "size": 1}).sort("last_accessed", 1)
+        async for entry in cursor:
+            victims.append(entry["_id"])
+            freed += entry.get("size", 0)
+            if freed >= excess:
+                break
+        if victims:
+            result = await self.collection.delete_many({"_id": {"$in": victims}})
+            self.evictions += result.deleted_count
+            self._total_bytes -= freed
+            logger.info(f"Evicted {result.deleted_count} analysis cache entries")
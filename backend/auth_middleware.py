@@ -1,6 +1,9 @@
+import os
+import hmac
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from firebase_config import verify_firebase_token
+from tracing import span
 from typing import Dict, Optional
 
 security = HTTPBearer()
@@ -13,7 +16,8 @@ async def get_current_user(
     """
     try:
         # Verify the Firebase ID token
-        user_data = await verify_firebase_token(credentials.credentials)
+        with span("verify_firebase_token"):
+            user_data = await verify_firebase_token(credentials.credentials)
         return user_data
     except ValueError as e:
         raise HTTPException(
@@ -36,7 +40,30 @@ async def optional_auth(
         return None
         
     try:
-        user_data = await verify_firebase_token(credentials.credentials)
+        with span("verify_firebase_token"):
+            user_data = await verify_firebase_token(credentials.credentials)
         return user_data
     except:
-        return None
\ No newline at end of file
+        return None
+
+async def require_internal_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+):
+    """
+    Dependency for internal monitoring endpoints: requires INTERNAL_API_TOKEN
+    as the bearer token (these expose load and usage of all users). Read per
+    request, as server.py loads .env after importing this module; unset
+    disables the endpoints.
+    """
+    internal_token = os.environ.get('INTERNAL_API_TOKEN', '')
+    if not internal_token:
+        raise HTTPException(
+            status_code=403,
+            detail="Internal endpoints are disabled; set INTERNAL_API_TOKEN to enable them"
+        )
+    if not credentials or not hmac.compare_digest(credentials.credentials.encode(), internal_token.encode()):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid internal token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
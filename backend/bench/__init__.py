@@ -0,0 +1,6 @@
+"""
+Offline benchmark harness: local stand-ins for Firebase, MongoDB, Storage
+and OpenAI, SAP-like fixtures and a load generator.
+
+    cd backend && python -m bench.run
+"""
@@ -0,0 +1,165 @@
+import copy
+import threading
+from typing import Dict, Optional
+
+import firebase_admin
+from firebase_admin import credentials
+from google.auth.credentials import AnonymousCredentials
+
+# Benchmark bearer tokens are "bench-<uid>"
+BENCH_TOKEN_PREFIX = 'bench-'
+
+
+def bench_token(uid: str) -> str:
+    return f"{BENCH_TOKEN_PREFIX}{uid}"
+
+
+async def fake_verify_firebase_token(id_token: str) -> dict:
+    """
+    Stand-in for firebase_config.verify_firebase_token: accepts bench tokens
+    and returns the same claims shape
+    """
+    if not id_token.startswith(BENCH_TOKEN_PREFIX):
+        raise ValueError("Not a benchmark token")
+    uid = id_token[len(BENCH_TOKEN_PREFIX):]
+    return {
+        "uid": uid,
+        "email": f"{uid}@bench.local",
+        "phone_number": None,
+        "email_verified": True,
+        "provider_id": "password"
+    }
+
+
+class _AnonymousCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+def initialize_fake_firebase():
+    """
+    Register a credential-less Firebase app before firebase_config is
+    imported, so no service account file is needed
+    """
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(_AnonymousCredential(), {'projectId': 'bench'})
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, data: Optional[dict]):
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, store: "FakeFirestore", collection: str, document_id: str):
+        self._store = store
+        self._key = (collection, document_id)
+
+    def get(self) -> FakeDocumentSnapshot:
+        with self._store.lock:
+            return FakeDocumentSnapshot(self._store.documents.get(self._key))
+
+    def set(self, data: dict, merge: bool = False):
+        with self._store.lock:
+            current = self._store.documents.get(self._key) if merge else None
+            self._store.documents[self._key] = {**(current or {}), **copy.deepcopy(data)}
+
+    def update(self, data: dict):
+        with self._store.lock:
+            if self._key not in self._store.documents:
+                raise KeyError(f"No document to update: {self._key[0]}/{self._key[1]}")
+            self._store.documents[self._key].update(copy.deepcopy(data))
+
+
+class FakeCollectionReference:
+    def __init__(self, store: "FakeFirestore", name: str):
+        self._store = store
+        self._name = name
+
+    def document(self, document_id: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self._store, self._name, document_id)
+
+
+class FakeWriteBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, reference: FakeDocumentReference, data: dict, merge: bool = False):
+        self._writes.append(lambda: reference.set(data, merge=merge))
+
+    def update(self, reference: FakeDocumentReference, data: dict):
+        self._writes.append(lambda: reference.update(data))
+
+    def commit(self):
+        for write in self._writes:
+            write()
+        self._writes = []
+
+
+class FakeFirestore:
+    """
+    In-memory subset of the Firestore client used by profile_cache
+    (collection/document get, set, update and batched writes). Thread-safe,
+    as the backend calls it through asyncio.to_thread.
+    """
+
+    def __init__(self):
+        self.documents: Dict[tuple, dict] = {}
+        self.lock = threading.Lock()
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, name)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch()
+
+
+def make_database(mongo_url: Optional[str] = None, db_name: str = 'osapio_bench'):
+    """
+    A real MongoDB database when mongo_url is given, otherwise an in-memory
+    one (mongomock-motor, see bench/requirements.txt)
+    """
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)[db_name]
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise RuntimeError(
+            "In-memory MongoDB needs mongomock-motor (pip install -r bench/requirements.txt); "
+            "or pass a MongoDB URL"
+        )
+    return AsyncMongoMockClient()[db_name]
+
+
+async def _no_token_key_refresh():
+    pass
+
+
+def install_fakes(server, database, firestore_client: FakeFirestore, analysis_cache: bool = True):
+    """
+    Point an imported server module at the stand-ins. Call before the app
+    starts: the startup hooks read these module globals.
+    """
+    import auth_middleware
+    from upload_repository import UploadRepository
+    from analysis_cache import AnalysisCache
+    from profile_cache import ProfileCache, LastLoginWriter
+
+    auth_middleware.verify_firebase_token = fake_verify_firebase_token
+    # Google's signing keys are never needed
+    server.start_token_key_refresh = _no_token_key_refresh
+    server.stop_token_key_refresh = _no_token_key_refresh
+
+    server.db = database
+    server.upload_repository = UploadRepository(database)
+    server.analysis_cache = AnalysisCache(database) if analysis_cache else None
+    server.profile_cache = ProfileCache(lambda: firestore_client)
+    server.last_login_writer = LastLoginWriter(lambda: firestore_client)
@@ -0,0 +1,183 @@
+import csv
+import random
+import argparse
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List, Sequence
+
+from openpyxl import Workbook
+
+from idoc_parser import CONTROL_RECORD_FIELDS, DATA_SEGNAM, DATA_HLEVEL, DATA_SDATA
+
+# Rows (CSV/Excel) or IDocs per fixture size
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+MATERIAL_COLUMNS = ['MATNR', 'MAKTX', 'MTART', 'MATKL', 'MEINS', 'WERKS', 'LGORT', 'LABST', 'BRGEW', 'GEWEI', 'ERSDA']
+ORDER_COLUMNS = ['VBELN', 'POSNR', 'KUNNR', 'MATNR', 'KWMENG', 'VRKME', 'NETWR', 'WAERK', 'ERDAT', 'AUART', 'VKORG']
+
+MATERIAL_TYPES = ['FERT', 'HALB', 'ROH', 'HAWA', 'VERP']
+UNITS = ['EA', 'KG', 'L', 'M', 'PC', 'BOX']
+PLANTS = ['1000', '1100', '1200', '2000', '3000']
+CURRENCIES = ['EUR', 'USD', 'GBP', 'CHF']
+ORDER_TYPES = ['OR', 'RE', 'ZOR', 'KB']
+WORDS = ['Pump', 'Valve', 'Housing', 'Gasket', 'Bearing', 'Shaft', 'Motor', 'Sensor', 'Cable', 'Bracket', 'Steel', 'Coated']
+
+
+@dataclass
+class Fixture:
+    name: str
+    path: Path
+    kind: str  # csv, excel or idoc
+    size: int
+    content_type: str
+
+
+def _material_row(rng: random.Random, index: int) -> list:
+    return [
+        f"{index:018d}",
+        ' '.join(rng.sample(WORDS, 3)),
+        rng.choice(MATERIAL_TYPES),
+        f"{rng.randint(1, 999):03d}",
+        rng.choice(UNITS),
+        rng.choice(PLANTS),
+        f"{rng.randint(1, 20):04d}",
+        round(rng.uniform(0, 10000), 3),
+        round(rng.uniform(0.01, 500), 3),
+        'KG',
+        (date(2015, 1, 1) + timedelta(days=rng.randint(0, 3650))).isoformat(),
+    ]
+
+
+def _order_row(rng: random.Random, index: int) -> list:
+    return [
+        f"{4500000000 + index // 5:010d}",
+        f"{(index % 5 + 1) * 10:06d}",
+        f"{rng.randint(100000, 199999):010d}",
+        f"{rng.randint(1, 50000):018d}",
+        rng.randint(1, 500),
+        rng.choice(UNITS),
+        round(rng.uniform(10, 50000), 2),
+        rng.choice(CURRENCIES),
+        (date(2022, 1, 1) + timedelta(days=rng.randint(0, 900))).isoformat(),
+        rng.choice(ORDER_TYPES),
+        rng.choice(PLANTS),
+    ]
+
+
+def generate_csv(path: Path, rows: int, seed: int = 1) -> Path:
+    """
+    Material master export (MARA/MARC/MARD-like columns)
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file, delimiter=';')
+        writer.writerow(MATERIAL_COLUMNS)
+        for index in range(rows):
+            writer.writerow(_material_row(rng, index))
+    return path
+
+
+def generate_excel(path: Path, rows: int, seed: int = 1) -> Path:
+    """
+    Workbook with a material sheet and a sales order sheet, rows split between them
+    """
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    for title, columns, make_row, count in (
+        ('Materials', MATERIAL_COLUMNS, _material_row, rows // 2),
+        ('SalesOrders', ORDER_COLUMNS, _order_row, rows - rows // 2),
+    ):
+        sheet = workbook.create_sheet(title)
+        sheet.append(columns)
+        for index in range(count):
+            sheet.append(make_row(rng, index))
+    workbook.save(path)
+    return path
+
+
+def _fixed_width(fields: Sequence[tuple], width: int) -> str:
+    record = [' '] * width
+    for (start, end), value in fields:
+        text = str(value)[:end - start]
+        record[start:start + len(text)] = text
+    return ''.join(record).rstrip()
+
+
+def _control_record(docnum: int) -> str:
+    values = {
+        'DOCNUM': f"{docnum:016d}",
+        'IDOCTYP': 'ORDERS05',
+        'MESTYP': 'ORDERS',
+        'SNDPOR': 'SAPECC',
+        'SNDPRT': 'LS',
+        'SNDPRN': 'ECCCLNT100',
+        'RCVPOR': 'OSAPIO',
+        'RCVPRT': 'LS',
+        'RCVPRN': 'OSAPIO',
+    }
+    fields = [((0, 10), 'EDI_DC40')] + [(CONTROL_RECORD_FIELDS[name], value) for name, value in values.items()]
+    return _fixed_width(fields, 524)
+
+
+def _data_record(segment: str, level: int, sdata: str) -> str:
+    return _fixed_width([(DATA_SEGNAM, segment), (DATA_HLEVEL, f"{level:02d}"), (DATA_SDATA, sdata)], DATA_SDATA[1])
+
+
+def generate_idoc(path: Path, idocs: int, seed: int = 1) -> Path:
+    """
+    Flat-file ORDERS05 IDocs: header segments and 1-10 items each
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as idoc_file:
+        for docnum in range(1, idocs + 1):
+            row = _order_row(rng, docnum)
+            lines = [
+                _control_record(docnum),
+                _data_record('E1EDK01', 1, f"{row[7]}  {row[8]}  {row[0]}"),
+                _data_record('E1EDK14', 2, f"008{row[10]}"),
+                _data_record('E1EDKA1', 2, f"AG {row[2]}  Customer {row[2][-4:]}"),
+            ]
+            for item in range(1, rng.randint(1, 10) + 1):
+                item_row = _order_row(rng, docnum * 10 + item)
+                lines.append(_data_record('E1EDP01', 2, f"{item * 10:06d} {item_row[4]} {item_row[5]} {item_row[6]}"))
+                lines.append(_data_record('E1EDP19', 3, f"002{item_row[3]}"))
+                lines.append(_data_record('E1EDP20', 3, f"{item_row[4]} {item_row[8]}"))
+            idoc_file.write('\n'.join(lines) + '\n')
+    return path
+
+
+def generate_fixtures(directory: Path, sizes: Sequence[int] = DEFAULT_SIZES) -> List[Fixture]:
+    """
+    CSV, Excel and IDoc fixtures at each size; existing files are reused
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    fixtures = []
+    for size in sizes:
+        for kind, name, generate, content_type in (
+            ('csv', f"materials_{size}.csv", generate_csv, 'text/csv'),
+            ('excel', f"sap_export_{size}.xlsx", generate_excel,
+             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+            # IDocs are an order of magnitude larger per unit
+            ('idoc', f"orders05_idoc_{size}.txt", lambda path, count: generate_idoc(path, max(1, count // 10)),
+             'text/plain'),
+        ):
+            path = directory / name
+            if not path.exists():
+                generate(path, size)
+            fixtures.append(Fixture(name, path, kind, size, content_type))
+    return fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate SAP-like benchmark fixtures")
+    parser.add_argument('directory', type=Path)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    args = parser.parse_args()
+    for fixture in generate_fixtures(args.directory, args.sizes):
+        print(f"{fixture.path} ({fixture.path.stat().st_size // 1024} KB)")
+
+
+if __name__ == '__main__':
+    main()
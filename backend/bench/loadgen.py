@@ -0,0 +1,260 @@
+import time
+import asyncio
+import itertools
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Sequence
+
+import httpx
+
+from bench.fakes import bench_token
+from bench.fixtures import Fixture
+
+SCENARIOS = ('my-uploads', 'upload-file', 'download', 'download-stored', 'analyze')
+
+# /upload-file rejects larger files
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# Polling interval while waiting for a queued analysis to finish
+JOB_POLL_SECONDS = 0.1
+JOB_TIMEOUT_SECONDS = 600
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> Dict:
+        ordered = sorted(self.latencies)
+        return {
+            "scenario": self.name,
+            "requests": len(ordered) + self.errors,
+            "errors": self.errors,
+            "throughput_rps": round(len(ordered) / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+            "statuses": dict(self.statuses),
+        }
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def _check(response: httpx.Response, *expected: int):
+    if response.status_code not in expected:
+        raise RequestFailed(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+async def run_load(
+    name: str,
+    request: Callable[[int], Awaitable[httpx.Response]],
+    total: int,
+    concurrency: int
+) -> ScenarioResult:
+    """
+    Issue `total` requests from `concurrency` closed-loop workers; request(i)
+    performs call i and raises on failure
+    """
+    result = ScenarioResult(name)
+    counter = itertools.count()
+
+    async def worker():
+        while True:
+            index = next(counter)
+            if index >= total:
+                return
+            started = time.perf_counter()
+            try:
+                response = await request(index)
+                result.statuses[response.status_code] += 1
+            except RequestFailed as e:
+                result.errors += 1
+                result.statuses[str(e).split(':')[0]] += 1
+                continue
+            except httpx.HTTPError as e:
+                result.errors += 1
+                result.statuses[type(e).__name__] += 1
+                continue
+            result.latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+class LoadGenerator:
+    """
+    Drives the hot endpoints of a running backend (started by bench.serve)
+    as `users` distinct bench users
+    """
+
+    def __init__(self, base_url: str, storage_url: str, fixtures: List[Fixture], users: int = 10):
+        self.base_url = base_url.rstrip('/')
+        self.storage_url = storage_url.rstrip('/')
+        self.fixtures = fixtures
+        self.users = [f"bench-user-{n}" for n in range(users)]
+        # (uid, upload_id) of records pointing at the storage stub
+        self.uploads: List[tuple] = []
+        # (uid, upload_id) of files sent to /upload-file (kept by the storage backend)
+        self.stored_uploads: List[tuple] = []
+
+    def _headers(self, index: int) -> dict:
+        return {"Authorization": f"Bearer {bench_token(self.users[index % len(self.users)])}"}
+
+    async def seed(self, client: httpx.AsyncClient):
+        """
+        One upload record per user and fixture, stored "in Firebase Storage"
+        (the file server stub), and one file sent to /upload-file per user
+        and fixture that fits its size limit
+        """
+        for user_index, uid in enumerate(self.users):
+            for fixture in self.fixtures:
+                if fixture.path.stat().st_size <= MAX_UPLOAD_BYTES:
+                    response = await client.post(
+                        f"{self.base_url}/api/upload-file",
+                        headers=self._headers(user_index),
+                        files={"file": (fixture.name, fixture.path.read_bytes(), fixture.content_type)}
+                    )
+                    _check(response, 200)
+                    self.stored_uploads.append((user_index, response.json()['upload_id']))
+                response = await client.post(
+                    f"{self.base_url}/api/upload-record",
+                    headers=self._headers(user_index),
+                    json={
+                        "filename": fixture.name,
+                        "file_size": fixture.path.stat().st_size,
+                        "file_path": f"{self.storage_url}/{fixture.name}"
+                    }
+                )
+                _check(response, 200)
+                self.uploads.append((user_index, response.json()['upload_id']))
+
+    async def my_uploads(self, client: httpx.AsyncClient, total: int, concurrency: int) -> ScenarioResult:
+        async def request(index: int):
+            response = await client.get(f"{self.base_url}/api/my-uploads", params={"limit": 50}, headers=self._headers(index))
+            _check(response, 200)
+            return response
+        return await run_load('GET /my-uploads', request, total, concurrency)
+
+    async def upload_file(self, client: httpx.AsyncClient, total: int, concurrency: int) -> ScenarioResult:
+        # Smallest fixture of each kind, rotated
+        smallest = {}
+        for fixture in sorted(self.fixtures, key=lambda f: f.size):
+            smallest.setdefault(fixture.kind, fixture)
+        payloads = [(f.name, f.path.read_bytes(), f.content_type) for f in smallest.values()]
+
+        async def request(index: int):
+            name, content, content_type = payloads[index % len(payloads)]
+            response = await client.post(
+                f"{self.base_url}/api/upload-file",
+                headers=self._headers(index),
+                files={"file": (name, content, content_type)}
+            )
+            _check(response, 200)
+            return response
+        return await run_load('POST /upload-file', request, total, concurrency)
+
+    async def download(
+        self,
+        client: httpx.AsyncClient,
+        total: int,
+        concurrency: int,
+        stored: bool = False
+    ) -> ScenarioResult:
+        """
+        Download proxied Firebase Storage files, or (stored) files kept by
+        the storage backend
+        """
+        uploads = self.stored_uploads if stored else self.uploads
+
+        async def request(index: int):
+            user_index, upload_id = uploads[index % len(uploads)]
+            async with client.stream(
+                "GET", f"{self.base_url}/api/download/{upload_id}", headers=self._headers(user_index)
+            ) as response:
+                _check(response, 200)
+                async for _ in response.aiter_bytes():
+                    pass
+            return response
+        name = 'GET /download/{id} (stored)' if stored else 'GET /download/{id}'
+        return await run_load(name, request, total, concurrency)
+
+    async def analyze(self, client: httpx.AsyncClient, total: int, concurrency: int) -> List[ScenarioResult]:
+        """
+        Queue analyses and wait for each job; reports the time to accept
+        (202) and the end-to-end time to a completed result
+        """
+        accepted = ScenarioResult('POST /analyze/{id} (accept)')
+
+        async def request(index: int):
+            user_index, upload_id = self.uploads[index % len(self.uploads)]
+            headers = self._headers(user_index)
+            started = time.perf_counter()
+            response = await client.post(f"{self.base_url}/api/analyze/{upload_id}", headers=headers, json={})
+            _check(response, 202)
+            accepted.latencies.append(time.perf_counter() - started)
+            accepted.statuses[response.status_code] += 1
+            job_id = response.json()['job_id']
+            deadline = started + JOB_TIMEOUT_SECONDS
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                job = await client.get(f"{self.base_url}/api/analyze/jobs/{job_id}", headers=headers)
+                _check(job, 200)
+                status = job.json()['status']
+                if status == 'completed':
+                    return job
+                if status == 'failed':
+                    raise RequestFailed(f"job failed: {job.json().get('error')}")
+            raise RequestFailed("job timed out")
+
+        completed = await run_load('POST /analyze/{id} (complete)', request, total, concurrency)
+        accepted.elapsed = completed.elapsed
+        return [accepted, completed]
+
+    async def run(self, scenarios: Sequence[str], total: int, concurrency: int) -> List[ScenarioResult]:
+        limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+        async with httpx.AsyncClient(timeout=httpx.Timeout(120.0), limits=limits) as client:
+            await self.seed(client)
+            results = []
+            for scenario in scenarios:
+                if scenario == 'my-uploads':
+                    results.append(await self.my_uploads(client, total, concurrency))
+                elif scenario == 'upload-file':
+                    results.append(await self.upload_file(client, total, concurrency))
+                elif scenario == 'download':
+                    results.append(await self.download(client, total, concurrency))
+                elif scenario == 'download-stored':
+                    results.append(await self.download(client, total, concurrency, stored=True))
+                elif scenario == 'analyze':
+                    results.extend(await self.analyze(client, total, concurrency))
+            return results
+
+
+def format_results(results: List[ScenarioResult]) -> str:
+    header = f"{'scenario':<32} {'reqs':>6} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    lines = [header, '-' * len(header)]
+    for result in results:
+        s = result.summary()
+        lines.append(
+            f"{s['scenario']:<32} {s['requests']:>6} {s['errors']:>6} {s['throughput_rps']:>8} "
+            f"{s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9} {s['max_ms']:>9}"
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,92 @@
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import httpx
+
+from bench.fixtures import generate_fixtures
+from bench.loadgen import SCENARIOS, LoadGenerator, format_results
+from bench.stub_servers import chat_completions_url, start_chat_server, start_file_server
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+STARTUP_TIMEOUT_SECONDS = 60
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _wait_until_healthy(base_url: str, server: subprocess.Popen):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Backend exited during startup (code {server.returncode})")
+        try:
+            if httpx.get(f"{base_url}/api/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Backend did not become healthy in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend's hot endpoints offline")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="Fixture sizes (rows)")
+    parser.add_argument('--fixtures-dir', type=Path, help="Reuse generated fixtures (default: a temp dir)")
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--mongo-url', help="Use a real MongoDB instead of the in-memory one")
+    parser.add_argument('--no-analysis-cache', action='store_true')
+    parser.add_argument('--json', type=Path, help="Also write the results here")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='osapio-bench-'))
+    fixtures = generate_fixtures(args.fixtures_dir or work_dir / 'fixtures', args.sizes)
+    storage = start_file_server(str(fixtures[0].path.parent))
+    chat = start_chat_server(args.llm_latency, args.llm_error_rate)
+    base_url = f"http://127.0.0.1:{_free_port()}"
+
+    command = [
+        sys.executable, '-m', 'bench.serve',
+        '--port', base_url.rsplit(':', 1)[1],
+        '--data-dir', str(work_dir / 'data'),
+        '--chat-url', chat_completions_url(chat),
+    ]
+    if args.mongo_url:
+        command += ['--mongo-url', args.mongo_url]
+    if args.no_analysis_cache:
+        command.append('--no-analysis-cache')
+
+    server = subprocess.Popen(command, cwd=BACKEND_DIR)
+    try:
+        _wait_until_healthy(base_url, server)
+        generator = LoadGenerator(base_url, storage.base_url, fixtures, users=args.users)
+        results = asyncio.run(generator.run(args.scenarios, args.requests, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        storage.close()
+        chat.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(format_results(results))
+    if args.json:
+        args.json.write_text(json.dumps([result.summary() for result in results], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+import uvicorn
+
+from bench.fakes import FakeFirestore, initialize_fake_firebase, install_fakes, make_database
+from bench.stub_servers import chat_completions_url, start_chat_server
+
+
+def configure_environment(data_dir: Path, chat_url: str):
+    """
+    Settings read by the backend modules at import time
+    """
+    os.environ.update({
+        'LLM_PROVIDER': 'openai',
+        'OPENAI_API_KEY': 'bench',
+        'OPENAI_CHAT_URL': chat_url,
+        'UPLOAD_STORAGE_DIR': str(data_dir / 'uploads'),
+        'PARSED_CACHE_DIR': str(data_dir / 'parsed_cache'),
+        'TRACE_EXPORT_DIR': str(data_dir / 'traces'),
+    })
+    # Measure throughput, not the per-user rate limit
+    os.environ.setdefault('USER_ANALYSES_PER_MINUTE', '1000000')
+    os.environ.setdefault('USER_ANALYSIS_BURST', '1000000')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend against local stand-ins")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--data-dir', type=Path, help="Uploads, parsed cache and traces (default: a temp dir)")
+    parser.add_argument('--mongo-url', help="Use a real MongoDB instead of the in-memory one")
+    parser.add_argument('--chat-url', help="Chat-completions endpoint (default: start a stub)")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Stub model latency in seconds")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help="Share of stub model calls failing with 503")
+    parser.add_argument('--no-analysis-cache', action='store_true', help="Send every analysis to the model")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    chat_url = args.chat_url
+    if not chat_url:
+        chat_url = chat_completions_url(start_chat_server(args.llm_latency, args.llm_error_rate))
+    configure_environment(args.data_dir or Path(tempfile.mkdtemp(prefix='osapio-bench-')), chat_url)
+
+    initialize_fake_firebase()
+    import server
+    logging.getLogger().setLevel(args.log_level.upper())
+    install_fakes(
+        server,
+        make_database(args.mongo_url),
+        FakeFirestore(),
+        analysis_cache=not args.no_analysis_cache
+    )
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level=args.log_level.lower())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import json
+import time
+import random
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Type
+
+# Canned analysis returned by the chat stub, streamed word by word
+STUB_ANALYSIS = (
+    "Document type: SAP data export. Key information: master data and "
+    "transactional records. SAP modules: MM, SD. Recommendations: validate "
+    "keys before loading and map units of measure. Integration: IDoc or OData."
+)
+
+
+class StubServer:
+    """
+    A ThreadingHTTPServer on a free local port, served from a daemon thread
+    """
+
+    def __init__(self, handler: Type[BaseHTTPRequestHandler], **settings):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        for name, value in settings.items():
+            setattr(self.httpd, name, value)
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class QuietFileHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI chat-completions stand-in. Server settings: latency_seconds
+    (per call, +/- 20%), error_rate (share of calls answered 503)
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if random.random() < self.server.error_rate:
+            self._send_json(503, {"error": {"message": "Stub overloaded"}})
+            return
+
+        latency = self.server.latency_seconds
+        if latency:
+            time.sleep(latency * random.uniform(0.8, 1.2))
+
+        prompt_chars = sum(len(message.get('content') or '') for message in request.get('messages', []))
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(STUB_ANALYSIS) // 4,
+            "total_tokens": prompt_chars // 4 + len(STUB_ANALYSIS) // 4
+        }
+        if request.get('stream'):
+            self._stream(usage)
+            return
+        self._send_json(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "model": request.get('model', 'stub'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_ANALYSIS}, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    def _stream(self, usage: dict):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for word in STUB_ANALYSIS.split(' '):
+            event = {"choices": [{"index": 0, "delta": {"content": word + ' '}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_file_server(directory: str) -> StubServer:
+    """
+    Stand-in for Firebase Storage: serves files from directory over HTTP
+    """
+    return StubServer(partial(QuietFileHandler, directory=directory)).start()
+
+
+def start_chat_server(latency_seconds: float = 0.5, error_rate: float = 0.0) -> StubServer:
+    return StubServer(ChatCompletionsHandler, latency_seconds=latency_seconds, error_rate=error_rate).start()
+
+
+def chat_completions_url(server: StubServer) -> str:
+    return f"{server.base_url}/v1/chat/completions"
@@ -0,0 +1,72 @@
+import re
+from typing import List
+
+# Markers that start a self-contained section, most specific first
+_SHEET_BOUNDARY = re.compile(r'^(?==== Sheet: )', re.MULTILINE)
+_PAGE_BOUNDARY = re.compile(r'^(?==== Page \d+ ===)', re.MULTILINE)
+_XML_IDOC_BOUNDARY = re.compile(r'(?=<IDOC\b)')
+_FLAT_IDOC_BOUNDARY = re.compile(r'^(?=EDI_DC40)', re.MULTILINE)
+_BLANK_LINE_BOUNDARY = re.compile(r'\n\s*\n')
+
+
+def _split_sections(content: str) -> tuple:
+    """
+    Split content on its natural boundaries.
+    Returns (preamble, sections); the preamble (e.g. the workbook header)
+    is repeated at the top of every chunk for context.
+    """
+    for boundary in (_SHEET_BOUNDARY, _PAGE_BOUNDARY, _XML_IDOC_BOUNDARY, _FLAT_IDOC_BOUNDARY):
+        parts = boundary.split(content)
+        if len(parts) > 2 or (len(parts) == 2 and parts[0].strip()):
+            preamble, sections = parts[0], [part for part in parts[1:] if part]
+            # Keep a long preamble as content rather than repeating it
+            if len(preamble) > 2000:
+                return "", [preamble] + sections
+            return preamble, sections
+    return "", [part + "\n\n" for part in _BLANK_LINE_BOUNDARY.split(content) if part.strip()]
+
+
+def _split_oversized(section: str, max_chars: int) -> List[str]:
+    """
+    Split a section that is too large on line (row/segment) boundaries
+    """
+    pieces, current, size = [], [], 0
+    for line in section.splitlines(keepends=True):
+        while len(line) > max_chars:
+            # A single line longer than a chunk: hard split
+            if current:
+                pieces.append("".join(current))
+                current, size = [], 0
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if size + len(line) > max_chars and current:
+            pieces.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def split_content(content: str, max_chars: int) -> List[str]:
+    """
+    Split document content into chunks of at most max_chars, breaking on
+    sheets, PDF pages, IDoc boundaries, paragraphs and finally row/segment lines
+    """
+    if len(content) <= max_chars:
+        return [content]
+
+    preamble, sections = _split_sections(content)
+    budget = max(1000, max_chars - len(preamble))
+
+    chunks, current = [], ""
+    for section in sections:
+        for piece in ([section] if len(section) <= budget else _split_oversized(section, budget)):
+            if current and len(current) + len(piece) > budget:
+                chunks.append(preamble + current)
+                current = ""
+            current += piece
+    if current:
+        chunks.append(preamble + current)
+    return chunks
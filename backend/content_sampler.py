@@ -0,0 +1,309 @@
+import os
+import math
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+# Tokens of sample rows per document (shared by all of its sheets)
+SAMPLE_TOKEN_BUDGET = int(os.environ.get('SAMPLE_TOKEN_BUDGET', '3000'))
+
+HEAD_ROWS = 20
+TAIL_ROWS = 5
+# Rows always preferred from the head/tail before strata and outliers
+HEAD_FIRST_ROWS = 3
+TAIL_FIRST_ROWS = 2
+# A column with at most this many distinct values can stratify the sample
+MAX_STRATA = 20
+# Columns tracked for strata and outliers (memory is bounded by this)
+MAX_TRACKED_COLUMNS = 32
+# Column fitting: rows the budget should hold, and the narrowest useful cell
+MIN_BUDGET_ROWS = 5
+MIN_CELL_CHARS = 8
+MAX_CELL_CHARS = 40
+
+logger = logging.getLogger(__name__)
+
+# Fallback estimate when no local tokenizer is available
+CHARS_PER_TOKEN = 4
+TOKENIZER_MODEL = 'gpt-4o-mini'
+
+# Where tiktoken keeps its vocabulary. The marker file is written once the
+# vocabulary has been fetched, so extraction workers can load it from disk
+# without ever touching the network.
+TOKENIZER_CACHE_DIR = Path(
+    os.environ.get('TIKTOKEN_CACHE_DIR', str(Path(__file__).parent / 'tiktoken_cache'))
+)
+_READY_MARKER = TOKENIZER_CACHE_DIR / f"{TOKENIZER_MODEL}.ready"
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _load_encoding():
+    import tiktoken
+
+    os.environ.setdefault('TIKTOKEN_CACHE_DIR', str(TOKENIZER_CACHE_DIR))
+    return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+
+
+def _preload_tokenizer():
+    try:
+        TOKENIZER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _load_encoding()
+        _READY_MARKER.touch()
+        logger.info(f"Tokenizer vocabulary for {TOKENIZER_MODEL} cached in {TOKENIZER_CACHE_DIR}")
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, estimating tokens as chars / {CHARS_PER_TOKEN}: {e}")
+
+
+def start_tokenizer_preload():
+    """
+    Fetch the tokenizer vocabulary into the cache in the background (called
+    once in the server process). tiktoken's download has no timeout, so it
+    runs on a daemon thread and never blocks startup or extraction.
+    """
+    if not _READY_MARKER.exists():
+        threading.Thread(target=_preload_tokenizer, name='tokenizer-preload', daemon=True).start()
+
+
+def _get_encoding():
+    """
+    The tokenizer, when its vocabulary is already cached; None otherwise
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if _READY_MARKER.exists():
+            try:
+                _encoding = _load_encoding()
+            except Exception:
+                # tiktoken not installed
+                _encoding = None
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Token count of text with the model's tokenizer (tiktoken), or a
+    characters / 4 estimate when it isn't available
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def allocate_budget(demands: Sequence[int], total: int) -> List[int]:
+    """
+    Split a token budget across tables: every table gets an equal share,
+    and what small tables don't need goes to the larger ones
+    """
+    budgets = [0] * len(demands)
+    remaining = total
+    pending = sorted(range(len(demands)), key=lambda i: demands[i])
+    while pending:
+        share = remaining // len(pending)
+        index = pending.pop(0)
+        budgets[index] = min(demands[index], share)
+        remaining -= budgets[index]
+    return budgets
+
+
+def _is_blank(value) -> bool:
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value)
+
+
+def _cell_text(value, max_chars: int) -> str:
+    if _is_blank(value):
+        return ""
+    text = f"{value:g}" if isinstance(value, float) else str(value)
+    text = ' '.join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+class RowSampler:
+    """
+    Keeps the candidate rows of a table in one pass with bounded memory:
+    the head and tail, the first row of each value of low-cardinality
+    columns (strata), and the rows holding each numeric column's min and
+    max (outliers). render() picks from them by priority within a token
+    budget.
+    """
+
+    def __init__(self, head: int = HEAD_ROWS, tail: int = TAIL_ROWS, max_strata: int = MAX_STRATA):
+        self.head = head
+        self.max_strata = max_strata
+        self.row_count = 0
+        self._head: List[tuple] = []
+        self._tail: deque = deque(maxlen=tail)
+        # column -> {value: (index, row)}; None once the column has too many values
+        self._strata: Dict[int, Optional[dict]] = {}
+        self._string_keys: Dict[int, bool] = {}
+        # column -> (value, index, row)
+        self._mins: Dict[int, tuple] = {}
+        self._maxes: Dict[int, tuple] = {}
+
+    def add(self, index: int, row: Sequence):
+        """
+        Offer data row `index` (0-based); rows must come in index order
+        """
+        self.row_count = max(self.row_count, index + 1)
+        if index < self.head:
+            self._head.append((index, row))
+        self._tail.append((index, row))
+
+        for column, value in enumerate(row[:MAX_TRACKED_COLUMNS]):
+            if _is_blank(value):
+                continue
+            if _is_number(value):
+                if column not in self._mins or value < self._mins[column][0]:
+                    self._mins[column] = (value, index, row)
+                if column not in self._maxes or value > self._maxes[column][0]:
+                    self._maxes[column] = (value, index, row)
+            self._add_stratum(column, value, index, row)
+
+    def _add_stratum(self, column: int, value, index: int, row: Sequence):
+        strata = self._strata.get(column, {})
+        if strata is None:
+            return
+        if isinstance(value, float):
+            # Continuous values don't make categories
+            self._strata[column] = None
+            return
+        try:
+            if value in strata:
+                return
+        except TypeError:
+            self._strata[column] = None
+            return
+        if len(strata) >= self.max_strata:
+            self._strata[column] = None
+            return
+        strata[value] = (index, row)
+        self._strata[column] = strata
+        self._string_keys[column] = self._string_keys.get(column, True) and isinstance(value, str)
+
+    def add_frame(self, frame, start_index: int):
+        """
+        Offer a pandas chunk whose first row is data row start_index. Only the
+        rows that can become candidates are converted, so the result is the
+        same as adding every row.
+        """
+        import numpy as np
+        import pandas as pd
+
+        size = len(frame)
+        positions = set(range(min(size, max(0, self.head - start_index))))
+        positions.update(range(max(0, size - (self._tail.maxlen or 0)), size))
+        for column, name in enumerate(frame.columns[:MAX_TRACKED_COLUMNS]):
+            series = frame[name]
+            if self._strata.get(column, {}) is not None:
+                first_seen = np.flatnonzero(series.notna().to_numpy() & ~series.duplicated().to_numpy())
+                positions.update(first_seen[:self.max_strata + 1].tolist())
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series) and series.notna().any():
+                values = series.to_numpy(dtype=float, na_value=np.nan)
+                positions.add(int(np.nanargmin(values)))
+                positions.add(int(np.nanargmax(values)))
+
+        ordered = sorted(positions)
+        candidates = frame.iloc[ordered].astype(object)
+        rows = candidates.where(candidates.notna(), None).values.tolist()
+        for position, row in zip(ordered, rows):
+            self.add(start_index + position, row)
+        self.row_count = max(self.row_count, start_index + size)
+
+    def _key_column(self) -> Optional[int]:
+        """
+        The low-cardinality column that splits the rows into the fewest
+        groups, preferring text columns (codes, types, plants) over numbers
+        """
+        best = None
+        for column, strata in self._strata.items():
+            if strata is None or len(strata) < 2:
+                continue
+            rank = (self._string_keys.get(column, False), -len(strata), -column)
+            if best is None or rank > best[0]:
+                best = (rank, column)
+        return best[1] if best else None
+
+    def _ranked(self, columns: Sequence[str]) -> List[tuple]:
+        """
+        Candidates as (index, row, reason), most valuable first
+        """
+        tail = list(self._tail)
+        ranked = [(i, row, "first rows") for i, row in self._head[:HEAD_FIRST_ROWS]]
+        key_column = self._key_column()
+        if key_column is not None:
+            ranked += [
+                (i, row, f"one per {columns[key_column]} value")
+                for i, row in sorted(self._strata[key_column].values(), key=lambda entry: entry[0])
+            ]
+        for column in sorted(self._mins):
+            if self._mins[column][0] != self._maxes[column][0]:
+                ranked.append((self._mins[column][1], self._mins[column][2], "min/max values"))
+                ranked.append((self._maxes[column][1], self._maxes[column][2], "min/max values"))
+        ranked += [(i, row, "last rows") for i, row in tail[-TAIL_FIRST_ROWS:]]
+        ranked += [(i, row, "first rows") for i, row in self._head[HEAD_FIRST_ROWS:]]
+        ranked += [(i, row, "last rows") for i, row in tail[:-TAIL_FIRST_ROWS]]
+
+        seen = set()
+        unique = []
+        for entry in ranked:
+            if entry[0] not in seen:
+                seen.add(entry[0])
+                unique.append(entry)
+        return unique
+
+    def _layout(self, columns: Sequence[str], token_budget: int) -> tuple:
+        """
+        Columns shown and characters per cell, so that the header and at
+        least MIN_BUDGET_ROWS rows fit the budget
+        """
+        row_chars = max(1, token_budget * CHARS_PER_TOKEN // (MIN_BUDGET_ROWS + 1))
+        # Each cell also takes a separator
+        shown = min(len(columns), max(1, row_chars // (MIN_CELL_CHARS + 1)))
+        cell_chars = max(MIN_CELL_CHARS, min(MAX_CELL_CHARS, row_chars // max(1, shown) - 1))
+        return shown, cell_chars
+
+    def _render_rows(self, columns: Sequence[str], token_budget: int) -> tuple:
+        shown, cell_chars = self._layout(columns, token_budget)
+        header = ["row"] + [_cell_text(name, cell_chars) for name in columns[:shown]]
+        used = estimate_tokens(' '.join(header))
+        chosen = []
+        for index, row, reason in self._ranked(columns):
+            cells = [str(index + 1)] + [_cell_text(value, cell_chars) for value in list(row[:shown]) + [None] * (shown - len(row))]
+            cost = estimate_tokens(' '.join(cells))
+            if used + cost > token_budget:
+                break
+            used += cost
+            chosen.append((index, cells, reason))
+        return header, chosen, used, shown
+
+    def token_demand(self, columns: Sequence[str], token_budget: int) -> int:
+        """
+        Tokens all candidate rows would take (at most token_budget)
+        """
+        return self._render_rows(columns, token_budget)[2]
+
+    def render(self, columns: Sequence[str], token_budget: int) -> str:
+        if not columns or token_budget <= 0:
+            return ""
+        header, chosen, _, shown = self._render_rows(columns, token_budget)
+        if not chosen:
+            return ""
+        import pandas as pd
+
+        chosen.sort(key=lambda entry: entry[0])
+        reasons = list(dict.fromkeys(reason for _, _, reason in chosen))
+        text = f"Sample of {len(chosen)} of {self.row_count} rows ({', '.join(reasons)})"
+        if shown < len(columns):
+            text += f", first {shown} of {len(columns)} columns"
+        text += ":\n"
+        frame = pd.DataFrame([cells for _, cells, _ in chosen], columns=header)
+        return text + frame.to_string(index=False) + "\n\n"
@@ -0,0 +1,169 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from content_sampler import SAMPLE_TOKEN_BUDGET, RowSampler
+
+# Rows parsed per chunk; peak memory is proportional to this, not the file
+CHUNK_ROWS = 50_000
+# Size of the K-minimum-values sketch used for distinct-count estimates
+DISTINCT_SKETCH_SIZE = 1024
+# Candidate values tracked per column for the top-values list
+TOP_VALUE_CAPACITY = 200
+TOP_VALUES_SHOWN = 5
+
+_HASH_SPACE = float(2 ** 64)
+
+
+def merge_dtypes(current: Optional[str], chunk_dtype: str) -> str:
+    """
+    Combine per-chunk dtypes the way a single pandas read would have
+    """
+    if current is None or current == chunk_dtype:
+        return chunk_dtype
+    if {current, chunk_dtype} <= {"int64", "float64"}:
+        return "float64"
+    return "object"
+
+
+class ColumnProfile:
+    """
+    Running statistics for one column, updated a whole chunk at a time
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.non_null = 0
+        self.dtype: Optional[str] = None
+        self.min = None
+        self.max = None
+        self._sketch = np.empty(0, dtype=np.uint64)
+        self._top: Dict[object, int] = {}
+
+    def update(self, series: pd.Series):
+        self.dtype = merge_dtypes(self.dtype, str(series.dtype))
+        values = series.dropna()
+        self.non_null += len(values)
+        if values.empty:
+            return
+
+        if self.dtype not in ("int64", "float64"):
+            # Column turned out not to be numeric: min/max no longer meaningful
+            self.min = self.max = None
+        elif pd.api.types.is_numeric_dtype(values):
+            chunk_min, chunk_max = values.min(), values.max()
+            self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+            self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+        # Distinct count: keep the K smallest 64-bit hashes seen so far
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        merged = np.unique(np.concatenate([self._sketch, hashes]))
+        self._sketch = merged[:DISTINCT_SKETCH_SIZE]
+
+        # Top values: merge chunk counts, then keep only the heaviest candidates
+        for value, count in values.value_counts().head(TOP_VALUE_CAPACITY).items():
+            self._top[value] = self._top.get(value, 0) + int(count)
+        if len(self._top) > TOP_VALUE_CAPACITY:
+            self._top = dict(
+                sorted(self._top.items(), key=lambda item: item[1], reverse=True)[:TOP_VALUE_CAPACITY]
+            )
+
+    def distinct_estimate(self) -> int:
+        if len(self._sketch) < DISTINCT_SKETCH_SIZE:
+            return len(self._sketch)
+        kth_hash = float(self._sketch[-1])
+        return int((DISTINCT_SKETCH_SIZE - 1) * _HASH_SPACE / kth_hash)
+
+    def top_values(self, limit: int = TOP_VALUES_SHOWN) -> List[tuple]:
+        return sorted(self._top.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def dtype_for(self, row_count: int) -> str:
+        if self.dtype == "int64" and self.non_null < row_count:
+            return "float64"
+        return self.dtype or "object"
+
+
+def profile_csv(
+    path: str,
+    chunk_rows: int = CHUNK_ROWS,
+    snapshot_dir: Optional[str] = None
+) -> dict:
+    """
+    Profile a CSV file on disk in fixed-size chunks. With snapshot_dir, the
+    rows are also written there as an Arrow table in the same pass.
+    """
+    snapshot_table = None
+    if snapshot_dir:
+        from parsed_cache import SnapshotDirectory
+
+        snapshot_table = SnapshotDirectory(snapshot_dir).table()
+
+    columns: List[str] = []
+    profiles: List[ColumnProfile] = []
+    sampler = RowSampler()
+    row_count = 0
+
+    # The C parser reads the file through a memory map instead of buffered reads
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, memory_map=True):
+        if not profiles:
+            columns = [str(column) for column in chunk.columns]
+            profiles = [ColumnProfile(name) for name in columns]
+        sampler.add_frame(chunk, row_count)
+        for profile, column in zip(profiles, chunk.columns):
+            profile.update(chunk[column])
+        if snapshot_table is not None:
+            snapshot_table.write_frame(chunk)
+        row_count += len(chunk)
+
+    if snapshot_table is not None:
+        if snapshot_table.columns is None:
+            snapshot_table.write_header(columns)
+        snapshot_table.close()
+
+    return {
+        "columns": columns,
+        "row_count": row_count,
+        "sampler": sampler,
+        "profiles": profiles,
+    }
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:g}"
+    text = str(value)
+    return text if len(text) <= 40 else text[:37] + "..."
+
+
+def format_csv_summary(profile: dict, filename: str, token_budget: int = SAMPLE_TOKEN_BUDGET) -> str:
+    """
+    Render a CSV profile in the layout the analysis prompt uses, with
+    sample rows chosen to fit token_budget
+    """
+    columns = profile["columns"]
+    row_count = profile["row_count"]
+    csv_summary = f"CSV File: {filename}\n"
+    csv_summary += f"Columns ({len(columns)}): {', '.join(columns)}\n"
+    csv_summary += f"Rows: {row_count}\n\n"
+
+    # Representative rows: head, tail, one per category, min/max values
+    csv_summary += profile["sampler"].render(columns, token_budget)
+
+    # Column information
+    csv_summary += "Column information:\n"
+    for column in profile["profiles"]:
+        line = f"  - {column.name}: {column.dtype_for(row_count)}, {column.non_null}/{row_count} non-null values"
+        if column.min is not None:
+            line += f", min={_format_value(column.min)}, max={_format_value(column.max)}"
+        if column.non_null:
+            line += f", ~{column.distinct_estimate()} distinct"
+            top = ", ".join(f"{_format_value(value)} ({count})" for value, count in column.top_values())
+            line += f", top: {top}"
+        csv_summary += line + "\n"
+    csv_summary += "\n"
+    return csv_summary
+
+
+def summarize_csv_file(path: str, filename: str, snapshot_dir: Optional[str] = None) -> str:
+    return format_csv_summary(profile_csv(path, snapshot_dir=snapshot_dir), filename)
@@ -0,0 +1,223 @@
+from datetime import date, datetime
+from typing import Iterator, List, Optional, Sequence
+
+from content_sampler import SAMPLE_TOKEN_BUDGET, RowSampler, allocate_budget
+
+
+class ColumnStats:
+    """
+    Running per-column statistics built one cell at a time
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.non_null = 0
+        self.bools = 0
+        self.ints = 0
+        self.floats = 0
+        self.datetimes = 0
+        self.others = 0
+
+    def add(self, value):
+        if value is None or value == "":
+            return
+        self.non_null += 1
+        if isinstance(value, bool):
+            self.bools += 1
+        elif isinstance(value, int):
+            self.ints += 1
+        elif isinstance(value, float):
+            self.floats += 1
+        elif isinstance(value, (datetime, date)):
+            self.datetimes += 1
+        else:
+            self.others += 1
+
+    def dtype(self, row_count: int) -> str:
+        """
+        Infer the dtype pandas would have assigned to the full column
+        """
+        has_nulls = self.non_null < row_count
+        if self.non_null == 0:
+            return "float64"
+        if self.others:
+            return "object"
+        if self.datetimes == self.non_null:
+            return "datetime64[ns]"
+        if self.bools == self.non_null:
+            return "object" if has_nulls else "bool"
+        if self.bools or self.datetimes:
+            return "object"
+        if self.floats or has_nulls:
+            return "float64"
+        return "int64"
+
+
+def _column_name(value, index: int) -> str:
+    if value is None or value == "":
+        return f"Unnamed: {index}"
+    return str(value)
+
+
+def _is_blank(row: Sequence) -> bool:
+    return all(value is None or value == "" for value in row)
+
+
+def summarize_rows(rows: Iterator[Sequence]) -> dict:
+    """
+    Single pass over a sheet's rows (first row is the header).
+    Memory is bounded by the sampler's candidates, not the sheet size.
+    """
+    sampler = RowSampler()
+    header = next(rows, None)
+    if header is None:
+        return {"columns": [], "row_count": 0, "sampler": sampler, "dtypes": [], "non_null": []}
+
+    columns: List[str] = [_column_name(value, i) for i, value in enumerate(header)]
+    stats = [ColumnStats(name) for name in columns]
+    row_count = 0
+    # Blank rows only count once a non-blank row follows them
+    # (trailing blank rows are dropped, like pandas does)
+    pending_blank = 0
+
+    for row in rows:
+        if _is_blank(row):
+            pending_blank += 1
+            continue
+        row_count += pending_blank
+        pending_blank = 0
+
+        if len(row) > len(columns):
+            for i in range(len(columns), len(row)):
+                columns.append(_column_name(None, i))
+                stats.append(ColumnStats(columns[i]))
+        for column_stats, value in zip(stats, row):
+            column_stats.add(value)
+        sampler.add(row_count, row)
+        row_count += 1
+
+    return {
+        "columns": columns,
+        "row_count": row_count,
+        "sampler": sampler,
+        "dtypes": [column_stats.dtype(row_count) for column_stats in stats],
+        "non_null": [column_stats.non_null for column_stats in stats],
+    }
+
+
+def format_sheet_summary(summary: dict, token_budget: int = SAMPLE_TOKEN_BUDGET) -> str:
+    """
+    Render one sheet in the layout the analysis prompt uses, with sample
+    rows chosen to fit token_budget
+    """
+    columns = summary["columns"]
+    row_count = summary["row_count"]
+    text = f"Columns ({len(columns)}): {', '.join(columns)}\n"
+    text += f"Rows: {row_count}\n\n"
+    text += summary["sampler"].render(columns, token_budget)
+
+    # Show data types and sample values
+    text += "Column information:\n"
+    for name, dtype, non_null in zip(columns, summary["dtypes"], summary["non_null"]):
+        text += f"  - {name}: {dtype}, {non_null}/{row_count} non-null values\n"
+    text += "\n"
+    return text
+
+
+def _iter_xlsx_sheets(path: str) -> Iterator[tuple]:
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            yield worksheet.title, worksheet.iter_rows(values_only=True)
+    finally:
+        # Read-only workbooks keep the zip archive open until closed
+        workbook.close()
+
+
+def _xls_cell_value(cell, datemode: int):
+    import xlrd
+
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return None
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        try:
+            return xlrd.xldate.xldate_as_datetime(cell.value, datemode)
+        except Exception:
+            return cell.value
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    if cell.ctype == xlrd.XL_CELL_NUMBER and float(cell.value).is_integer():
+        return int(cell.value)
+    if cell.ctype == xlrd.XL_CELL_ERROR:
+        return None
+    return cell.value
+
+
+def _iter_xls_sheets(path: str) -> Iterator[tuple]:
+    import xlrd
+
+    # on_demand loads one sheet at a time instead of the whole workbook
+    workbook = xlrd.open_workbook(path, on_demand=True)
+    try:
+        for sheet_name in workbook.sheet_names():
+            sheet = workbook.sheet_by_name(sheet_name)
+            rows = (
+                [_xls_cell_value(cell, workbook.datemode) for cell in sheet.row(i)]
+                for i in range(sheet.nrows)
+            )
+            yield sheet_name, rows
+            workbook.unload_sheet(sheet_name)
+    finally:
+        workbook.release_resources()
+
+
+def iter_sheets(path: str, filename: str) -> Iterator[tuple]:
+    """
+    Yield (sheet_name, row iterator) for each sheet of a workbook on disk
+    """
+    if filename.lower().endswith('.xls'):
+        return _iter_xls_sheets(path)
+    return _iter_xlsx_sheets(path)
+
+
+def summarize_workbook(
+    path: str,
+    filename: str,
+    snapshot_dir: Optional[str] = None,
+    token_budget: int = SAMPLE_TOKEN_BUDGET
+) -> str:
+    """
+    Summarize every sheet of an Excel workbook without loading whole sheets.
+    Sample rows of all sheets share token_budget. With snapshot_dir, each
+    sheet is also written there as an Arrow table in the same pass.
+    """
+    snapshot = None
+    if snapshot_dir:
+        from parsed_cache import SnapshotDirectory, snapshot_rows
+
+        snapshot = SnapshotDirectory(snapshot_dir)
+
+    sheets = []
+    for sheet_name, rows in iter_sheets(path, filename):
+        rows = iter(rows)
+        if snapshot is not None:
+            rows = snapshot_rows(rows, snapshot.table())
+        sheets.append((sheet_name, summarize_rows(rows)))
+
+    # A sheet that needs less than an even share leaves the rest to the others
+    budgets = allocate_budget(
+        [summary["sampler"].token_demand(summary["columns"], token_budget) for _, summary in sheets],
+        token_budget
+    )
+    sheet_texts = [
+        f"=== Sheet: {sheet_name} ===\n" + format_sheet_summary(summary, budget)
+        for (sheet_name, summary), budget in zip(sheets, budgets)
+    ]
+
+    # Convert to readable text format
+    excel_summary = f"Excel File: {filename}\n"
+    excel_summary += f"Number of sheets: {len(sheet_texts)}\n\n"
+    excel_summary += "".join(sheet_texts)
+    return excel_summary
@@ -0,0 +1,215 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+import resource
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', str(os.cpu_count() or 2)))
+# Workers are replaced after (on average) this many tasks so parser memory
+# fragmentation can't build up
+EXTRACTION_MAX_TASKS_PER_CHILD = int(os.environ.get('EXTRACTION_MAX_TASKS_PER_CHILD', '20'))
+EXTRACTION_CPU_SECONDS = int(os.environ.get('EXTRACTION_CPU_SECONDS', '120'))
+EXTRACTION_MEMORY_MB = int(os.environ.get('EXTRACTION_MEMORY_MB', '4096'))
+
+# Extra CPU seconds past the soft limit before the kernel kills a worker stuck in native code
+CPU_HARD_LIMIT_GRACE_SECONDS = 10
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def _raise_cpu_exceeded(signum, frame):
+    raise ExtractionTimeout("Extraction exceeded its CPU time limit")
+
+
+def _lower_limit(limit: int, value: int):
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, value))
+
+
+def _init_worker(memory_bytes: int, cpu_hard_seconds: int):
+    """
+    Runs once in each worker process before it takes any task
+    """
+    # One thread per worker; parallelism comes from the pool
+    for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[variable] = '1'
+    if memory_bytes:
+        # Allocations past the limit raise MemoryError inside the task
+        _lower_limit(resource.RLIMIT_AS, memory_bytes)
+    # The soft CPU limit is moved per task; the hard limit caps the worker's
+    # whole lifetime (its pool is retired after a fixed number of tasks)
+    _lower_limit(resource.RLIMIT_CPU, cpu_hard_seconds)
+    signal.signal(signal.SIGXCPU, _raise_cpu_exceeded)
+
+
+def _cpu_time_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run_limited(cpu_seconds: int, fn: Callable, args: tuple):
+    """
+    Run one task in a worker with a soft CPU-time limit of cpu_seconds
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(_cpu_time_used()) + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+        return fn(*args)
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+class ExtractionPool:
+    """
+    Process pool for CPU-bound document parsing. Each task runs under CPU-time
+    and memory limits, workers are recycled after a fixed number of tasks, and
+    a pool broken by a crashed worker is replaced and the task retried once.
+
+    Recycling swaps in a fresh executor once the current one has taken
+    workers * max_tasks_per_child tasks; the old one finishes its queued work
+    and exits. (ProcessPoolExecutor's own max_tasks_per_child can deadlock
+    with a full queue on Python 3.11.)
+    """
+
+    def __init__(
+        self,
+        workers: int = EXTRACTION_WORKERS,
+        max_tasks_per_child: int = EXTRACTION_MAX_TASKS_PER_CHILD,
+        cpu_seconds: int = EXTRACTION_CPU_SECONDS,
+        memory_mb: int = EXTRACTION_MEMORY_MB
+    ):
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_tasks = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.recycles = 0
+
+    @property
+    def _tasks_per_executor(self) -> int:
+        return self.workers * self.max_tasks_per_child
+
+    def _build_executor(self) -> ProcessPoolExecutor:
+        self._executor_tasks = 0
+        cpu_hard_seconds = self._tasks_per_executor * self.cpu_seconds + CPU_HARD_LIMIT_GRACE_SECONDS
+        # spawn: workers don't inherit the server's event loop, threads or sockets
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.memory_bytes, cpu_hard_seconds)
+        )
+
+    def _next_executor(self) -> ProcessPoolExecutor:
+        """
+        Executor for the next task, retiring the current one once it has
+        taken its share of tasks
+        """
+        self.start()
+        if self._executor_tasks >= self._tasks_per_executor:
+            retired = self._executor
+            self._executor = self._build_executor()
+            # Already-submitted tasks still complete; its workers then exit
+            retired.shutdown(wait=False)
+            self.recycles += 1
+        self._executor_tasks += 1
+        return self._executor
+
+    def start(self):
+        if self._executor is None:
+            self._executor = self._build_executor()
+            logger.info(f"Extraction pool started with {self.workers} workers")
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _replace_broken(self, broken: ProcessPoolExecutor):
+        # Several tasks can see the same broken pool; only the first replaces it
+        if self._executor is broken:
+            logger.error("Extraction worker died; restarting the extraction pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._build_executor()
+            self.restarts += 1
+
+    async def run(self, fn: Callable, *args, cpu_seconds: Optional[int] = None):
+        """
+        Run fn(*args) on a worker process. fn and its arguments/result must be
+        picklable. Raises ExtractionTimeout when the task exceeds its CPU time.
+        """
+        loop = asyncio.get_running_loop()
+        limit = cpu_seconds or self.cpu_seconds
+        self.in_flight += 1
+        try:
+            for attempt in range(2):
+                executor = self._next_executor()
+                try:
+                    result = await loop.run_in_executor(executor, _run_limited, limit, fn, args)
+                    self.completed += 1
+                    return result
+                except BrokenProcessPool:
+                    self._replace_broken(executor)
+                    if attempt == 1:
+                        raise
+        except ExtractionTimeout:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": min(self.in_flight, self.workers),
+            "queued": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "recycles": self.recycles,
+            "max_tasks_per_child": self.max_tasks_per_child,
+            "cpu_seconds_per_task": self.cpu_seconds,
+            "memory_mb_per_worker": self.memory_bytes // (1024 * 1024),
+        }
+
+
+_pool: Optional[ExtractionPool] = None
+
+
+def get_extraction_pool() -> ExtractionPool:
+    global _pool
+    if _pool is None:
+        _pool = ExtractionPool()
+    return _pool
+
+
+def start_extraction_pool():
+    get_extraction_pool().start()
+
+
+def close_extraction_pool():
+    if _pool is not None:
+        _pool.close()
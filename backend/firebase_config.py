@@ -1,8 +1,22 @@
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
 import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
 from pathlib import Path
 
+import jwt
+from cryptography import x509
+
+from http_client import get_http_client
+from metrics import track_dependency
+
+logger = logging.getLogger(__name__)
+
 # Initialize Firebase Admin SDK
 def initialize_firebase():
     if not firebase_admin._apps:
@@ -24,19 +38,127 @@ firebase_app = initialize_firebase()
 def get_firestore_client():
     return firestore.client()
 
+# Google's public certificates for Firebase ID tokens
+ID_TOKEN_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+PROJECT_ID = firebase_app.project_id or 'asapio'
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+
+# sha256(token) -> (exp, user claims), least recently used first
+_token_cache: "OrderedDict[str, tuple]" = OrderedDict()
+# kid -> RSA public key
+_public_keys: dict = {}
+_key_refresh_task = None
+
+def _user_from_claims(decoded_token: dict) -> dict:
+    return {
+        "uid": decoded_token["uid"],
+        "email": decoded_token.get("email"),
+        "phone_number": decoded_token.get("phone_number"),
+        "email_verified": decoded_token.get("email_verified", False),
+        "provider_id": decoded_token.get("firebase", {}).get("sign_in_provider")
+    }
+
+def _cache_get(key: str):
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, user_data = entry
+    if expires_at <= time.time():
+        del _token_cache[key]
+        return None
+    _token_cache.move_to_end(key)
+    return user_data
+
+def _cache_put(key: str, expires_at: float, user_data: dict):
+    _token_cache[key] = (expires_at, user_data)
+    _token_cache.move_to_end(key)
+    while len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+
+async def refresh_public_keys() -> float:
+    """
+    Fetch Google's signing certificates and return how long they may be cached (seconds)
+    """
+    global _public_keys
+    with track_dependency('firebase_auth', 'fetch_public_keys'):
+        response = await get_http_client().get(ID_TOKEN_CERTS_URL)
+    response.raise_for_status()
+    _public_keys = {
+        kid: x509.load_pem_x509_certificate(pem.encode()).public_key()
+        for kid, pem in response.json().items()
+    }
+    match = re.search(r'max-age=(\d+)', response.headers.get('cache-control', ''))
+    return float(match.group(1)) if match else 3600.0
+
+async def _refresh_public_keys_forever():
+    while True:
+        try:
+            max_age = await refresh_public_keys()
+            # Refresh well before Google rotates the keys
+            delay = max(60.0, max_age * 0.8)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error refreshing Firebase public keys: {e}")
+            delay = 60.0
+        await asyncio.sleep(delay)
+
+async def start_token_key_refresh():
+    global _key_refresh_task
+    if _key_refresh_task is None:
+        _key_refresh_task = asyncio.create_task(_refresh_public_keys_forever())
+
+async def stop_token_key_refresh():
+    global _key_refresh_task
+    if _key_refresh_task is not None:
+        _key_refresh_task.cancel()
+        await asyncio.gather(_key_refresh_task, return_exceptions=True)
+        _key_refresh_task = None
+
+def _verify_locally(id_token: str, public_key) -> dict:
+    """
+    Verify an ID token with a cached public key, applying the same checks
+    as firebase_admin.auth.verify_id_token
+    """
+    decoded_token = jwt.decode(
+        id_token,
+        public_key,
+        algorithms=["RS256"],
+        audience=PROJECT_ID,
+        issuer=f"https://securetoken.google.com/{PROJECT_ID}",
+        options={"require": ["exp", "iat", "sub"]}
+    )
+    subject = decoded_token.get("sub")
+    if not isinstance(subject, str) or not subject or len(subject) > 128:
+        raise ValueError("Token has an invalid subject")
+    if decoded_token.get("auth_time", 0) > time.time():
+        raise ValueError("Token auth_time is in the future")
+    decoded_token["uid"] = subject
+    return decoded_token
+
 # Verify Firebase ID Token
 async def verify_firebase_token(id_token: str) -> dict:
     """
-    Verify Firebase ID token and return decoded claims
+    Verify Firebase ID token and return decoded claims.
+    Verified tokens are cached until they expire; verification itself runs
+    locally against the refreshed Google keys, falling back to the Admin SDK
+    (off the event loop) when the signing key is unknown.
     """
+    cache_key = hashlib.sha256(id_token.encode()).hexdigest()
+    user_data = _cache_get(cache_key)
+    if user_data is not None:
+        return user_data
+
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        return {
-            "uid": decoded_token["uid"],
-            "email": decoded_token.get("email"),
-            "phone_number": decoded_token.get("phone_number"),
-            "email_verified": decoded_token.get("email_verified", False),
-            "provider_id": decoded_token.get("firebase", {}).get("sign_in_provider")
-        }
+        public_key = _public_keys.get(jwt.get_unverified_header(id_token).get("kid"))
+        if public_key is not None:
+            decoded_token = _verify_locally(id_token, public_key)
+        else:
+            with track_dependency('firebase_auth', 'verify_id_token'):
+                decoded_token = await asyncio.to_thread(auth.verify_id_token, id_token)
+        user_data = _user_from_claims(decoded_token)
     except Exception as e:
-        raise ValueError(f"Invalid token: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Invalid token: {str(e)}")
+
+    _cache_put(cache_key, float(decoded_token["exp"]), user_data)
+    return user_data
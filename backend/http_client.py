@@ -0,0 +1,53 @@
+import os
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Shared outbound HTTP client (Firebase Storage, OpenAI).
+# Created on app startup and closed on shutdown so connections are pooled
+# and kept alive across requests instead of re-handshaking every call.
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(
+            float(os.environ.get('HTTP_TIMEOUT_SECONDS', '30')),
+            connect=10.0
+        ),
+        limits=httpx.Limits(
+            max_connections=int(os.environ.get('HTTP_MAX_CONNECTIONS', '100')),
+            max_keepalive_connections=int(os.environ.get('HTTP_MAX_KEEPALIVE', '20')),
+            keepalive_expiry=30.0
+        ),
+        follow_redirects=True
+    )
+
+
+async def start_http_client():
+    global _client
+    if _client is None:
+        _client = _build_client()
+        logger.info("Shared HTTP client started")
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the shared HTTP client (lazily created outside the app lifecycle,
+    e.g. in scripts)
+    """
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
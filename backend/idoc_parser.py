@@ -0,0 +1,251 @@
+import io
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Dict, IO, Iterable, List, Optional
+
+from storage import open_mapped
+
+# Fixed-width layout of flat-file IDoc records (SAP EDI_DC40 / EDI_DD40)
+CONTROL_RECORD_FIELDS = {
+    'DOCNUM': (13, 29),
+    'IDOCTYP': (39, 69),
+    'CIMTYP': (69, 99),
+    'MESTYP': (99, 129),
+    'SNDPOR': (148, 158),
+    'SNDPRT': (158, 160),
+    'SNDPRN': (162, 172),
+    'RCVPOR': (263, 273),
+    'RCVPRT': (273, 275),
+    'RCVPRN': (277, 287),
+}
+DATA_SEGNAM = (0, 30)
+DATA_HLEVEL = (61, 63)
+DATA_SDATA = (63, 1063)
+
+# Control record fields summarized in the digest
+CONTROL_SUMMARY_FIELDS = ['IDOCTYP', 'CIMTYP', 'MESTYP', 'SNDPOR', 'SNDPRT', 'SNDPRN', 'RCVPOR', 'RCVPRT', 'RCVPRN']
+
+SAMPLES_PER_SEGMENT = 2
+MAX_DISTINCT_CONTROL_VALUES = 20
+SAMPLE_VALUE_CHARS = 200
+
+# Leading bytes of a stored file inspected to recognize an IDoc
+IDOC_SNIFF_BYTES = 4096
+# An IDOC or EDI_DC40 element (optionally namespaced), not fields like IDOCTYP
+_XML_IDOC_ELEMENT = re.compile(r'<(?:[\w.-]+:)?(?:IDOC|EDI_DC40)[\s/>]')
+
+
+class SegmentStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.parents: Counter = Counter()
+        self.levels: Counter = Counter()
+        self.field_fills: Counter = Counter()
+        self.field_seen: Counter = Counter()
+        self.filled_chars = 0
+        self.samples: List = []
+
+    def add(self, parent: Optional[str], level: Optional[int], fields: Dict[str, str], raw: Optional[str] = None):
+        self.count += 1
+        self.parents[parent or '(root)'] += 1
+        if level is not None:
+            self.levels[level] += 1
+        for field, value in fields.items():
+            self.field_seen[field] += 1
+            if value:
+                self.field_fills[field] += 1
+        if raw is not None:
+            self.filled_chars += len(raw)
+        if len(self.samples) < SAMPLES_PER_SEGMENT:
+            if raw is not None:
+                self.samples.append(raw[:SAMPLE_VALUE_CHARS])
+            else:
+                self.samples.append({k: v[:60] for k, v in fields.items() if v})
+
+
+class IdocDigest:
+    """
+    Compact structural summary of one or more IDocs, built in a single pass
+    """
+
+    def __init__(self, source_format: str):
+        self.format = source_format
+        self.idoc_count = 0
+        self.control_values: Dict[str, Counter] = {field: Counter() for field in CONTROL_SUMMARY_FIELDS}
+        self.segments: Dict[str, SegmentStats] = {}
+
+    def add_control(self, fields: Dict[str, str]):
+        self.idoc_count += 1
+        for field in CONTROL_SUMMARY_FIELDS:
+            value = fields.get(field)
+            counter = self.control_values[field]
+            if value and (value in counter or len(counter) < MAX_DISTINCT_CONTROL_VALUES):
+                counter[value] += 1
+
+    def segment(self, name: str) -> SegmentStats:
+        stats = self.segments.get(name)
+        if stats is None:
+            stats = self.segments[name] = SegmentStats(name)
+        return stats
+
+
+def _slice(record: str, bounds: tuple) -> str:
+    return record[bounds[0]:bounds[1]].strip()
+
+
+def parse_flat_idoc(lines: Iterable[str]) -> IdocDigest:
+    """
+    Parse flat-file IDoc records line by line by fixed-width slicing
+    """
+    digest = IdocDigest('flat')
+    # Most recent segment seen at each hierarchy level, to resolve parents
+    open_segments: Dict[int, str] = {}
+
+    for line in lines:
+        record = line.rstrip('\r\n')
+        if not record.strip():
+            continue
+        if record.startswith('EDI_DC40'):
+            digest.add_control({field: _slice(record, bounds) for field, bounds in CONTROL_RECORD_FIELDS.items()})
+            open_segments = {}
+            continue
+
+        name = _slice(record, DATA_SEGNAM)
+        hlevel_text = _slice(record, DATA_HLEVEL)
+        level = int(hlevel_text) if hlevel_text.isdigit() else None
+        parent = open_segments.get(level - 1) if level else None
+        if level is not None:
+            open_segments[level] = name
+            for deeper in [key for key in open_segments if key > level]:
+                del open_segments[deeper]
+
+        sdata = record[DATA_SDATA[0]:DATA_SDATA[1]].rstrip()
+        # Field layout of SDATA is segment-specific; report the populated payload
+        digest.segment(name).add(parent, level, {}, raw=' '.join(sdata.split()))
+
+    return digest
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _is_segment(element) -> bool:
+    return _local_name(element.tag) == 'EDI_DC40' or element.get('SEGMENT') is not None
+
+
+def parse_xml_idoc(source: IO[bytes]) -> IdocDigest:
+    """
+    Parse IDoc-XML incrementally; each segment element is detached and
+    cleared once summarized, so memory doesn't grow with document size
+    """
+    digest = IdocDigest('xml')
+    # Open elements, outermost first
+    stack: list = []
+    segment_depth = 0
+
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            if _is_segment(element):
+                segment_depth += 1
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        tag = _local_name(element.tag)
+
+        if _is_segment(element):
+            segment_depth -= 1
+            # Fields are the leaf children of a segment element
+            # (child segments were already detached when they ended)
+            fields = {_local_name(child.tag): (child.text or '').strip() for child in element}
+            if tag == 'EDI_DC40':
+                digest.add_control(fields)
+            else:
+                parent_segment = None
+                if parent is not None and _is_segment(parent) and _local_name(parent.tag) != 'EDI_DC40':
+                    parent_segment = _local_name(parent.tag)
+                digest.segment(tag).add(parent_segment, segment_depth + 1, fields)
+        elif tag != 'IDOC':
+            # Field elements stay attached until their segment is summarized
+            continue
+
+        element.clear()
+        if parent is not None:
+            parent.remove(element)
+
+    return digest
+
+
+def is_idoc_content(head: str) -> bool:
+    """
+    Recognize an IDoc by its structure in the start of a document: a flat
+    control record line (EDI_DC40) or an IDOC / EDI_DC40 element
+    """
+    head = head.lstrip('\ufeff')
+    if any(line.startswith('EDI_DC40') for line in head.splitlines()):
+        return True
+    return _XML_IDOC_ELEMENT.search(head) is not None
+
+
+def read_head(path: str, size: int = IDOC_SNIFF_BYTES) -> str:
+    with open(path, 'rb') as source:
+        return source.read(size).decode('utf-8', errors='replace')
+
+
+def parse_idoc_file(path: str) -> IdocDigest:
+    """
+    Parse an IDoc file on disk (memory-mapped), detecting flat vs XML format
+    """
+    with open_mapped(path) as source:
+        head = source.read(512).lstrip(b'\xef\xbb\xbf').lstrip()
+        source.seek(0)
+        if head.startswith(b'<'):
+            return parse_xml_idoc(source)
+        return parse_flat_idoc(
+            line.decode('utf-8', errors='replace') for line in iter(source.readline, b'')
+        )
+
+
+def parse_idoc_text(text: str) -> IdocDigest:
+    if text.lstrip().startswith('<'):
+        return parse_xml_idoc(io.BytesIO(text.encode('utf-8')))
+    return parse_flat_idoc(io.StringIO(text))
+
+
+def format_idoc_digest(digest: IdocDigest, filename: str) -> str:
+    """
+    Render the digest as the compact text sent to the model
+    """
+    text = f"IDoc File: {filename}\n"
+    text += f"Format: {'IDoc-XML' if digest.format == 'xml' else 'flat file'}\n"
+    text += f"IDocs: {digest.idoc_count}\n"
+    text += f"Segment types: {len(digest.segments)}, segments: {sum(s.count for s in digest.segments.values())}\n\n"
+
+    text += "Control records (EDI_DC40):\n"
+    for field, counter in digest.control_values.items():
+        if counter:
+            values = ", ".join(f"{value} ({count})" for value, count in counter.most_common(5))
+            text += f"  - {field}: {values}\n"
+    text += "\n"
+
+    text += "Segments:\n"
+    for stats in digest.segments.values():
+        parents = ", ".join(parent for parent, _ in stats.parents.most_common(3))
+        levels = "/".join(str(level) for level in sorted(stats.levels))
+        text += f"=== {stats.name}: {stats.count} occurrences, parent: {parents}"
+        text += f", level {levels}\n" if levels else "\n"
+        if stats.field_seen:
+            fill_rates = ", ".join(
+                f"{field} {100 * stats.field_fills[field] // stats.count}%"
+                for field in stats.field_seen
+            )
+            text += f"  Field fill rates: {fill_rates}\n"
+        elif stats.count:
+            text += f"  Average populated data length: {stats.filled_chars // stats.count} chars\n"
+        for sample in stats.samples:
+            text += f"  Sample: {sample}\n"
+    return text
@@ -0,0 +1,252 @@
+import os
+import socket
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+
+from tracing import current_trace_id, start_trace
+
+logger = logging.getLogger(__name__)
+
+# Job lifecycle states (stored in the analysis_jobs collection)
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# A running job is owned by its worker until lease_until; the lease is renewed
+# every third of this while the job runs
+JOB_LEASE_SECONDS = float(os.environ.get('ANALYSIS_JOB_LEASE_SECONDS', '60'))
+
+
+class AnalysisJobQueue:
+    """
+    Persistent analysis job queue backed by MongoDB with a bounded pool of
+    asyncio workers. A running job holds a lease renewed by its worker;
+    jobs whose lease expired (their process died) are claimed again by any
+    queue, so jobs still running in other processes are left alone.
+    """
+
+    def __init__(
+        self,
+        database,
+        handler: Callable[[dict], Awaitable[None]],
+        on_failed: Optional[Callable[[dict, str], Awaitable[None]]] = None,
+        concurrency: int = 4,
+        poll_interval: float = 2.0,
+        max_attempts: int = 3,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+    ):
+        self.collection = database.analysis_jobs
+        self.handler = handler
+        self.on_failed = on_failed
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        # Owner of the leases taken by this process
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._workers = []
+        self._stopping = False
+
+    async def start(self):
+        """
+        Ensure indexes and spawn the workers (interrupted jobs are claimed
+        again once their lease expires)
+        """
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("status", 1), ("created_at", 1)])
+        await self.collection.create_index([("status", 1), ("lease_until", 1)])
+
+        self._stopping = False
+        self._workers = [
+            asyncio.create_task(self._worker(n)) for n in range(self.concurrency)
+        ]
+        self._wakeup.set()
+        logger.info(f"Analysis job queue started with {self.concurrency} workers")
+
+    async def stop(self):
+        """
+        Cancel the workers and hand their in-flight jobs back to the queue,
+        without counting the interrupted attempt
+        """
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(self, upload_id: str, user_id: str, payload: dict, job_id: Optional[str] = None) -> dict:
+        """
+        Persist a new job and wake an idle worker
+        """
+        job = {
+            "id": job_id or str(uuid.uuid4()),
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "payload": payload,
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "error": None,
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+            "worker_id": None,
+            "lease_until": None,
+            # Links the job's own trace to the request that queued it
+            "trace_id": current_trace_id(),
+        }
+        await self.collection.insert_one(dict(job))
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str, user_id: str) -> Optional[dict]:
+        return await self.collection.find_one(
+            {"id": job_id, "user_id": user_id},
+            {"_id": 0, "payload": 0}
+        )
+
+    async def _claim(self) -> Optional[dict]:
+        """
+        Take the oldest queued job, or a running job whose lease expired
+        (running jobs without a lease predate leases)
+        """
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": JOB_QUEUED},
+                {"status": JOB_RUNNING, "lease_until": {"$lt": now}},
+                {"status": JOB_RUNNING, "lease_until": None},
+            ]},
+            {
+                "$set": {
+                    "status": JOB_RUNNING,
+                    "started_at": now,
+                    "worker_id": self.worker_id,
+                    "lease_until": now + timedelta(seconds=self.lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _owned(self, job: dict) -> dict:
+        return {"id": job["id"], "worker_id": self.worker_id, "status": JOB_RUNNING}
+
+    @asynccontextmanager
+    async def _hold_lease(self, job: dict):
+        """
+        Renew the job's lease while the body runs
+        """
+        async def renew():
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                try:
+                    renewed = await self.collection.update_one(
+                        self._owned(job),
+                        {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+                    )
+                    if not renewed.matched_count:
+                        logger.warning(f"Lost the lease on analysis job {job['id']}")
+                        return
+                except Exception as e:
+                    logger.error(f"Could not renew the lease on analysis job {job['id']}: {e}")
+
+        renewer = asyncio.create_task(renew())
+        try:
+            yield
+        finally:
+            renewer.cancel()
+
+    async def _release(self, job: dict, count_attempt: bool = True):
+        """
+        Put a job this process holds back on the queue
+        """
+        update = {"$set": {"status": JOB_QUEUED, "started_at": None, "worker_id": None, "lease_until": None}}
+        if not count_attempt:
+            update["$inc"] = {"attempts": -1}
+        try:
+            await self.collection.update_one(self._owned(job), update)
+        except Exception as e:
+            # The lease expires and the job is claimed again anyway
+            logger.error(f"Could not re-queue analysis job {job['id']}: {e}")
+
+    async def _finish(self, job: dict, status: str, error: Optional[str] = None) -> bool:
+        """
+        Record the outcome, unless the lease was lost to another worker
+        """
+        result = await self.collection.update_one(
+            self._owned(job),
+            {"$set": {
+                "status": status,
+                "error": error,
+                "finished_at": datetime.utcnow(),
+                "lease_until": None
+            }}
+        )
+        if not result.matched_count:
+            logger.warning(f"Analysis job {job['id']} was taken over by another worker; outcome not recorded")
+        return bool(result.matched_count)
+
+    async def _fail(self, job: dict, error: str):
+        try:
+            if await self._finish(job, JOB_FAILED, error) and self.on_failed:
+                await self.on_failed(job, error)
+        except Exception as db_error:
+            logger.error(f"Error recording job failure: {db_error}")
+
+    async def _worker(self, worker_id: int):
+        while not self._stopping:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} could not claim a job: {e}")
+                job = None
+
+            if job is None:
+                # Idle: sleep until a local enqueue or the next poll tick
+                # (the poll picks up jobs enqueued by other processes)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if job.get("attempts", 1) > self.max_attempts:
+                logger.error(f"Analysis job {job['id']} exceeded {self.max_attempts} attempts")
+                await self._fail(job, "Maximum attempts exceeded")
+                continue
+
+            try:
+                async with self._hold_lease(job):
+                    with start_trace(
+                        "analysis_job",
+                        job_id=job["id"],
+                        upload_id=job["upload_id"],
+                        attempt=job.get("attempts", 1),
+                        enqueued_by_trace=job.get("trace_id")
+                    ):
+                        await self.handler(job)
+                    await self._finish(job, JOB_COMPLETED)
+            except asyncio.CancelledError:
+                if self._stopping:
+                    # Hand the job back without counting this attempt
+                    await self._release(job, count_attempt=False)
+                    raise
+                # Raised inside the handler (e.g. a shared call it waited on was
+                # cancelled): retry the job and keep the worker running
+                logger.warning(f"Analysis job {job['id']} was cancelled; re-queueing it")
+                await self._release(job)
+            except Exception as e:
+                logger.error(f"Analysis job {job['id']} failed: {e}", exc_info=True)
+                await self._fail(job, str(e))
@@ -0,0 +1,401 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+
+from http_client import get_http_client
+from admission import get_admission_controller
+from metrics import llm_tokens, track_dependency
+
+logger = logging.getLogger(__name__)
+
+# Overridable to point at a compatible endpoint (e.g. the benchmark stub)
+OPENAI_CHAT_URL = os.environ.get('OPENAI_CHAT_URL', 'https://api.openai.com/v1/chat/completions')
+
+# 'openai' or 'stub' (canned local responses, for tests and load runs)
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'openai')
+# One attempt holds a model slot for at most LLM_TIMEOUT_SECONDS (for streams:
+# without a new byte); all attempts and backoff of one call end by the deadline
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '60'))
+LLM_CALL_DEADLINE_SECONDS = float(os.environ.get('LLM_CALL_DEADLINE_SECONDS', '150'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '4'))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get('LLM_BACKOFF_BASE_SECONDS', '0.5'))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get('LLM_BACKOFF_MAX_SECONDS', '30'))
+# Consecutive upstream failures that open the circuit, and how long it stays open
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))
+LLM_CIRCUIT_RESET_SECONDS = float(os.environ.get('LLM_CIRCUIT_RESET_SECONDS', '30'))
+LLM_STUB_LATENCY_SECONDS = float(os.environ.get('LLM_STUB_LATENCY_SECONDS', '0'))
+
+# Longest Retry-After we'll sleep for before giving up on a call
+MAX_RETRY_AFTER_SECONDS = 60.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RetryableLLMError(LLMError):
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message, status_code)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMError):
+    pass
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Seconds to wait from retry-after-ms / Retry-After (seconds or HTTP date)
+    """
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures and fails
+    calls fast for `reset_seconds`; then lets a single probe call through
+    (half-open) and closes again once one succeeds
+    """
+
+    def __init__(self, failure_threshold: int = LLM_CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = LLM_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # When the half-open probe started; a probe that never reports back
+        # (e.g. cancelled) is superseded after reset_seconds
+        self._probe_started: Optional[float] = None
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    @property
+    def _probing(self) -> bool:
+        return self._probe_started is not None and time.monotonic() - self._probe_started < self.reset_seconds
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+            raise CircuitOpenError(f"Model provider unavailable; retry in {retry_in:.0f}s", status_code=503)
+        if state == "half_open":
+            self._probe_started = time.monotonic()
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_started is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probe_started is not None:
+                self.times_opened += 1
+                logger.error(f"Model provider circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+
+
+class OpenAIProvider:
+    requires_api_key = True
+
+    def _headers(self, api_key: str) -> dict:
+        return {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json',
+        }
+
+    @staticmethod
+    def _error(response: httpx.Response) -> LLMError:
+        message = f"OpenAI API error: {response.status_code}"
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            return RetryableLLMError(message, response.status_code, parse_retry_after(response.headers))
+        return LLMError(message, response.status_code)
+
+    @staticmethod
+    def _malformed(error: Exception) -> LLMError:
+        # A 200 we can't read is an upstream fault like a 5xx
+        return RetryableLLMError(f"OpenAI API returned a malformed response: {type(error).__name__}: {error}")
+
+    async def complete(self, request_body: dict, api_key: str) -> Tuple[str, dict]:
+        response = await get_http_client().post(
+            OPENAI_CHAT_URL,
+            headers=self._headers(api_key),
+            json=request_body,
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0)
+        )
+        if response.status_code != 200:
+            raise self._error(response)
+        try:
+            body = response.json()
+            return body['choices'][0]['message']['content'], body.get('usage') or {}
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise self._malformed(e)
+
+    async def stream(self, request_body: dict, api_key: str, usage: dict) -> AsyncIterator[str]:
+        async with get_http_client().stream(
+            "POST",
+            OPENAI_CHAT_URL,
+            headers=self._headers(api_key),
+            json={**request_body, 'stream': True, 'stream_options': {'include_usage': True}},
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0)
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise self._error(response)
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    event = json.loads(data)
+                    # The final event carries token usage and no choices
+                    if event.get('usage'):
+                        usage.update(event['usage'])
+                    choices = event.get('choices') or []
+                    delta = choices[0].get('delta', {}).get('content') if choices else None
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    raise self._malformed(e)
+                if delta:
+                    yield delta
+
+
+class StubProvider:
+    """
+    Deterministic local responses, so the pipeline can run without OpenAI
+    """
+
+    requires_api_key = False
+
+    def _response(self, request_body: dict) -> str:
+        prompt = request_body['messages'][-1]['content']
+        return f"Stub analysis ({len(prompt)} prompt characters).\n\n{prompt[:200]}"
+
+    async def complete(self, request_body: dict, api_key: str) -> Tuple[str, dict]:
+        if LLM_STUB_LATENCY_SECONDS:
+            await asyncio.sleep(LLM_STUB_LATENCY_SECONDS)
+        text = self._response(request_body)
+        prompt_chars = sum(len(message['content']) for message in request_body['messages'])
+        return text, {'prompt_tokens': prompt_chars // 4, 'completion_tokens': len(text) // 4}
+
+    async def stream(self, request_body: dict, api_key: str, usage: dict) -> AsyncIterator[str]:
+        text, call_usage = await self.complete(request_body, api_key)
+        usage.update(call_usage)
+        for word in text.split(' '):
+            yield word + ' '
+
+
+class LLMClient:
+    """
+    Chat completions with retries (jittered exponential backoff that honors
+    Retry-After) within an overall deadline per call, a circuit breaker, the global admission slot per attempt,
+    and per-call latency/token accounting
+    """
+
+    def __init__(
+        self,
+        provider,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+        backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+        breaker: Optional[CircuitBreaker] = None,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        deadline: float = LLM_CALL_DEADLINE_SECONDS
+    ):
+        self.provider = provider
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def requires_api_key(self) -> bool:
+        return self.provider.requires_api_key
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter spreads retries from many callers out over the window
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after + random.uniform(0, self.backoff_base))
+        return delay
+
+    def _account(self, started: float, usage: dict, model: str):
+        latency = time.monotonic() - started
+        self.calls += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.prompt_tokens += usage.get('prompt_tokens', 0)
+        self.completion_tokens += usage.get('completion_tokens', 0)
+        llm_tokens.inc('prompt', amount=usage.get('prompt_tokens', 0))
+        llm_tokens.inc('completion', amount=usage.get('completion_tokens', 0))
+        logger.info(
+            f"Model call to {model} took {latency:.2f}s, "
+            f"tokens: {usage.get('prompt_tokens', '?')} prompt / {usage.get('completion_tokens', '?')} completion"
+        )
+
+    async def _wait_before_retry(self, attempt: int, error: RetryableLLMError, deadline: float) -> bool:
+        """
+        Sleep before the next attempt; False when the call should give up
+        """
+        if attempt >= self.max_retries:
+            return False
+        if error.retry_after is not None and error.retry_after > MAX_RETRY_AFTER_SECONDS:
+            return False
+        delay = self._backoff(attempt, error.retry_after)
+        if time.monotonic() + delay >= deadline:
+            logger.warning(f"{error}; not retrying past the {self.deadline:.0f}s call deadline")
+            return False
+        self.retries += 1
+        logger.warning(f"{error}; retrying in {delay:.1f}s (attempt {attempt + 2} of {self.max_retries + 1})")
+        await asyncio.sleep(delay)
+        return True
+
+    @staticmethod
+    def _as_retryable(error: Exception) -> RetryableLLMError:
+        if isinstance(error, RetryableLLMError):
+            return error
+        return RetryableLLMError(f"Model provider request failed: {type(error).__name__}: {error}")
+
+    async def complete(self, request_body: dict, api_key: str = '') -> str:
+        attempt = 0
+        deadline = time.monotonic() + self.deadline
+        while True:
+            self.breaker.before_call()
+            started = time.monotonic()
+            try:
+                # The slot is released while backing off
+                async with get_admission_controller().llm_slot():
+                    with track_dependency('llm', 'complete'):
+                        # Bounds the whole attempt, not just each read
+                        text, usage = await asyncio.wait_for(
+                            self.provider.complete(request_body, api_key),
+                            timeout=max(1.0, min(self.timeout, deadline - time.monotonic()))
+                        )
+            except (RetryableLLMError, httpx.TransportError, asyncio.TimeoutError) as error:
+                retryable = self._as_retryable(error)
+                self.breaker.record_failure()
+                if not await self._wait_before_retry(attempt, retryable, deadline):
+                    self.failures += 1
+                    raise retryable
+                attempt += 1
+                continue
+            except LLMError:
+                # Upstream answered (e.g. 400): not an availability failure
+                self.breaker.record_success()
+                self.failures += 1
+                raise
+            self.breaker.record_success()
+            self._account(started, usage, request_body.get('model', ''))
+            return text
+
+    async def stream(self, request_body: dict, api_key: str = '') -> AsyncIterator[str]:
+        """
+        Yield content deltas as they arrive. Failures before the first delta
+        are retried like complete(); once text has been sent they propagate.
+        Closing the generator closes the upstream connection.
+        """
+        attempt = 0
+        deadline = time.monotonic() + self.deadline
+        while True:
+            self.breaker.before_call()
+            started = time.monotonic()
+            usage: dict = {}
+            yielded = False
+            try:
+                # The slot is held until the stream ends
+                async with get_admission_controller().llm_slot():
+                    with track_dependency('llm', 'stream'):
+                        async for delta in self.provider.stream(request_body, api_key, usage):
+                            yielded = True
+                            yield delta
+            except (RetryableLLMError, httpx.TransportError) as error:
+                retryable = self._as_retryable(error)
+                self.breaker.record_failure()
+                if yielded or not await self._wait_before_retry(attempt, retryable, deadline):
+                    self.failures += 1
+                    raise retryable
+                attempt += 1
+                continue
+            except LLMError:
+                # Upstream answered (e.g. 400): not an availability failure
+                self.breaker.record_success()
+                self.failures += 1
+                raise
+            self.breaker.record_success()
+            self._account(started, usage, request_body.get('model', ''))
+            return
+
+    def stats(self) -> dict:
+        return {
+            "provider": type(self.provider).__name__,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "average_latency_seconds": round(self.latency_total / self.calls, 3) if self.calls else None,
+            "max_latency_seconds": round(self.latency_max, 3),
+        }
+
+
+PROVIDERS = {
+    'openai': OpenAIProvider,
+    'stub': StubProvider,
+}
+
+_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    global _client
+    if _client is None:
+        provider = PROVIDERS.get(LLM_PROVIDER)
+        if provider is None:
+            raise ValueError(f"Unknown LLM_PROVIDER '{LLM_PROVIDER}' (expected one of: {', '.join(PROVIDERS)})")
+        _client = LLMClient(provider())
+    return _client
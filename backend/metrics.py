@@ -0,0 +1,265 @@
+import time
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, List, Sequence, Tuple
+
+from tracing import route_template, span
+
+# Latency buckets in seconds; wide enough for model calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# All metrics are updated from the event loop; plain dict updates, no locks.
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+
+class CallbackGauge(Metric):
+    """
+    Gauge read from a callback at scrape time (e.g. queue depths); the
+    callback returns a number, or {label values tuple: number}
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback: Callable, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(float(value))}"
+            for labels, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_duration = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ['method', 'route', 'status']
+))
+http_requests_in_flight = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served'
+))
+dependency_call_duration = REGISTRY.register(Histogram(
+    'dependency_call_duration_seconds',
+    'Latency of calls to MongoDB, Firestore, Firebase Auth, file storage and the model provider',
+    ['dependency', 'operation', 'outcome']
+))
+dependency_calls_in_flight = REGISTRY.register(Gauge(
+    'dependency_calls_in_flight', 'Dependency calls currently in progress', ['dependency']
+))
+download_bytes = REGISTRY.register(Counter(
+    'download_bytes_total', 'Bytes downloaded from file storage', ['source']
+))
+llm_tokens = REGISTRY.register(Counter(
+    'llm_tokens_total', 'Model tokens used', ['kind']
+))
+parse_duration = REGISTRY.register(Histogram(
+    'document_parse_duration_seconds', 'Document extraction time by file type', ['file_type']
+))
+
+
+def register_gauge(name: str, help_text: str, callback: Callable, labelnames: Sequence[str] = ()):
+    REGISTRY.register(CallbackGauge(name, help_text, callback, labelnames))
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str):
+    """
+    Time one dependency call and count it as in flight while it runs;
+    also a span of the current trace
+    """
+    dependency_calls_in_flight.inc(dependency)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(f"{dependency}.{operation}"):
+            yield
+        outcome = "ok"
+    finally:
+        dependency_calls_in_flight.dec(dependency)
+        dependency_call_duration.observe(time.perf_counter() - started, dependency, operation, outcome)
+
+
+@contextmanager
+def track_parse(file_type: str):
+    """
+    Time one document extraction, as a metric and a span
+    """
+    with parse_duration.time(file_type), span("parse", file_type=file_type):
+        yield
+
+
+def timed_dependency(dependency: str, operation: str = None):
+    """
+    Decorator form of track_dependency for async functions/methods
+    """
+    def decorator(fn):
+        name = operation or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with track_dependency(dependency, name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def count_bytes(chunks: AsyncIterator[bytes], source: str) -> AsyncIterator[bytes]:
+    """
+    Pass a byte stream through, adding its size to download_bytes_total
+    """
+    async for chunk in chunks:
+        download_bytes.inc(source, amount=len(chunk))
+        yield chunk
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+class MetricsMiddleware:
+    """
+    Records latency per route template (not raw path, to keep label
+    cardinality bounded) and the number of requests in flight. Streaming
+    responses are timed until their last byte is sent.
+    """
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/api/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            http_request_duration.observe(
+                time.perf_counter() - started, scope["method"], route_template(scope), str(status)
+            )
@@ -0,0 +1,276 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+PARSED_CACHE_DIR = Path(
+    os.environ.get('PARSED_CACHE_DIR', str(Path(__file__).parent / 'parsed_cache'))
+)
+PARSED_CACHE_MAX_BYTES = int(os.environ.get('PARSED_CACHE_MAX_MB', '2048')) * 1024 * 1024
+
+PROFILE_FILE = 'profile.txt'
+TABLE_SUFFIX = '.arrow'
+# Rows per Arrow record batch (and rows buffered to settle a sheet's width)
+BATCH_ROWS = 10000
+
+
+def snapshot_key(upload: dict) -> str:
+    """
+    Cache key for an upload: its id plus the content hash, or, for files that
+    were never hashed (Firebase Storage only), a hash of the storage URL
+    """
+    content_hash = upload.get('content_hash')
+    if not content_hash:
+        content_hash = hashlib.sha256((upload.get('file_path') or '').encode('utf-8')).hexdigest()
+    return f"{upload['id']}-{content_hash[:16]}"
+
+
+def _as_string(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+class TableSnapshotWriter:
+    """
+    Streams one sheet's rows into an uncompressed Arrow IPC file, every
+    column stored as strings. Runs inside the extraction worker.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.columns: Optional[List[str]] = None
+        self._pending: List[Sequence] = []
+        self._schema: Optional[pa.Schema] = None
+        self._writer = None
+
+    def write_header(self, columns: Sequence):
+        self.columns = [str(column) for column in columns]
+
+    def write_row(self, row: Sequence):
+        self._pending.append(row)
+        if len(self._pending) >= BATCH_ROWS:
+            self._flush()
+
+    def write_frame(self, frame):
+        """
+        Append a pandas DataFrame chunk (CSV)
+        """
+        if self.columns is None:
+            self.write_header(frame.columns)
+        strings = frame.astype('string')
+        self._write_batch([
+            pa.array(strings[column], type=pa.string(), from_pandas=True)
+            for column in strings.columns
+        ])
+
+    def _flush(self):
+        if not self._pending:
+            return
+        if self._writer is None:
+            # Rows wider than the header get extra columns, settled on the first batch
+            width = max(len(self.columns or []), max(len(row) for row in self._pending))
+            self.columns = (self.columns or []) + [
+                f"Unnamed: {i}" for i in range(len(self.columns or []), width)
+            ]
+        width = len(self.columns)
+        cells = [[None] * len(self._pending) for _ in range(width)]
+        for row_index, row in enumerate(self._pending):
+            for column_index, value in enumerate(row[:width]):
+                cells[column_index][row_index] = _as_string(value)
+        self._pending = []
+        self._write_batch([pa.array(column, type=pa.string()) for column in cells])
+
+    def _write_batch(self, arrays: List[pa.Array]):
+        if self._writer is None:
+            self._open()
+        self._writer.write_batch(pa.record_batch(arrays, schema=self._schema))
+
+    def _open(self):
+        self._schema = pa.schema([(name, pa.string()) for name in self.columns or []])
+        self._writer = pa.ipc.new_file(str(self.path), self._schema)
+
+    def close(self):
+        self._flush()
+        if self._writer is None:
+            # Header-only or empty sheet
+            self._open()
+        self._writer.close()
+
+
+class SnapshotDirectory:
+    """
+    Worker-side handle on a snapshot being built: one Arrow file per sheet
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.tables = 0
+
+    def table(self) -> TableSnapshotWriter:
+        writer = TableSnapshotWriter(self.path / f"{self.tables:04d}{TABLE_SUFFIX}")
+        self.tables += 1
+        return writer
+
+
+def snapshot_rows(rows: Iterator[Sequence], writer: TableSnapshotWriter) -> Iterator[Sequence]:
+    """
+    Pass rows through unchanged while copying them into a snapshot table;
+    the first row is the header
+    """
+    for index, row in enumerate(rows):
+        if index == 0:
+            writer.write_header([
+                f"Unnamed: {i}" if value is None or value == "" else value
+                for i, value in enumerate(row)
+            ])
+        else:
+            writer.write_row(row)
+        yield row
+    writer.close()
+
+
+class ParsedDocumentCache:
+    """
+    Local cache of parsed documents: the profile text sent to the model plus
+    an Arrow snapshot of every sheet/CSV, keyed by upload id and content hash.
+    Snapshots are read through memory maps, and the least recently used
+    entries are evicted to keep the directory under max_bytes.
+    """
+
+    def __init__(self, directory: Path = PARSED_CACHE_DIR, max_bytes: int = PARSED_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # key -> size in bytes; populated from disk on first use
+        self._sizes: Optional[Dict[str, int]] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key
+
+    def _index(self) -> Dict[str, int]:
+        if self._sizes is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._sizes = {}
+            for entry in self.directory.iterdir():
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    self._sizes[entry.name] = sum(f.stat().st_size for f in entry.iterdir())
+        return self._sizes
+
+    def new_snapshot_dir(self) -> str:
+        self._index()
+        return tempfile.mkdtemp(dir=self.directory, prefix='.building-')
+
+    def load_profile(self, upload: dict) -> Optional[str]:
+        key = snapshot_key(upload)
+        profile_path = self._entry(key) / PROFILE_FILE
+        try:
+            profile = profile_path.read_text(encoding='utf-8')
+        except OSError:
+            self.misses += 1
+            return None
+        # Directory mtime is the LRU clock
+        os.utime(self._entry(key))
+        self.hits += 1
+        return profile
+
+    def store(self, upload: dict, snapshot_dir: str, profile: str):
+        """
+        Publish a snapshot built by an extraction worker
+        """
+        key = snapshot_key(upload)
+        build_path = Path(snapshot_dir)
+        (build_path / PROFILE_FILE).write_text(profile, encoding='utf-8')
+        try:
+            os.replace(build_path, self._entry(key))
+        except OSError:
+            # Another analysis of the same upload published it first
+            shutil.rmtree(build_path, ignore_errors=True)
+            return
+        self._index()[key] = sum(f.stat().st_size for f in self._entry(key).iterdir())
+        self._evict(keep=key)
+
+    def discard_build(self, snapshot_dir: str):
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    def discard(self, upload_id: str):
+        """
+        Drop every snapshot of an upload (e.g. when it is deleted)
+        """
+        for key in [key for key in self._index() if key.rsplit('-', 1)[0] == upload_id]:
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            self._index().pop(key, None)
+
+    def _evict(self, keep: str):
+        sizes = self._index()
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = sorted(
+            (key for key in sizes if key != keep),
+            key=lambda key: self._last_used(key)
+        )
+        for key in by_age:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= sizes.pop(key)
+            self.evictions += 1
+
+    def _last_used(self, key: str) -> float:
+        try:
+            return self._entry(key).stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def table_count(self, upload: dict) -> int:
+        entry = self._entry(snapshot_key(upload))
+        if not entry.is_dir():
+            return 0
+        return len([f for f in entry.iterdir() if f.suffix == TABLE_SUFFIX])
+
+    def read_table(self, upload: dict, index: int) -> Optional[pa.Table]:
+        """
+        Memory-mapped, zero-copy view of one snapshot table, or None
+        """
+        path = self._entry(snapshot_key(upload)) / f"{index:04d}{TABLE_SUFFIX}"
+        try:
+            source = pa.memory_map(str(path), 'r')
+        except (OSError, pa.ArrowIOError):
+            return None
+        os.utime(path.parent)
+        # The table's buffers keep the mapping alive after the file is closed
+        with source:
+            return pa.ipc.open_file(source).read_all()
+
+    def stats(self) -> dict:
+        sizes = self._index()
+        return {
+            "entries": len(sizes),
+            "bytes": sum(sizes.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_cache: Optional[ParsedDocumentCache] = None
+
+
+def get_parsed_cache() -> ParsedDocumentCache:
+    global _cache
+    if _cache is None:
+        _cache = ParsedDocumentCache()
+    return _cache
@@ -0,0 +1,104 @@
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import pdfplumber
+
+from extraction_pool import ExtractionTimeout, get_extraction_pool
+
+logger = logging.getLogger(__name__)
+
+PDF_PAGE_TIMEOUT_SECONDS = int(os.environ.get('PDF_PAGE_TIMEOUT_SECONDS', '30'))
+
+
+def count_pages(path: str) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def _format_table(table: List[List[Optional[str]]]) -> str:
+    rows = []
+    for row in table:
+        cells = [" ".join((cell or "").split()) for cell in row]
+        if any(cells):
+            rows.append(" | ".join(cells))
+    return "\n".join(rows)
+
+
+def extract_page(path: str, page_number: int) -> str:
+    """
+    Extract the text and tables of one page (0-based). Runs in a worker process.
+    """
+    with pdfplumber.open(path, pages=[page_number + 1]) as pdf:
+        page = pdf.pages[0]
+        text = (page.extract_text() or "").strip()
+        tables = [_format_table(table) for table in page.extract_tables()]
+    parts = [text] if text else []
+    for index, table in enumerate(tables):
+        if table:
+            parts.append(f"Table {index + 1}:\n{table}")
+    return "\n\n".join(parts)
+
+
+async def extract_pdf_text(path: str, filename: str, max_chars: int) -> str:
+    """
+    Extract a PDF page by page across the extraction pool, in page order.
+    A page that uses more than PDF_PAGE_TIMEOUT_SECONDS of CPU time is
+    skipped (time spent queued doesn't count), and no further pages are
+    scheduled once max_chars of text has been collected.
+    """
+    pool = get_extraction_pool()
+    page_count = await pool.run(count_pages, path)
+
+    pending: Dict[int, asyncio.Future] = {}
+    pages: List[str] = []
+    skipped: List[int] = []
+    collected = 0
+    next_page = 0
+    # Pages read before the text budget ran out, when it did
+    stopped_after: Optional[int] = None
+
+    def schedule():
+        nonlocal next_page
+        # Keep every worker busy, but don't run far ahead of the budget
+        while next_page < page_count and len(pending) < pool.workers * 2:
+            pending[next_page] = asyncio.ensure_future(
+                pool.run(extract_page, path, next_page, cpu_seconds=PDF_PAGE_TIMEOUT_SECONDS)
+            )
+            next_page += 1
+
+    try:
+        schedule()
+        for page_number in range(page_count):
+            if collected >= max_chars:
+                stopped_after = page_number
+                break
+            try:
+                text = await pending.pop(page_number)
+            except ExtractionTimeout:
+                logger.warning(f"PDF page {page_number + 1} of {filename} timed out; skipping")
+                skipped.append(page_number + 1)
+                text = ""
+            except Exception as page_error:
+                logger.warning(f"PDF page {page_number + 1} of {filename} failed: {page_error}")
+                skipped.append(page_number + 1)
+                text = ""
+            if text:
+                page_text = f"=== Page {page_number + 1} ===\n{text}\n\n"
+                pages.append(page_text)
+                collected += len(page_text)
+            schedule()
+    finally:
+        # Pages that haven't started yet are dropped
+        for future in pending.values():
+            future.cancel()
+
+    extracted = len(pages)
+    header = f"PDF File: {filename}\nPages: {page_count}"
+    if stopped_after is not None:
+        header += f" (text budget reached after page {stopped_after})"
+    if skipped:
+        header += f"\nPages skipped (timeout or error): {', '.join(str(page) for page in skipped[:50])}"
+    logger.info(f"PDF extracted: {extracted} of {page_count} pages with text, {collected} chars")
+    return header + "\n\n" + "".join(pages)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from google.api_core.exceptions import NotFound
+
+from metrics import track_dependency
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batched writes with more than 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class ProfileCache:
+    """
+    In-process cache of Firestore user profiles with a TTL, bounded to
+    max_entries (least recently used dropped first). Concurrent misses for
+    the same user share a single Firestore read.
+    """
+
+    def __init__(self, firestore_factory: Callable, ttl: float = 60.0, max_entries: int = 10000):
+        self.firestore_factory = firestore_factory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def _user_ref(self, uid: str):
+        return self.firestore_factory().collection('users').document(uid)
+
+    def get_cached(self, uid: str) -> Optional[dict]:
+        entry = self._entries.get(uid)
+        if entry is None:
+            return None
+        expires_at, profile = entry
+        if expires_at <= time.monotonic():
+            self._entries.pop(uid, None)
+            return None
+        self._entries.move_to_end(uid)
+        return profile
+
+    def put(self, uid: str, profile: dict):
+        self._entries[uid] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(uid)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, uid: str):
+        self._entries.pop(uid, None)
+
+    async def get_or_load(self, uid: str, default_profile: Callable[[], dict]) -> tuple:
+        """
+        Return (profile, created). Creates the Firestore profile from
+        default_profile() when the user has none yet.
+        """
+        profile = self.get_cached(uid)
+        if profile is not None:
+            return profile, False
+
+        pending = self._loading.get(uid)
+        while pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    # This request itself was cancelled
+                    raise
+            # The load we joined was cancelled: join the next one or load
+            pending = self._loading.get(uid)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[uid] = future
+        try:
+            result = await self._load(uid, default_profile)
+            self.put(uid, result[0])
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future doesn't log a warning
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled (client disconnected): the requests waiting on this
+            # load retry it themselves instead of waiting forever
+            future.cancel()
+            raise
+        finally:
+            self._loading.pop(uid, None)
+
+    async def _load(self, uid: str, default_profile: Callable[[], dict]) -> tuple:
+        user_ref = self._user_ref(uid)
+        with track_dependency('firestore', 'get_profile'):
+            user_doc = await asyncio.to_thread(user_ref.get)
+        if user_doc.exists:
+            return user_doc.to_dict(), False
+
+        # Create user profile if doesn't exist
+        user_profile = default_profile()
+        with track_dependency('firestore', 'create_profile'):
+            await asyncio.to_thread(user_ref.set, user_profile)
+        return user_profile, True
+
+    async def update(self, uid: str, update_data: dict):
+        with track_dependency('firestore', 'update_profile'):
+            await asyncio.to_thread(self._user_ref(uid).update, update_data)
+        self.invalidate(uid)
+
+
+class LastLoginWriter:
+    """
+    Debounces last_login updates: logins are collected in memory (one entry
+    per user) and flushed periodically with Firestore batched writes.
+    """
+
+    def __init__(self, firestore_factory: Callable, flush_interval: float = 30.0):
+        self.firestore_factory = firestore_factory
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, uid: str, when: Optional[datetime] = None):
+        self._pending[uid] = when or datetime.utcnow()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Don't lose logins recorded since the last tick
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            with track_dependency('firestore', 'write_last_login'):
+                await asyncio.to_thread(self._write_batches, pending)
+        except Exception as e:
+            logger.error(f"Error flushing last_login updates: {e}")
+            # Re-queue, keeping any newer login recorded meanwhile
+            for uid, when in pending.items():
+                self._pending.setdefault(uid, when)
+
+    def _write_batches(self, pending: Dict[str, datetime]):
+        firestore_client = self.firestore_factory()
+        users = firestore_client.collection('users')
+        items = list(pending.items())
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            chunk = items[start:start + FIRESTORE_BATCH_LIMIT]
+            # update(), not set(): a login must not recreate a deleted profile
+            batch = firestore_client.batch()
+            for uid, when in chunk:
+                batch.update(users.document(uid), {'last_login': when})
+            try:
+                batch.commit()
+            except NotFound:
+                # One missing profile fails the whole batch; write this
+                # chunk one profile at a time and skip the missing ones
+                for uid, when in chunk:
+                    try:
+                        users.document(uid).update({'last_login': when})
+                    except NotFound:
+                        logger.info(f"Skipping last_login for deleted profile {uid}")
+        logger.info(f"Flushed last_login for {len(items)} users")
@@ -1,27 +1,51 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, UploadFile, File, Query, Response
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
+import json
+import base64
 from datetime import datetime
-import io
-import requests
+import anyio
+import httpx
+from starlette.background import BackgroundTask
 
 # Import Firebase auth middleware
-from auth_middleware import get_current_user
-from firebase_config import get_firestore_client
+from auth_middleware import get_current_user, require_internal_token
+from firebase_config import get_firestore_client, start_token_key_refresh, stop_token_key_refresh
+from analysis import (
+    run_analysis, prepare_document, needs_map_reduce, map_document,
+    build_analysis_request, build_reduce_request, stream_openai, get_model_api_key
+)
+from http_client import start_http_client, close_http_client, get_http_client
+from extraction_pool import get_extraction_pool, start_extraction_pool, close_extraction_pool
+from parsed_cache import get_parsed_cache
+from content_sampler import start_tokenizer_preload
+from admission import AdmissionRejected, get_admission_controller
+from llm_client import get_llm_client
+from tracing import TracingMiddleware, get_trace_exporter, install_log_trace_ids
+from metrics import MetricsMiddleware, count_bytes, register_gauge, render_metrics, track_dependency
+from job_queue import AnalysisJobQueue, JOB_COMPLETED
+from profile_cache import ProfileCache, LastLoginWriter
+from analysis_cache import AnalysisCache
+from upload_repository import UploadRepository
+from upload_ingest import ingest_upload, UploadSizeLimitMiddleware, UploadTooLarge, UnsupportedContent
+from storage import StorageUnavailable, StoredFileMissing, file_response, get_storage
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+# Log lines carry the id of the trace they were written in
+install_log_trace_ids()
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
 logger = logging.getLogger(__name__)
 
 # MongoDB connection
@@ -37,12 +61,44 @@ except Exception as e:
     client = None
     db = None
 
+# Data access for the file_uploads collection
+upload_repository = UploadRepository(db) if db is not None else None
+
+# Firestore user profile cache and batched last_login writer
+profile_cache = ProfileCache(
+    get_firestore_client,
+    ttl=float(os.environ.get('PROFILE_CACHE_TTL_SECONDS', '60'))
+)
+last_login_writer = LastLoginWriter(
+    get_firestore_client,
+    flush_interval=float(os.environ.get('LAST_LOGIN_FLUSH_SECONDS', '30'))
+)
+
+# Background analysis job queue (created on app startup)
+job_queue: Optional[AnalysisJobQueue] = None
+
+# Content-addressed cache of LLM analysis results
+analysis_cache = AnalysisCache(
+    db,
+    max_bytes=int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+) if db is not None else None
+
+# Per-user rate limits and the global cap on upstream model calls
+admission = get_admission_controller()
+
+# Batch analysis: uploads per request, and documents with the model at once per batch
+MAX_BATCH_ANALYSIS_ITEMS = 100
+BATCH_ANALYSIS_CONCURRENCY = int(os.environ.get('BATCH_ANALYSIS_CONCURRENCY', '5'))
+
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Monitoring endpoints, only for holders of INTERNAL_API_TOKEN
+internal_router = APIRouter(prefix="/api", dependencies=[Depends(require_internal_token)])
+
 # Define Models
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -70,6 +126,11 @@ class FileUploadRecord(BaseModel):
     upload_timestamp: datetime = Field(default_factory=datetime.utcnow)
     analysis_status: str = "pending"  # pending, processing, completed, failed
     analysis_result: Optional[str] = None
+    storage_key: Optional[str] = None  # Key of files sent to /upload-file in the storage backend
+    local_path: Optional[str] = None  # Spooled copy (records from before the storage backend)
+    content_hash: Optional[str] = None  # SHA-256 of the file content
+    detected_type: Optional[str] = None  # Type sniffed from magic bytes
+    analysis_progress: Optional[dict] = None  # {stage, completed, total} for chunked analyses
 
 # Public routes (no authentication required)
 @api_router.get("/")
@@ -80,21 +141,67 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+# Internal routes (INTERNAL_API_TOKEN required)
+@internal_router.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus exposition: per-route and per-dependency latency histograms,
+    in-flight gauges, download/token counters and parse times per file type
+    """
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@internal_router.get("/traces/stats")
+async def get_trace_stats():
+    """
+    Counters of the sampled JSONL trace exporter
+    """
+    return get_trace_exporter().stats()
+
+@internal_router.get("/analysis-cache/stats")
+async def get_analysis_cache_stats():
+    """
+    Hit/miss counters of the analysis result cache
+    """
+    if analysis_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **analysis_cache.stats()}
+
+@internal_router.get("/parsed-cache/stats")
+async def get_parsed_cache_stats():
+    """
+    Size and hit/miss counters of the parsed-document snapshot cache
+    """
+    return get_parsed_cache().stats()
+
+@internal_router.get("/llm/stats")
+async def get_llm_stats():
+    """
+    Model call counters, token usage, latency and circuit breaker state
+    """
+    return get_llm_client().stats()
+
+@internal_router.get("/admission/stats")
+async def get_admission_stats():
+    """
+    Upstream call slots in use/waiting and admission rejection counters
+    """
+    return admission.stats()
+
+@internal_router.get("/extraction-pool/stats")
+async def get_extraction_pool_stats():
+    """
+    Queue depth and task counters of the document extraction process pool
+    """
+    return get_extraction_pool().stats()
+
 # Protected routes (authentication required)
 @api_router.get("/me")
 async def get_current_user_profile(current_user: dict = Depends(get_current_user)):
     """
     Get current authenticated user's profile
     """
-    firestore_client = get_firestore_client()
-    
-    # Check if user profile exists in Firestore
-    user_ref = firestore_client.collection('users').document(current_user['uid'])
-    user_doc = user_ref.get()
-    
-    if not user_doc.exists:
-        # Create user profile if doesn't exist
-        user_profile = {
+    def new_profile():
+        return {
             'uid': current_user['uid'],
             'email': current_user.get('email'),
             'phone_number': current_user.get('phone_number'),
@@ -103,12 +210,14 @@ async def get_current_user_profile(current_user: dict = Depends(get_current_user
             'created_at': datetime.utcnow(),
             'last_login': datetime.utcnow()
         }
-        user_ref.set(user_profile)
-        return user_profile
-    else:
-        # Update last login
-        user_ref.update({'last_login': datetime.utcnow()})
-        return user_doc.to_dict()
+    
+    # Served from the profile cache; creates the profile if it doesn't exist
+    user_profile, created = await profile_cache.get_or_load(current_user['uid'], new_profile)
+    
+    if not created:
+        # Update last login (debounced, written in batches)
+        last_login_writer.record(current_user['uid'])
+    return user_profile
 
 @api_router.put("/me")
 async def update_user_profile(
@@ -118,9 +227,6 @@ async def update_user_profile(
     """
     Update current user's profile
     """
-    firestore_client = get_firestore_client()
-    user_ref = firestore_client.collection('users').document(current_user['uid'])
-    
     # Prepare update data
     update_data = {}
     if 'display_name' in profile_data:
@@ -128,10 +234,22 @@ async def update_user_profile(
     
     update_data['updated_at'] = datetime.utcnow()
     
-    user_ref.update(update_data)
+    await profile_cache.update(current_user['uid'], update_data)
     
     return {"message": "Profile updated successfully"}
 
+async def release_stored_file(storage_key: str):
+    """
+    Remove a stored file once no upload references it any more (uploads of
+    identical content share one stored file). The record is already gone,
+    so a storage error is logged rather than failing the request.
+    """
+    try:
+        if not await upload_repository.storage_key_in_use(storage_key):
+            await get_storage().delete(storage_key)
+    except Exception as e:
+        logger.warning(f"Could not delete stored file {storage_key}: {e}")
+
 @api_router.delete("/upload-record/{upload_id}")
 async def delete_upload_record(
     upload_id: str,
@@ -147,25 +265,14 @@ async def delete_upload_record(
         )
     
     try:
-        # Check if the upload belongs to the current user
-        upload = await db.file_uploads.find_one({
-            "id": upload_id,
-            "user_id": current_user['uid']
-        })
-        
-        if not upload:
+        # Delete the upload record (only matches the current user's uploads)
+        deleted = await upload_repository.delete(upload_id, current_user['uid'])
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Upload not found or access denied")
-        
-        # Delete the upload record
-        result = await db.file_uploads.delete_one({
-            "id": upload_id,
-            "user_id": current_user['uid']
-        })
-        
-        if result.deleted_count == 1:
-            return {"message": "Upload deleted successfully"}
-        else:
-            raise HTTPException(status_code=404, detail="Upload not found")
+        get_parsed_cache().discard(upload_id)
+        if deleted.get('storage_key'):
+            await release_stored_file(deleted['storage_key'])
+        return {"message": "Upload deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
@@ -183,15 +290,9 @@ async def upload_file(
     """
     Upload a file and create a record (protected endpoint)
     Note: Files are stored in Firebase Storage by the frontend.
-    This endpoint creates the metadata record in MongoDB.
+    This endpoint keeps a copy in the storage backend (local disk or S3) and
+    creates the metadata record in MongoDB.
     """
-    # Validate file size (max 10MB)
-    contents = await file.read()
-    file_size = len(contents)
-    
-    if file_size > 10 * 1024 * 1024:  # 10MB
-        raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
-    
     # Validate file type
     allowed_types = [
         'application/pdf',
@@ -215,22 +316,39 @@ async def upload_file(
             detail=f"File type not allowed. Allowed types: PDF, XML, TXT, CSV, Excel (.xlsx, .xls, .csv)"
         )
     
+    # Stream to storage in chunks (max 10MB), hashing and sniffing the content
+    try:
+        ingested = await ingest_upload(file)
+    except UploadTooLarge as e:
+        # Same status as UploadSizeLimitMiddleware's early rejection
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedContent as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except StorageUnavailable as e:
+        logger.error(f"Error storing uploaded file: {e}")
+        raise HTTPException(status_code=502, detail="Failed to store file")
+    file_size = ingested.size
+    
     # Create upload record
     upload_record = FileUploadRecord(
         user_id=current_user['uid'],
         filename=file.filename or "unnamed",
         file_size=file_size,
-        content_type=file.content_type
+        content_type=file.content_type,
+        storage_key=ingested.key,
+        content_hash=ingested.content_hash,
+        detected_type=ingested.detected_type
     )
     
     # Store in MongoDB
-    await db.file_uploads.insert_one(upload_record.model_dump())
+    await upload_repository.insert(upload_record.model_dump())
     
     return {
         "message": "File uploaded successfully",
         "upload_id": upload_record.id,
         "filename": upload_record.filename,
         "file_size": file_size,
+        "content_hash": ingested.content_hash,
         "user_id": current_user['uid']
     }
 
@@ -243,6 +361,12 @@ class AnalyzeRequest(BaseModel):
     file_content: Optional[str] = None
     filename: str = ""
 
+class BatchAnalyzeItem(AnalyzeRequest):
+    upload_id: str
+
+class BatchAnalyzeRequest(BaseModel):
+    items: List[BatchAnalyzeItem] = Field(..., min_length=1, max_length=MAX_BATCH_ANALYSIS_ITEMS)
+
 @api_router.post("/upload-record")
 async def create_upload_record(
     upload_data: UploadRecordCreate,
@@ -273,7 +397,7 @@ async def create_upload_record(
         logger.info(f"Upload record created: {upload_dict}")
         
         # Store in MongoDB
-        result = await db.file_uploads.insert_one(upload_dict)
+        result = await upload_repository.insert(upload_dict)
         logger.info(f"MongoDB insert result: {result.inserted_id}")
         
         return {
@@ -291,10 +415,34 @@ async def create_upload_record(
             detail=f"Error creating upload record: {str(e)}"
         )
 
+def encode_uploads_cursor(upload: dict) -> str:
+    """
+    Opaque keyset cursor: position of the last item of a page
+    """
+    # Legacy documents without an id are listed (and backfilled) under their _id
+    upload_id = upload['id'] if 'id' in upload else str(upload['_id'])
+    position = json.dumps({"t": upload['upload_timestamp'].isoformat(), "id": upload_id})
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decode_uploads_cursor(cursor: str) -> tuple:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position['t']), str(position['id'])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @api_router.get("/my-uploads")
-async def get_user_uploads(current_user: dict = Depends(get_current_user)):
+async def get_user_uploads(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     """
-    Get current user's file uploads
+    Get current user's file uploads, newest first.
+    Paginated by keyset: when more uploads exist, the X-Next-Cursor response
+    header holds the cursor for the next page. analysis_result is left out of
+    the list; fetch /upload/{upload_id} for it.
     """
     if db is None:
         raise HTTPException(
@@ -302,50 +450,29 @@ async def get_user_uploads(current_user: dict = Depends(get_current_user)):
             detail="Database connection unavailable. Please ensure MongoDB is running."
         )
     
+    after = decode_uploads_cursor(cursor) if cursor else None
+    
     try:
-        user_id = current_user['uid']
-        logger.info(f"Fetching uploads for user: {user_id}")
-        
-        cursor = db.file_uploads.find({"user_id": user_id}).sort("upload_timestamp", -1)
-        uploads = await cursor.to_list(100)
-        
-        logger.info(f"Found {len(uploads)} raw documents from MongoDB")
-        
-        # Convert MongoDB documents to JSON-serializable format
-        result = []
-        for upload in uploads:
-            # Convert MongoDB document to dict, handling ObjectId and datetime
-            upload_dict = {}
-            for key, value in upload.items():
-                if key == '_id':
-                    # Skip MongoDB's _id, we'll use 'id' field instead
-                    continue
-                elif isinstance(value, datetime):
-                    # Convert datetime to ISO format string
-                    upload_dict[key] = value.isoformat()
-                else:
-                    # Keep other values as-is
-                    upload_dict[key] = value
-            
-            # Ensure 'id' field exists (use existing 'id' or fallback to _id as string)
-            if 'id' not in upload_dict:
-                if '_id' in upload:
-                    upload_dict['id'] = str(upload['_id'])
-                else:
-                    # Generate a new ID if neither exists (shouldn't happen)
-                    upload_dict['id'] = str(uuid.uuid4())
-                    logger.warning(f"Upload document missing 'id' field, generated new one")
-            
-            result.append(upload_dict)
-        
-        logger.info(f"Returning {len(result)} serialized uploads for user {user_id}")
-        return result
+        # Fetch one extra document to know whether another page exists
+        uploads = await upload_repository.list_page(current_user['uid'], limit + 1, after)
     except Exception as e:
         logger.error(f"Error fetching uploads: {e}", exc_info=True)
         raise HTTPException(
             status_code=503,
             detail=f"Database error: {str(e)}"
         )
+    
+    if len(uploads) > limit:
+        uploads = uploads[:limit]
+        response.headers["X-Next-Cursor"] = encode_uploads_cursor(uploads[-1])
+    
+    for upload in uploads:
+        # Use 'id' rather than MongoDB's _id (fall back to _id for legacy documents)
+        object_id = upload.pop('_id', None)
+        if 'id' not in upload:
+            upload['id'] = str(object_id)
+    
+    return uploads
 
 @api_router.get("/upload/{upload_id}")
 async def get_upload_details(
@@ -362,10 +489,7 @@ async def get_upload_details(
         )
     
     try:
-        upload = await db.file_uploads.find_one({
-            "id": upload_id,
-            "user_id": current_user['uid']
-        })
+        upload = await upload_repository.get(upload_id, current_user['uid'])
         
         if not upload:
             raise HTTPException(status_code=404, detail="Upload not found or access denied")
@@ -400,14 +524,59 @@ async def get_upload_details(
             detail=f"Database error: {str(e)}"
         )
 
+@api_router.get("/upload/{upload_id}/preview")
+async def preview_upload(
+    upload_id: str,
+    table: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Rows of a parsed sheet/CSV, read from the snapshot kept by its last analysis
+    """
+    if db is None:
+        raise HTTPException(
+            status_code=503, 
+            detail="Database connection unavailable. Please ensure MongoDB is running."
+        )
+
+    try:
+        upload = await upload_repository.get(
+            upload_id, current_user['uid'], {"id": 1, "file_path": 1, "content_hash": 1}
+        )
+    except Exception as e:
+        logger.error(f"Error fetching upload for preview: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Database error: {str(e)}"
+        )
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found or access denied")
+
+    parsed_cache = get_parsed_cache()
+    snapshot = parsed_cache.read_table(upload, table)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No parsed snapshot for this upload. Analyze it first.")
+
+    return {
+        "tables": parsed_cache.table_count(upload),
+        "table": table,
+        "columns": snapshot.column_names,
+        "total_rows": snapshot.num_rows,
+        "offset": offset,
+        "rows": snapshot.slice(offset, limit).to_pylist(),
+    }
+
 @api_router.get("/download/{upload_id}")
 async def download_file(
     upload_id: str,
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Download a file by proxying it from Firebase Storage
-    This avoids CORS issues by downloading on the backend
+    Download a file: served from the storage backend for files sent to
+    /upload-file, otherwise proxied from Firebase Storage (this avoids CORS
+    issues by downloading on the backend)
     """
     if db is None:
         raise HTTPException(
@@ -417,40 +586,55 @@ async def download_file(
     
     try:
         # Get upload record and verify ownership
-        upload = await db.file_uploads.find_one({
-            "id": upload_id,
-            "user_id": current_user['uid']
-        })
+        upload = await upload_repository.get(upload_id, current_user['uid'])
         
         if not upload:
             raise HTTPException(status_code=404, detail="Upload not found or access denied")
         
         file_path = upload.get('file_path')
         filename = upload.get('filename', 'download')
+        media_type = upload.get('content_type')
+        
+        # Stored copy: served from disk (sendfile where the server supports it) or S3
+        try:
+            if upload.get('storage_key'):
+                return await get_storage().download_response(upload['storage_key'], filename, media_type)
+            if upload.get('local_path'):
+                return file_response(upload['local_path'], filename, media_type)
+        except StoredFileMissing:
+            logger.warning(f"Stored copy of upload {upload_id} is missing")
+        except StorageUnavailable as e:
+            logger.error(f"Error reading file from storage: {e}")
+            raise HTTPException(status_code=502, detail="Failed to download file from storage")
         
         if not file_path:
             raise HTTPException(status_code=404, detail="File path not available")
         
         # Download file from Firebase Storage
+        http_client = get_http_client()
         try:
-            response = requests.get(file_path, stream=True, timeout=30)
-            response.raise_for_status()
-        except requests.RequestException as e:
+            with track_dependency('storage', 'download'):
+                response = await http_client.send(
+                    http_client.build_request("GET", file_path),
+                    stream=True
+                )
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            if isinstance(e, httpx.HTTPStatusError):
+                await e.response.aclose()
             logger.error(f"Error downloading file from Firebase Storage: {e}")
             raise HTTPException(status_code=502, detail="Failed to download file from storage")
         
-        # Return file as streaming response with proper headers
-        def generate():
-            for chunk in response.iter_content(chunk_size=8192):
-                yield chunk
-        
+        # Return file as streaming response with proper headers;
+        # the upstream response is released once the body has been sent
         return StreamingResponse(
-            generate(),
+            count_bytes(response.aiter_bytes(), 'download_proxy'),
             media_type=upload.get('content_type', 'application/octet-stream'),
             headers={
                 "Content-Disposition": f'attachment; filename="{filename}"',
                 "Content-Length": str(upload.get('file_size', 0))
-            }
+            },
+            background=BackgroundTask(response.aclose)
         )
     except HTTPException:
         raise
@@ -461,272 +645,391 @@ async def download_file(
             detail=f"Error downloading file: {str(e)}"
         )
 
-@api_router.post("/analyze/{upload_id}")
+def admit_analysis(current_user: dict, cost: int = 1):
+    """
+    Per-user rate limit and global overload check for starting analyses;
+    sheds load with 429 + Retry-After instead of queueing without bound
+    """
+    try:
+        admission.admit(current_user['uid'], cost)
+    except AdmissionRejected as rejected:
+        raise HTTPException(
+            status_code=429,
+            detail=rejected.detail,
+            headers={"Retry-After": rejected.retry_after_header}
+        )
+
+def ndjson_line(data: dict) -> str:
+    return json.dumps(data) + "\n"
+
+# Registered before /analyze/{upload_id} so "batch" isn't taken for an upload id
+@api_router.post("/analyze/batch")
+async def analyze_documents_batch(
+    batch: BatchAnalyzeRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Analyze several uploads in one request. Ownership is checked with a single
+    query, files are fetched and parsed concurrently, and at most
+    BATCH_ANALYSIS_CONCURRENCY documents are with the model at once.
+    Streams one NDJSON line per upload as it finishes, then a summary line.
+    """
+    if db is None:
+        raise HTTPException(
+            status_code=503, 
+            detail="Database connection unavailable. Please ensure MongoDB is running."
+        )
+    
+    admit_analysis(current_user, cost=len(batch.items))
+    
+    user_id = current_user['uid']
+    # First occurrence wins for duplicated ids
+    items = {}
+    for item in batch.items:
+        items.setdefault(item.upload_id, item)
+    
+    try:
+        uploads = await upload_repository.get_many(list(items), user_id)
+        if uploads:
+            # Supersedes any queued analysis of these uploads
+            await upload_repository.set_status_many(
+                [upload['id'] for upload in uploads], user_id, "processing", analysis_job_id=None
+            )
+    except Exception as e:
+        logger.error(f"Error accessing database: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Database error: {str(e)}"
+        )
+    
+    found_ids = {upload['id'] for upload in uploads}
+    model_slots = asyncio.Semaphore(BATCH_ANALYSIS_CONCURRENCY)
+    
+    async def analyze_item(upload: dict) -> dict:
+        item = items[upload['id']]
+        try:
+            analysis_result = await run_analysis(
+                upload,
+                item.file_content,
+                item.filename,
+                current_user.get('email'),
+                cache=analysis_cache,
+                model_slots=model_slots
+            )
+            await upload_repository.set_status(upload['id'], user_id, "completed", analysis_result=analysis_result)
+        except Exception as e:
+            logger.error(f"Batch analysis error for {upload['id']}: {str(e)}")
+            try:
+                await upload_repository.set_status(upload['id'], user_id, "failed")
+            except Exception as db_error:
+                logger.error(f"Error updating database: {db_error}")
+            if isinstance(e, AdmissionRejected):
+                # Model calls are backed up; the client can retry this item later
+                return {
+                    "upload_id": upload['id'],
+                    "status": "failed",
+                    "error": e.detail,
+                    "retry_after": int(e.retry_after_header)
+                }
+            return {"upload_id": upload['id'], "status": "failed", "error": f"Analysis failed: {str(e)}"}
+        return {"upload_id": upload['id'], "status": "completed", "analysis_result": analysis_result}
+    
+    async def result_stream():
+        tasks = {asyncio.ensure_future(analyze_item(upload)): upload['id'] for upload in uploads}
+        counts = {"completed": 0, "failed": 0, "not_found": 0}
+        try:
+            for upload_id in items:
+                if upload_id not in found_ids:
+                    counts["not_found"] += 1
+                    yield ndjson_line({
+                        "upload_id": upload_id,
+                        "status": "not_found",
+                        "error": "Upload not found or access denied"
+                    })
+            for finished in asyncio.as_completed(tasks):
+                outcome = await finished
+                counts[outcome["status"]] += 1
+                yield ndjson_line(outcome)
+            yield ndjson_line({"done": True, **counts})
+        finally:
+            unfinished = [task for task in tasks if not task.done()]
+            if unfinished:
+                # Client went away: stop the remaining analyses and record them as failed
+                for task in unfinished:
+                    task.cancel()
+                with anyio.CancelScope(shield=True):
+                    try:
+                        await upload_repository.set_status_many([tasks[task] for task in unfinished], user_id, "failed")
+                    except Exception as db_error:
+                        logger.error(f"Error updating database: {db_error}")
+    
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/analyze/{upload_id}", status_code=202)
 async def analyze_document(
     upload_id: str,
     analyze_data: AnalyzeRequest,
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Analyze a document using AI (OpenAI API)
+    Queue a document for AI analysis (OpenAI API).
+    Returns immediately with a job id; poll /api/analyze/jobs/{job_id} for the result.
     """
-    if db is None:
+    if db is None or job_queue is None:
         raise HTTPException(
             status_code=503, 
             detail="Database connection unavailable. Please ensure MongoDB is running."
         )
     
+    admit_analysis(current_user)
+    
     try:
-        # Verify upload belongs to user
-        upload = await db.file_uploads.find_one({
-            "id": upload_id,
-            "user_id": current_user['uid']
-        })
+        # Verify ownership and reset status to pending in one round trip;
+        # stays pending until a worker picks the job up
+        job_id = str(uuid.uuid4())
+        upload = await upload_repository.update(
+            upload_id,
+            current_user['uid'],
+            {"analysis_status": "pending", "analysis_job_id": job_id},
+            projection={"_id": 0, "filename": 1}
+        )
         
         if not upload:
             raise HTTPException(status_code=404, detail="Upload not found or access denied")
         
-        # Update status to processing
-        await db.file_uploads.update_one(
-            {"id": upload_id, "user_id": current_user['uid']},
-            {"$set": {"analysis_status": "processing"}}
+        job = await job_queue.enqueue(
+            upload_id,
+            current_user['uid'],
+            {
+                "file_content": analyze_data.file_content or "",
+                "filename": analyze_data.filename or upload.get('filename', ''),
+                "user_email": current_user.get('email')
+            },
+            job_id=job_id
         )
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error accessing database: {e}")
+        logger.error(f"Error queueing analysis: {e}")
         raise HTTPException(
             status_code=503,
             detail=f"Database error: {str(e)}"
         )
     
-    try:
-        # Get file content and filename from request body
-        file_content = analyze_data.file_content or ""
-        filename = analyze_data.filename or upload.get('filename', '')
-        file_path = upload.get('file_path', '')
-        
-        # Check if OpenAI API key is configured
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-        
-        if not openai_api_key:
-            # Return mock analysis if OpenAI not configured
-            analysis_result = f"""
-File Analysis Results:
-====================
-
-📄 File: {filename}
-📊 Size: {upload.get('file_size', 0)} bytes
-👤 User: {current_user.get('email', 'Unknown')}
-📅 Upload Time: {upload.get('upload_timestamp', 'Unknown')}
-
-📋 Content Summary:
-OpenAI API key not configured. Please set OPENAI_API_KEY environment variable to enable AI analysis.
-
-✅ File uploaded successfully!
-            """
-            
-            await db.file_uploads.update_one(
-                {"id": upload_id, "user_id": current_user['uid']},
-                {"$set": {
-                    "analysis_status": "completed",
-                    "analysis_result": analysis_result
-                }}
-            )
-            
-            return {"analysis_result": analysis_result, "upload_id": upload_id}
-        
-        # Call OpenAI API
-        import requests
-        
-        # Determine document type
-        is_idoc = 'idoc' in filename.lower() or (file_content and 'IDOC' in file_content[:1000])
-        is_excel = filename.lower().endswith(('.xlsx', '.xls'))
-        is_csv = filename.lower().endswith('.csv')
-        
-        # For Excel files, download and parse the file from Firebase Storage
-        if is_excel and file_path:
-            try:
-                logger.info(f"Downloading Excel file from Firebase Storage: {file_path}")
-                # Download file from Firebase Storage URL
-                response = requests.get(file_path, timeout=30)
-                response.raise_for_status()
-                
-                # Parse Excel file using pandas
-                import pandas as pd
-                import io
-                
-                # Read Excel file - read all sheets
-                excel_file = pd.ExcelFile(io.BytesIO(response.content), engine='openpyxl' if filename.endswith('.xlsx') else 'xlrd')
-                sheet_names = excel_file.sheet_names
-                
-                # Convert to readable text format
-                excel_summary = f"Excel File: {filename}\n"
-                excel_summary += f"Number of sheets: {len(sheet_names)}\n\n"
-                
-                # Process each sheet
-                for sheet_name in sheet_names:
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                    excel_summary += f"=== Sheet: {sheet_name} ===\n"
-                    excel_summary += f"Columns ({len(df.columns)}): {', '.join(df.columns.astype(str))}\n"
-                    excel_summary += f"Rows: {len(df)}\n\n"
-                    
-                    # Show first 20 rows (or all if less than 20)
-                    rows_to_show = min(20, len(df))
-                    if rows_to_show > 0:
-                        excel_summary += f"First {rows_to_show} rows:\n"
-                        excel_summary += df.head(rows_to_show).to_string(index=False)
-                        excel_summary += "\n\n"
-                    
-                    # Show data types and sample values
-                    excel_summary += "Column information:\n"
-                    for col in df.columns:
-                        non_null_count = df[col].notna().sum()
-                        excel_summary += f"  - {col}: {df[col].dtype}, {non_null_count}/{len(df)} non-null values\n"
-                    excel_summary += "\n"
-                
-                file_content = excel_summary
-                logger.info(f"Excel file parsed successfully. Content length: {len(file_content)}")
-                
-            except Exception as excel_error:
-                logger.error(f"Error parsing Excel file: {excel_error}")
-                # Fallback to basic info
-                file_content = f"Excel file: {filename}\n\nUnable to parse Excel file content. Error: {str(excel_error)}\n\nThis Excel file may contain SAP data exports or integration data. Please analyze based on filename and provide general recommendations."
-        
-        # For CSV files, download and parse the file from Firebase Storage
-        elif is_csv and file_path:
-            try:
-                logger.info(f"Downloading CSV file from Firebase Storage: {file_path}")
-                # Download file from Firebase Storage URL
-                response = requests.get(file_path, timeout=30)
-                response.raise_for_status()
-                
-                # Parse CSV file using pandas
-                import pandas as pd
-                import io
-                
-                # Read CSV file
-                df = pd.read_csv(io.BytesIO(response.content))
-                
-                csv_summary = f"CSV File: {filename}\n"
-                csv_summary += f"Columns ({len(df.columns)}): {', '.join(df.columns.astype(str))}\n"
-                csv_summary += f"Rows: {len(df)}\n\n"
-                
-                # Show sample data
-                rows_to_show = min(20, len(df))
-                if rows_to_show > 0:
-                    csv_summary += f"First {rows_to_show} rows:\n"
-                    csv_summary += df.head(rows_to_show).to_string(index=False)
-                    csv_summary += "\n\n"
-                
-                # Column information
-                csv_summary += "Column information:\n"
-                for col in df.columns:
-                    non_null_count = df[col].notna().sum()
-                    csv_summary += f"  - {col}: {df[col].dtype}, {non_null_count}/{len(df)} non-null values\n"
-                csv_summary += "\n"
-                
-                file_content = csv_summary
-                logger.info(f"CSV file parsed successfully. Content length: {len(file_content)}")
-                
-            except Exception as csv_error:
-                logger.error(f"Error parsing CSV file: {csv_error}")
-                # Fallback to basic info
-                file_content = f"CSV file: {filename}\n\nUnable to parse CSV file content. Error: {str(csv_error)}\n\nThis CSV file may contain SAP data exports or integration data. Please analyze based on filename and provide general recommendations."
-        
-        # Fallback if no content extracted
-        if not file_content and (is_excel or is_csv):
-            file_type = "Excel" if is_excel else "CSV"
-            file_content = f"{file_type} file: {filename}\n\nThis is a {file_type} file that may contain SAP data exports or integration data. Analyze the file structure and provide recommendations for integration approaches."
-        
-        system_prompt = """You are an expert SAP consultant analyzing a document. 
-Provide a comprehensive analysis including:
-1. Document type and content overview
-2. Key information extracted
-3. SAP-related processes or modules involved
-4. Recommendations and next steps
-5. Potential integration opportunities
-
-Focus on SAP-relevant insights and actionable recommendations."""
-        
-        if is_idoc:
-            system_prompt = """You are an expert SAP consultant analyzing an IDOC (Intermediate Document). 
-Provide a detailed analysis including:
-1. Document type and purpose
-2. Key data fields and their meanings
-3. Business process context
-4. Potential issues or recommendations
-5. Integration points and dependencies
-
-Make your response clear and actionable for SAP professionals."""
-        elif is_excel or is_csv:
-            file_type = "Excel" if is_excel else "CSV"
-            system_prompt = f"""You are an expert SAP consultant analyzing a {file_type} file that may contain SAP data exports or integration data.
-Provide a detailed analysis including:
-1. File structure and data organization
-2. Key data fields and their SAP relevance
-3. Data quality assessment
-4. Potential SAP module associations (FI, CO, SD, MM, etc.)
-5. Integration opportunities (real-time vs batch)
-6. Recommendations for ASAPIO or similar integration tools if applicable
-7. Data transformation needs
-
-Focus on identifying if this data would benefit from real-time integration tools like ASAPIO vs batch file processing."""
-        
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {openai_api_key}',
-                'Content-Type': 'application/json',
-            },
-            json={
-                'model': 'gpt-4o-mini',
-                'messages': [
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': f'Please analyze this {"SAP IDOC" if is_idoc else "Excel file" if is_excel else "CSV file" if is_csv else "document"}:\n\n{file_content[:50000]}'}  # Limit to 50k chars
-                ],
-                'max_tokens': 2000,
-                'temperature': 0.3,
-            },
-            timeout=30
+    return {
+        "message": "Analysis queued",
+        "job_id": job['id'],
+        "upload_id": upload_id,
+        "analysis_status": "pending"
+    }
+
+@api_router.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get the state of a queued analysis job (and its result once completed)
+    """
+    if db is None or job_queue is None:
+        raise HTTPException(
+            status_code=503, 
+            detail="Database connection unavailable. Please ensure MongoDB is running."
         )
+    
+    try:
+        job = await job_queue.get(job_id, current_user['uid'])
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found or access denied")
         
-        if response.status_code == 200:
-            analysis_result = response.json()['choices'][0]['message']['content']
-        else:
-            raise Exception(f"OpenAI API error: {response.status_code}")
-        
-        # Update database with analysis result
-        try:
-            await db.file_uploads.update_one(
-                {"id": upload_id, "user_id": current_user['uid']},
-                {"$set": {
-                    "analysis_status": "completed",
-                    "analysis_result": analysis_result
-                }}
-            )
-        except Exception as db_error:
-            logger.error(f"Error updating database: {db_error}")
-            # Still return the analysis result even if DB update fails
-        
-        return {"analysis_result": analysis_result, "upload_id": upload_id}
+        upload = await upload_repository.get(
+            job['upload_id'],
+            current_user['uid'],
+            {"_id": 0, "analysis_status": 1, "analysis_progress": 1, "analysis_result": 1}
+        ) or {}
         
+        return {
+            "job_id": job['id'],
+            "upload_id": job['upload_id'],
+            "status": job['status'],
+            "analysis_status": upload.get('analysis_status'),
+            "analysis_progress": upload.get('analysis_progress'),
+            "analysis_result": upload.get('analysis_result') if job['status'] == JOB_COMPLETED else None,
+            "error": job.get('error'),
+            "created_at": job['created_at'].isoformat(),
+            "finished_at": job['finished_at'].isoformat() if job.get('finished_at') else None
+        }
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Analysis error: {str(e)}")
-        
-        # Update status to failed (if DB is available)
+        logger.error(f"Error fetching analysis job: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Database error: {str(e)}"
+        )
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api_router.post("/analyze/{upload_id}/stream")
+async def analyze_document_stream(
+    upload_id: str,
+    analyze_data: AnalyzeRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Analyze a document and stream the model output as Server-Sent Events.
+    Emits "token" events as text arrives, then "done" (or "error").
+    The full text is saved to analysis_result once the stream completes.
+    """
+    if db is None:
+        raise HTTPException(
+            status_code=503, 
+            detail="Database connection unavailable. Please ensure MongoDB is running."
+        )
+    
+    admit_analysis(current_user)
+    
+    try:
+        upload = await upload_repository.update(
+            upload_id,
+            current_user['uid'],
+            # Supersedes any queued analysis of this upload
+            {"analysis_status": "processing", "analysis_job_id": None}
+        )
+    except Exception as e:
+        logger.error(f"Error accessing database: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Database error: {str(e)}"
+        )
+    
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found or access denied")
+    
+    async def event_stream():
+        chunks = []
+        completed = False
         try:
-            if db:
-                await db.file_uploads.update_one(
-                    {"id": upload_id, "user_id": current_user['uid']},
-                    {"$set": {"analysis_status": "failed"}}
+            openai_api_key = get_model_api_key()
+            if openai_api_key is None:
+                chunks.append(await run_analysis(
+                    upload, analyze_data.file_content, analyze_data.filename, current_user.get('email')
+                ))
+                yield sse_event("token", {"content": chunks[0]})
+            else:
+                document = await prepare_document(
+                    upload, analyze_data.file_content, analyze_data.filename
                 )
-        except:
-            pass  # Ignore DB errors during error handling
-        
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+                if needs_map_reduce(document):
+                    # Large document: analyze the chunks first, then stream the merge
+                    yield sse_event("progress", {"stage": "map"})
+                    findings = await map_document(document, openai_api_key, analysis_cache)
+                    request_body = build_reduce_request(document, findings)
+                else:
+                    request_body = build_analysis_request(document)
+                cached = await analysis_cache.lookup(request_body) if analysis_cache else None
+                if cached is not None:
+                    chunks.append(cached)
+                    yield sse_event("token", {"content": cached})
+                else:
+                    async for delta in stream_openai(request_body, openai_api_key):
+                        chunks.append(delta)
+                        yield sse_event("token", {"content": delta})
+                    if analysis_cache:
+                        await analysis_cache.store(request_body, "".join(chunks))
+            
+            await upload_repository.set_status(
+                upload_id,
+                current_user['uid'],
+                "completed",
+                analysis_result="".join(chunks)
+            )
+            completed = True
+            yield sse_event("done", {"upload_id": upload_id})
+        except AdmissionRejected as rejected:
+            # Model calls backed up after the stream started: too late for a 429
+            logger.warning(f"Streaming analysis rejected: {rejected.detail}")
+            yield sse_event("error", {"detail": rejected.detail, "retry_after": int(rejected.retry_after_header)})
+        except Exception as e:
+            logger.error(f"Streaming analysis error: {str(e)}")
+            yield sse_event("error", {"detail": f"Analysis failed: {str(e)}"})
+        finally:
+            if not completed:
+                # Client went away or the analysis failed: the upstream stream is
+                # already closed by unwinding stream_openai; record the failure
+                # even though this scope may be cancelled
+                with anyio.CancelScope(shield=True):
+                    try:
+                        await upload_repository.set_status(upload_id, current_user['uid'], "failed")
+                    except Exception as db_error:
+                        logger.error(f"Error updating database: {db_error}")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def process_analysis_job(job: dict):
+    """
+    Job queue handler: runs the analysis pipeline for one queued upload
+    """
+    # Every write is conditional on the upload still pointing at this job:
+    # once a newer analysis takes over, this one must not touch its status
+    upload = await upload_repository.update(
+        job['upload_id'],
+        job['user_id'],
+        {"analysis_status": "processing"},
+        job_id=job['id']
+    )
+    if not upload:
+        logger.info(f"Analysis job {job['id']} was superseded or its upload deleted; skipping")
+        return
+    
+    async def report_progress(stage: str, completed: int, total: int):
+        # Chunked (map-reduce) analyses report how far along they are
+        await upload_repository.set_status(
+            job['upload_id'],
+            job['user_id'],
+            "processing",
+            job_id=job['id'],
+            analysis_progress={"stage": stage, "completed": completed, "total": total}
+        )
+    
+    payload = job.get('payload') or {}
+    while True:
+        try:
+            analysis_result = await run_analysis(
+                upload,
+                payload.get('file_content', ''),
+                payload.get('filename', ''),
+                payload.get('user_email'),
+                cache=analysis_cache,
+                on_progress=report_progress
+            )
+            break
+        except AdmissionRejected as rejected:
+            # Queued work waits its turn rather than failing; calls that already
+            # finished are answered from the analysis cache on the next run
+            logger.warning(f"Analysis job {job['id']} deferred {rejected.retry_after_header}s: {rejected.detail}")
+            await asyncio.sleep(float(rejected.retry_after_header))
+    
+    if not await upload_repository.set_status(
+        job['upload_id'],
+        job['user_id'],
+        "completed",
+        job_id=job['id'],
+        analysis_result=analysis_result
+    ):
+        logger.info(f"Analysis job {job['id']} was superseded; result discarded")
+
+async def mark_analysis_failed(job: dict, error: str):
+    await upload_repository.set_status(job['upload_id'], job['user_id'], "failed", job_id=job['id'])
 
 @api_router.put("/upload/{upload_id}/analysis")
 async def update_analysis_result(
@@ -745,22 +1048,17 @@ async def update_analysis_result(
         )
     
     try:
-        upload = await db.file_uploads.find_one({
-            "id": upload_id,
-            "user_id": current_user['uid']
-        })
+        updated = await upload_repository.set_status(
+            upload_id,
+            current_user['uid'],
+            status,
+            analysis_result=analysis_result,
+            analysis_job_id=None
+        )
         
-        if not upload:
+        if not updated:
             raise HTTPException(status_code=404, detail="Upload not found or access denied")
         
-        await db.file_uploads.update_one(
-            {"id": upload_id, "user_id": current_user['uid']},
-            {"$set": {
-                "analysis_status": status,
-                "analysis_result": analysis_result
-            }}
-        )
-        
         return {"message": "Analysis result updated successfully"}
     except HTTPException:
         raise
@@ -806,6 +1104,10 @@ async def get_status_checks():
 
 # Include the router in the main app
 app.include_router(api_router)
+app.include_router(internal_router)
+
+# Reject oversized uploads before their multipart body is parsed
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/api/upload-file"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -813,8 +1115,92 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After", "X-Trace-Id"],
+)
+
+# Root span of every request; spans opened while handling it nest under it
+app.add_middleware(TracingMiddleware)
+
+# Outermost, so latency includes the other middleware
+app.add_middleware(MetricsMiddleware)
+
+register_gauge(
+    'llm_calls_in_flight', 'Model calls holding an upstream slot',
+    lambda: admission.in_flight
+)
+register_gauge(
+    'llm_calls_waiting', 'Model calls waiting for an upstream slot',
+    lambda: admission.waiting
+)
+register_gauge(
+    'llm_circuit_open', '1 while the model provider circuit breaker is open',
+    lambda: int(get_llm_client().breaker.state == 'open')
+)
+register_gauge(
+    'extraction_tasks', 'Extraction pool tasks by state',
+    lambda: {
+        ('running',): get_extraction_pool().stats()['running'],
+        ('queued',): get_extraction_pool().stats()['queued'],
+    },
+    ['state']
+)
+register_gauge(
+    'parsed_cache_bytes', 'Size of the parsed-document snapshot cache',
+    lambda: get_parsed_cache().stats()['bytes']
 )
 
+@app.on_event("startup")
+async def start_background_services():
+    await start_http_client()
+    start_extraction_pool()
+    start_tokenizer_preload()
+    await start_token_key_refresh()
+    await last_login_writer.start()
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if db is None:
+        return
+    try:
+        await upload_repository.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create file_uploads indexes: {e}")
+
+@app.on_event("startup")
+async def start_analysis_workers():
+    global job_queue
+    if db is None:
+        logger.warning("MongoDB unavailable - analysis job queue not started")
+        return
+    try:
+        if analysis_cache is not None:
+            await analysis_cache.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create analysis cache indexes: {e}")
+    job_queue = AnalysisJobQueue(
+        db,
+        handler=process_analysis_job,
+        on_failed=mark_analysis_failed,
+        concurrency=int(os.environ.get('ANALYSIS_WORKERS', '4'))
+    )
+    try:
+        await job_queue.start()
+    except Exception as e:
+        logger.error(f"Failed to start analysis job queue: {e}")
+        job_queue = None
+
+@app.on_event("shutdown")
+async def stop_analysis_workers():
+    if job_queue:
+        await job_queue.stop()
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await stop_token_key_refresh()
+    await last_login_writer.stop()
+    await close_http_client()
+    close_extraction_pool()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     if client:
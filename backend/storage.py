@@ -0,0 +1,256 @@
+import os
+import mmap
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional
+
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+
+from metrics import count_bytes, download_bytes, track_dependency
+
+logger = logging.getLogger(__name__)
+
+# "local" (files under UPLOAD_STORAGE_DIR) or "s3" (any S3-compatible store)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local').lower()
+UPLOAD_STORAGE_DIR = Path(
+    os.environ.get('UPLOAD_STORAGE_DIR', str(Path(__file__).parent / 'uploads'))
+)
+
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_PREFIX = os.environ.get('S3_PREFIX', 'uploads/')
+# Set for MinIO, Cloudflare R2, Ceph etc.; unset means AWS
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+S3_REGION = os.environ.get('S3_REGION') or None
+S3_MAX_CONNECTIONS = int(os.environ.get('S3_MAX_CONNECTIONS', '50'))
+# Redirect downloads to a presigned URL instead of streaming them through the backend
+S3_PRESIGNED_DOWNLOADS = os.environ.get('S3_PRESIGNED_DOWNLOADS', 'false').lower() == 'true'
+S3_PRESIGNED_EXPIRES_SECONDS = int(os.environ.get('S3_PRESIGNED_EXPIRES_SECONDS', '300'))
+
+# Read size for files served without sendfile support, and for S3 bodies
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class StoredFileMissing(Exception):
+    pass
+
+
+class StorageUnavailable(Exception):
+    pass
+
+
+@contextmanager
+def open_mapped(path: str) -> Iterator:
+    """
+    Open a file read-only as a memory map, for parsers that take a binary
+    file object: reads come straight from the page cache (shared with other
+    workers parsing the same file) without a read() call per buffer.
+    Empty files can't be mapped and are opened normally.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield file
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def file_response(path: str, filename: str, media_type: Optional[str]) -> FileResponse:
+    """
+    Serve a file from disk. Servers implementing the ASGI pathsend extension
+    send it with sendfile; others get it read in large chunks off the event loop.
+    """
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        raise StoredFileMissing(path)
+    download_bytes.inc('local_storage', amount=stat_result.st_size)
+    response = FileResponse(
+        path,
+        media_type=media_type or 'application/octet-stream',
+        filename=filename,
+        stat_result=stat_result
+    )
+    response.chunk_size = DOWNLOAD_CHUNK_BYTES
+    return response
+
+
+class LocalStorage:
+    """
+    Files on local disk, one per key, under root
+    """
+
+    name = 'local'
+
+    def __init__(self, root: Path = UPLOAD_STORAGE_DIR):
+        self.root = root
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    async def put(self, spool_path: str, key: str):
+        """
+        Move a spooled file (written under UPLOAD_STORAGE_DIR) to key. Keys
+        are content hashes, so an existing file is kept and the spool dropped.
+        """
+        stored_path = self.path(key)
+        if stored_path.exists():
+            os.unlink(spool_path)
+        else:
+            os.replace(spool_path, stored_path)
+
+    @asynccontextmanager
+    async def local_file(self, key: str, suffix: str = '') -> AsyncIterator[str]:
+        """
+        Yield a path on local disk holding the file (the stored file itself)
+        """
+        stored_path = self.path(key)
+        if not stored_path.exists():
+            raise StoredFileMissing(key)
+        yield str(stored_path)
+
+    async def download_response(self, key: str, filename: str, media_type: Optional[str]) -> Response:
+        return file_response(str(self.path(key)), filename, media_type)
+
+    async def delete(self, key: str):
+        """
+        Remove the stored file; a missing one is already deleted
+        """
+        await asyncio.to_thread(self.path(key).unlink, missing_ok=True)
+
+
+class S3Storage:
+    """
+    Files in an S3-compatible bucket, stored as <prefix><key>. boto3 is
+    synchronous, so calls run in threads.
+    """
+
+    name = 's3'
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        prefix: str = S3_PREFIX,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        region: Optional[str] = S3_REGION,
+        presigned_downloads: bool = S3_PRESIGNED_DOWNLOADS
+    ):
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set when STORAGE_BACKEND=s3")
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presigned_downloads = presigned_downloads
+        self._client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(max_pool_connections=S3_MAX_CONNECTIONS, retries={'mode': 'standard'})
+        )
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def _call(self, operation: str, fn, *args, **kwargs):
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            with track_dependency('s3', operation):
+                return await asyncio.to_thread(fn, *args, **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise StoredFileMissing(str(e)) from e
+            raise StorageUnavailable(str(e)) from e
+        except BotoCoreError as e:
+            raise StorageUnavailable(str(e)) from e
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await self._call('head', self._client.head_object, Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except StoredFileMissing:
+            return False
+
+    async def put(self, spool_path: str, key: str):
+        """
+        Upload a spooled file to key, unless the same content is already
+        stored, then remove the spool
+        """
+        try:
+            if not await self.exists(key):
+                await self._call('put', self._client.upload_file, spool_path, self.bucket, self.object_key(key))
+        finally:
+            os.unlink(spool_path)
+
+    @asynccontextmanager
+    async def local_file(self, key: str, suffix: str = '') -> AsyncIterator[str]:
+        """
+        Download the object to a temporary file and yield its path
+        """
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        temp_file.close()
+        try:
+            await self._call('download', self._client.download_file, self.bucket, self.object_key(key), temp_file.name)
+            download_bytes.inc('analysis', amount=os.path.getsize(temp_file.name))
+            yield temp_file.name
+        finally:
+            os.unlink(temp_file.name)
+
+    async def download_response(self, key: str, filename: str, media_type: Optional[str]) -> Response:
+        if self.presigned_downloads:
+            # The client fetches the bytes from the store directly
+            url = await self._call(
+                'presign',
+                self._client.generate_presigned_url,
+                'get_object',
+                Params={
+                    'Bucket': self.bucket,
+                    'Key': self.object_key(key),
+                    'ResponseContentDisposition': f'attachment; filename="{filename}"'
+                },
+                ExpiresIn=S3_PRESIGNED_EXPIRES_SECONDS
+            )
+            return RedirectResponse(url, status_code=307)
+
+        result = await self._call('get', self._client.get_object, Bucket=self.bucket, Key=self.object_key(key))
+        body = result['Body']
+        return StreamingResponse(
+            count_bytes(iterate_in_threadpool(body.iter_chunks(DOWNLOAD_CHUNK_BYTES)), 's3'),
+            media_type=media_type or result.get('ContentType') or 'application/octet-stream',
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "Content-Length": str(result['ContentLength'])
+            },
+            background=BackgroundTask(body.close)
+        )
+
+    async def delete(self, key: str):
+        """
+        Remove the object (S3 treats deleting a missing key as success)
+        """
+        await self._call('delete', self._client.delete_object, Bucket=self.bucket, Key=self.object_key(key))
+
+
+_storage = None
+
+
+def get_storage():
+    """
+    The configured storage backend (STORAGE_BACKEND)
+    """
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == 's3':
+            _storage = S3Storage()
+        elif STORAGE_BACKEND == 'local':
+            _storage = LocalStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+        logger.info(f"File storage: {_storage.name}")
+    return _storage
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_fan_out_calls_are_rejected_once_the_wait_queue_is_full():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_waiting=2)
+        release = asyncio.Event()
+
+        async def call():
+            async with controller.llm_slot():
+                await release.wait()
+
+        # One call holds the slot and two wait: the queue is full
+        calls = [asyncio.create_task(call()) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert controller.in_flight == 1 and controller.waiting == 2
+
+        # Further calls of an already admitted analysis are turned away too
+        with pytest.raises(AdmissionRejected):
+            async with controller.llm_slot():
+                pass
+        with pytest.raises(AdmissionRejected):
+            controller.admit("user-1")
+        assert controller.rejected_overload == 2
+
+        release.set()
+        await asyncio.gather(*calls)
+        async with controller.llm_slot():
+            assert controller.in_flight == 1
+
+    asyncio.run(scenario())
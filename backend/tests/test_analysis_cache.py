@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from analysis_cache import AnalysisCache
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "MARA export"}]}
+
+
+def make_cache(**kwargs) -> AnalysisCache:
+    return AnalysisCache(mongomock_motor.AsyncMongoMockClient().osapio_test, **kwargs)
+
+
+def test_follower_computes_when_leader_is_cancelled():
+    async def scenario():
+        cache = make_cache()
+        leader_started = asyncio.Event()
+
+        async def leader_compute():
+            leader_started.set()
+            await asyncio.sleep(60)
+            return "leader result"
+
+        async def follower_compute():
+            return "follower result"
+
+        leader = asyncio.create_task(cache.get_or_compute(REQUEST, leader_compute))
+        await leader_started.wait()
+        follower = asyncio.create_task(cache.get_or_compute(REQUEST, follower_compute))
+        # Let the follower join the leader's in-flight request
+        await asyncio.sleep(0)
+        assert cache.coalesced == 1
+
+        leader.cancel()
+        assert await follower == "follower result"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert cache.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_follower_does_not_cancel_leader():
+    async def scenario():
+        cache = make_cache()
+        release = asyncio.Event()
+
+        async def leader_compute():
+            await release.wait()
+            return "leader result"
+
+        leader = asyncio.create_task(cache.get_or_compute(REQUEST, leader_compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_compute(REQUEST, leader_compute))
+        await asyncio.sleep(0)
+
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        release.set()
+        assert await leader == "leader result"
+
+    asyncio.run(scenario())
+
+
+def test_leader_error_is_shared_with_followers():
+    async def scenario():
+        cache = make_cache()
+        release = asyncio.Event()
+
+        async def failing_compute():
+            await release.wait()
+            raise RuntimeError("model unavailable")
+
+        leader = asyncio.create_task(cache.get_or_compute(REQUEST, failing_compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_compute(REQUEST, failing_compute))
+        await asyncio.sleep(0)
+
+        release.set()
+        results = await asyncio.gather(leader, follower, return_exceptions=True)
+        assert [str(result) for result in results] == ["model unavailable"] * 2
+
+    asyncio.run(scenario())
+
+
+def test_store_evicts_least_recently_used_without_recounting():
+    async def scenario():
+        cache = make_cache(max_bytes=250)
+        for n in range(4):
+            await cache.store({"n": n}, "x" * 100)
+
+        # The first store counts the collection; later ones keep a running total
+        assert cache._stores_since_count == 3
+        assert cache.stats()["bytes"] == 200
+        assert cache.evictions == 2
+        assert await cache.lookup({"n": 0}) is None
+        assert await cache.lookup({"n": 3}) == "x" * 100
+
+    asyncio.run(scenario())
@@ -0,0 +1,33 @@
+from idoc_parser import is_idoc_content, read_head
+
+FLAT_IDOC = (
+    "EDI_DC40  1000000000000123456740 3014  ORDERS05\n"
+    "E2EDK01005                    1000000000000123456700000100000002\n"
+)
+
+XML_IDOC = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<ORDERS05>\n'
+    '  <IDOC BEGIN="1">\n'
+    '    <EDI_DC40 SEGMENT="1"><TABNAM>EDI_DC40</TABNAM><IDOCTYP>ORDERS05</IDOCTYP></EDI_DC40>\n'
+    '  </IDOC>\n'
+    '</ORDERS05>\n'
+)
+
+
+def test_flat_idoc_is_recognized_from_stored_file(tmp_path):
+    path = tmp_path / "orders.txt"
+    path.write_bytes(b"\xef\xbb\xbf" + FLAT_IDOC.encode())
+    assert is_idoc_content(read_head(str(path)))
+
+
+def test_xml_idoc_is_recognized():
+    assert is_idoc_content(XML_IDOC)
+
+
+def test_text_mentioning_idocs_is_not_an_idoc():
+    text = (
+        "Interface notes: the IDOC type ORDERS05 is sent nightly.\n"
+        "<MAPPING><IDOCTYP>ORDERS05</IDOCTYP></MAPPING>\n"
+    )
+    assert not is_idoc_content(text)
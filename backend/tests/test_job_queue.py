@@ -0,0 +1,193 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from job_queue import AnalysisJobQueue, JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+from upload_repository import UploadRepository
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def make_database():
+    return mongomock_motor.AsyncMongoMockClient().osapio_test
+
+
+async def wait_for_status(database, job_id: str, status: str, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        job = await database.analysis_jobs.find_one({"id": job_id})
+        if job and job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+
+def test_restart_leaves_jobs_leased_by_live_workers_alone():
+    async def scenario():
+        database = make_database()
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(job):
+            handled.append(job["id"])
+            await release.wait()
+
+        first = AnalysisJobQueue(database, handler, concurrency=1, poll_interval=0.01)
+        await first.start()
+        job = await first.enqueue("upload-1", "user-1", {})
+        await wait_for_status(database, job["id"], JOB_RUNNING)
+
+        # Another process starting up must not take over the live job
+        second = AnalysisJobQueue(database, handler, concurrency=1, poll_interval=0.01)
+        await second.start()
+        await asyncio.sleep(0.1)
+        assert handled == [job["id"]]
+
+        release.set()
+        finished = await wait_for_status(database, job["id"], JOB_COMPLETED)
+        assert finished["attempts"] == 1
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_job_with_expired_lease_is_claimed_again():
+    async def scenario():
+        database = make_database()
+        await database.analysis_jobs.insert_one({
+            "id": "job-1",
+            "upload_id": "upload-1",
+            "user_id": "user-1",
+            "payload": {},
+            "status": JOB_RUNNING,
+            "attempts": 1,
+            "created_at": datetime.utcnow(),
+            "worker_id": "crashed-worker",
+            "lease_until": datetime.utcnow() - timedelta(seconds=1),
+        })
+
+        async def handler(job):
+            pass
+
+        queue = AnalysisJobQueue(database, handler, concurrency=1, poll_interval=0.01)
+        await queue.start()
+        finished = await wait_for_status(database, "job-1", JOB_COMPLETED)
+        assert finished["attempts"] == 2
+        assert finished["worker_id"] == queue.worker_id
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stop_requeues_running_job_without_counting_the_attempt():
+    async def scenario():
+        database = make_database()
+
+        async def handler(job):
+            await asyncio.sleep(60)
+
+        queue = AnalysisJobQueue(database, handler, concurrency=1, poll_interval=0.01)
+        await queue.start()
+        job = await queue.enqueue("upload-1", "user-1", {})
+        await wait_for_status(database, job["id"], JOB_RUNNING)
+
+        await queue.stop()
+        stopped = await database.analysis_jobs.find_one({"id": job["id"]})
+        assert stopped["status"] == JOB_QUEUED
+        assert stopped["attempts"] == 0
+        assert stopped["lease_until"] is None
+
+    asyncio.run(scenario())
+
+
+def test_lease_is_renewed_while_the_job_runs():
+    async def scenario():
+        database = make_database()
+        handled = []
+
+        async def handler(job):
+            handled.append(job["id"])
+            # Several lease periods
+            await asyncio.sleep(0.5)
+
+        first = AnalysisJobQueue(database, handler, concurrency=1, poll_interval=0.01, lease_seconds=0.15)
+        second = AnalysisJobQueue(database, handler, concurrency=1, poll_interval=0.01, lease_seconds=0.15)
+        await first.start()
+        job = await first.enqueue("upload-1", "user-1", {})
+        await wait_for_status(database, job["id"], JOB_RUNNING)
+        await second.start()
+
+        await wait_for_status(database, job["id"], JOB_COMPLETED)
+        assert handled == [job["id"]]
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_cancellation_inside_handler_requeues_job_and_keeps_worker():
+    async def scenario():
+        database = make_database()
+        calls = []
+
+        async def handler(job):
+            calls.append(job["id"])
+            if len(calls) == 1:
+                raise asyncio.CancelledError()
+
+        queue = AnalysisJobQueue(database, handler, concurrency=1, poll_interval=0.01)
+        await queue.start()
+        job = await queue.enqueue("upload-1", "user-1", {})
+        finished = await wait_for_status(database, job["id"], JOB_COMPLETED)
+        assert calls == [job["id"], job["id"]]
+        assert finished["attempts"] == 2
+
+        # The same worker still takes new jobs
+        later = await queue.enqueue("upload-2", "user-1", {})
+        await wait_for_status(database, later["id"], JOB_COMPLETED)
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_superseded_job_leaves_the_newer_analysis_alone():
+    async def scenario():
+        database = make_database()
+        uploads = UploadRepository(database)
+        await uploads.insert({"id": "upload-1", "user_id": "user-1", "analysis_job_id": "job-old"})
+        release = asyncio.Event()
+
+        # Writes the way server.process_analysis_job / mark_analysis_failed do
+        async def handler(job):
+            await release.wait()
+            if job["payload"]["fail"]:
+                raise RuntimeError("model unavailable")
+            await uploads.set_status(
+                job["upload_id"], job["user_id"], "completed", job_id=job["id"], analysis_result="stale"
+            )
+
+        async def on_failed(job, error):
+            await uploads.set_status(job["upload_id"], job["user_id"], "failed", job_id=job["id"])
+
+        queue = AnalysisJobQueue(
+            database, handler, on_failed=on_failed, concurrency=2, poll_interval=0.01, max_attempts=1
+        )
+        await queue.start()
+        await queue.enqueue("upload-1", "user-1", {"fail": False}, job_id="job-old")
+        await queue.enqueue("upload-1", "user-1", {"fail": True}, job_id="job-failing")
+        await wait_for_status(database, "job-old", JOB_RUNNING)
+
+        # A newer analysis request takes the upload over
+        await uploads.update("upload-1", "user-1", {"analysis_status": "pending", "analysis_job_id": "job-new"})
+        release.set()
+        await wait_for_status(database, "job-old", JOB_COMPLETED)
+        await wait_for_status(database, "job-failing", JOB_FAILED)
+
+        upload = await uploads.get("upload-1", "user-1")
+        assert upload["analysis_status"] == "pending"
+        assert "analysis_result" not in upload
+        await queue.stop()
+
+    asyncio.run(scenario())
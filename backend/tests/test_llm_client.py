@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+import pytest
+
+import llm_client
+from llm_client import CircuitBreaker, LLMClient, LLMError, OpenAIProvider
+
+REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "MARA export"}]}
+
+
+def test_malformed_success_response_counts_as_a_breaker_failure(monkeypatch):
+    async def scenario():
+        responses = [
+            httpx.Response(200, text="<html>proxy error</html>"),
+            httpx.Response(200, json={"error": "no choices"}),
+        ]
+        transport = httpx.MockTransport(lambda request: responses.pop(0))
+        async with httpx.AsyncClient(transport=transport) as http:
+            monkeypatch.setattr(llm_client, "get_http_client", lambda: http)
+            client = LLMClient(
+                OpenAIProvider(),
+                max_retries=1,
+                backoff_base=0.01,
+                breaker=CircuitBreaker(failure_threshold=2)
+            )
+            with pytest.raises(LLMError, match="malformed response"):
+                await client.complete(REQUEST, "sk-test")
+
+        assert client.breaker.failures == 2
+        assert client.breaker.state == "open"
+        assert client.failures == 1
+
+    asyncio.run(scenario())
+
+
+def test_retries_stop_at_the_call_deadline():
+    class SlowProvider:
+        requires_api_key = False
+        calls = 0
+
+        async def complete(self, request_body, api_key):
+            self.calls += 1
+            await asyncio.sleep(60)
+
+    async def scenario():
+        provider = SlowProvider()
+        client = LLMClient(provider, max_retries=10, backoff_base=0.01, timeout=1.0, deadline=1.0)
+        with pytest.raises(LLMError):
+            await client.complete(REQUEST)
+        # One attempt used up the deadline; nothing left to retry in
+        assert provider.calls == 1
+
+    asyncio.run(scenario())
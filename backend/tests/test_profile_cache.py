@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+
+from google.api_core.exceptions import NotFound
+
+from profile_cache import LastLoginWriter, ProfileCache
+
+
+class FakeDocument:
+    def __init__(self, profiles: dict, uid: str):
+        self.profiles = profiles
+        self.uid = uid
+
+    def update(self, fields: dict):
+        if self.uid not in self.profiles:
+            raise NotFound(f"users/{self.uid}")
+        self.profiles[self.uid].update(fields)
+
+
+class FakeBatch:
+    def __init__(self):
+        self.updates = []
+
+    def update(self, document: FakeDocument, fields: dict):
+        self.updates.append((document, fields))
+
+    def commit(self):
+        # All or nothing, like Firestore
+        if any(document.uid not in document.profiles for document, _ in self.updates):
+            raise NotFound("batch")
+        for document, fields in self.updates:
+            document.update(fields)
+
+
+class FakeFirestore:
+    def __init__(self, profiles: dict):
+        self.profiles = profiles
+
+    def collection(self, name: str):
+        return self
+
+    def document(self, uid: str) -> FakeDocument:
+        return FakeDocument(self.profiles, uid)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch()
+
+
+def test_waiting_request_loads_itself_when_the_first_load_is_cancelled():
+    async def scenario():
+        cache = ProfileCache(lambda: None)
+        first_started = asyncio.Event()
+        loads = []
+
+        async def load(uid, default_profile):
+            loads.append(uid)
+            if len(loads) == 1:
+                first_started.set()
+                await asyncio.sleep(60)
+            return {"uid": uid}, False
+
+        cache._load = load
+        first = asyncio.create_task(cache.get_or_load("user-1", dict))
+        await first_started.wait()
+        second = asyncio.create_task(cache.get_or_load("user-1", dict))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        assert await asyncio.wait_for(second, timeout=5) == ({"uid": "user-1"}, False)
+        assert loads == ["user-1", "user-1"]
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_profile_is_dropped_when_full():
+    cache = ProfileCache(lambda: None, max_entries=2)
+    cache.put("user-1", {"uid": "user-1"})
+    cache.put("user-2", {"uid": "user-2"})
+    cache.get_cached("user-1")
+    cache.put("user-3", {"uid": "user-3"})
+
+    assert cache.get_cached("user-2") is None
+    assert cache.get_cached("user-1") == {"uid": "user-1"}
+    assert cache.get_cached("user-3") == {"uid": "user-3"}
+
+
+def test_last_login_flush_does_not_recreate_deleted_profiles():
+    async def scenario():
+        profiles = {"user-1": {"email": "a@example.com"}}
+        writer = LastLoginWriter(lambda: FakeFirestore(profiles))
+        when = datetime(2026, 1, 1)
+        writer.record("user-1", when)
+        writer.record("deleted-user", when)
+
+        await writer.flush()
+        assert profiles == {"user-1": {"email": "a@example.com", "last_login": when}}
+        assert writer._pending == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,18 @@
+import asyncio
+
+from storage import LocalStorage
+
+
+def test_local_delete_removes_the_file_and_tolerates_a_missing_one(tmp_path):
+    async def scenario():
+        storage = LocalStorage(tmp_path)
+        spool = tmp_path / "spool"
+        spool.write_bytes(b"MATNR;MAKTX\n")
+        await storage.put(str(spool), "abc123")
+        assert storage.path("abc123").exists()
+
+        await storage.delete("abc123")
+        assert not storage.path("abc123").exists()
+        await storage.delete("abc123")
+
+    asyncio.run(scenario())
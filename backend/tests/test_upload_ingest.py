@@ -0,0 +1,29 @@
+import codecs
+
+import pytest
+
+from upload_ingest import sniff_file_type
+
+
+@pytest.mark.parametrize("encoding", ["utf-16", "utf-16-le", "utf-16-be", "utf-32-le", "utf-32-be"])
+def test_wide_text_with_bom_is_accepted(encoding):
+    boms = {
+        "utf-16": b"", "utf-16-le": codecs.BOM_UTF16_LE, "utf-16-be": codecs.BOM_UTF16_BE,
+        "utf-32-le": codecs.BOM_UTF32_LE, "utf-32-be": codecs.BOM_UTF32_BE,
+    }
+    xml = boms[encoding] + '<?xml version="1.0" encoding="UTF-16"?>\n<ORDERS05/>'.encode(encoding)
+    text = boms[encoding] + "MATNR\tMAKTX\n100-100\tPumpe\n".encode(encoding)
+    assert sniff_file_type(xml[:512]) == 'xml'
+    assert sniff_file_type(text[:512]) == 'text'
+
+
+def test_binary_data_is_rejected():
+    assert sniff_file_type(b"\x7fELF\x02\x01\x01\x00\x00\x00") is None
+    assert sniff_file_type(codecs.BOM_UTF16_LE + b"a\x00\x00\x00b\x00") is None
+
+
+def test_known_formats():
+    assert sniff_file_type(b"%PDF-1.7\n") == 'pdf'
+    assert sniff_file_type(b"PK\x03\x04\x14\x00") == 'xlsx'
+    assert sniff_file_type(b"\xef\xbb\xbf<IDOC/>") == 'xml'
+    assert sniff_file_type(b"EDI_DC40  100") == 'text'
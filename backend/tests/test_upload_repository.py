@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import LocalStorage
+from upload_repository import UploadRepository
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_legacy_uploads_without_id_are_backfilled_and_paginated():
+    async def scenario():
+        database = mongomock_motor.AsyncMongoMockClient().osapio_test
+        now = datetime.utcnow()
+        legacy = await database.file_uploads.insert_one(
+            {"user_id": "user-1", "filename": "legacy.csv", "upload_timestamp": now - timedelta(days=1)}
+        )
+        await database.file_uploads.insert_one(
+            {"id": "new-upload", "user_id": "user-1", "filename": "new.csv", "upload_timestamp": now}
+        )
+        repository = UploadRepository(database)
+        await repository.ensure_indexes()
+
+        assert (await repository.get(str(legacy.inserted_id), "user-1"))["filename"] == "legacy.csv"
+
+        first_page = await repository.list_page("user-1", 1)
+        assert [upload["id"] for upload in first_page] == ["new-upload"]
+        after = (first_page[-1]["upload_timestamp"], first_page[-1]["id"])
+        second_page = await repository.list_page("user-1", 1, after)
+        assert [upload["id"] for upload in second_page] == [str(legacy.inserted_id)]
+
+    asyncio.run(scenario())
+
+
+def test_stored_file_is_deleted_with_its_last_upload(tmp_path):
+    async def scenario():
+        repository = UploadRepository(mongomock_motor.AsyncMongoMockClient().osapio_test)
+        storage = LocalStorage(tmp_path)
+        storage.path("shared-hash").write_bytes(b"MATNR;MAKTX\n")
+        # Two users uploaded identical content: one stored file
+        await repository.insert({"id": "upload-1", "user_id": "user-1", "storage_key": "shared-hash"})
+        await repository.insert({"id": "upload-2", "user_id": "user-2", "storage_key": "shared-hash"})
+
+        # As server.delete_upload_record / release_stored_file do it
+        async def delete_upload(upload_id, user_id):
+            deleted = await repository.delete(upload_id, user_id)
+            if not await repository.storage_key_in_use(deleted["storage_key"]):
+                await storage.delete(deleted["storage_key"])
+
+        await delete_upload("upload-1", "user-1")
+        assert storage.path("shared-hash").exists()
+
+        await delete_upload("upload-2", "user-2")
+        assert not storage.path("shared-hash").exists()
+        assert await repository.delete("upload-2", "user-2") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import secrets
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Completed traces are appended to <dir>/traces-YYYYMMDD.jsonl
+TRACE_EXPORT_DIR = Path(
+    os.environ.get('TRACE_EXPORT_DIR', str(Path(__file__).parent / 'traces'))
+)
+# Share of ordinary traces kept; slow and failed traces are always kept
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+TRACE_SLOW_SECONDS = float(os.environ.get('TRACE_SLOW_SECONDS', '5'))
+
+# Spans recorded per trace (a large batch analysis makes thousands of calls)
+MAX_SPANS_PER_TRACE = 2000
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List["Span"] = []
+        self.dropped_spans = 0
+
+    def add(self, span: "Span"):
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+
+class Span:
+    __slots__ = ('name', 'trace', 'span_id', 'parent_id', 'started_at', '_started', 'duration', 'attributes', 'error')
+
+    def __init__(self, name: str, trace: Trace, parent_id: Optional[str] = None, attributes: Optional[dict] = None):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        trace.add(self)
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    def to_dict(self, trace_start: float) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "offset_ms": round((self.started_at - trace_start) * 1000, 3),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.trace.trace_id if current is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Child span of the current one; a no-op outside a trace. Tasks and
+    threads started inside inherit it through the context.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace, parent.span_id, attributes)
+    # Restored by value rather than token: async generators may be
+    # finalized from another context
+    _current_span.set(child)
+    try:
+        yield child
+    except BaseException as error:
+        child.record_error(error)
+        raise
+    finally:
+        child.finish()
+        _current_span.set(parent)
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, **attributes):
+    """
+    Root span of a new trace; exported when it ends
+    """
+    previous = _current_span.get()
+    root = Span(name, Trace(trace_id or secrets.token_hex(16)), attributes=attributes)
+    _current_span.set(root)
+    try:
+        yield root
+    except BaseException as error:
+        root.record_error(error)
+        raise
+    finally:
+        root.finish()
+        _current_span.set(previous)
+        get_trace_exporter().export(root)
+
+
+class JsonlTraceExporter:
+    """
+    Tail-based sampling: the keep/drop decision is made once a trace has
+    finished, so every slow or failed trace is written and only a sample
+    of the rest. Lines are appended off the event loop.
+    """
+
+    def __init__(
+        self,
+        directory: Path = TRACE_EXPORT_DIR,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        slow_seconds: float = TRACE_SLOW_SECONDS
+    ):
+        self.directory = Path(directory)
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.sampled_out = 0
+        self.write_errors = 0
+
+    def should_keep(self, root: Span) -> bool:
+        if root.error or any(span.error for span in root.trace.spans):
+            return True
+        if root.duration >= self.slow_seconds:
+            return True
+        return random.random() < self.sample_rate
+
+    def export(self, root: Span):
+        if not self.should_keep(root):
+            self.sampled_out += 1
+            return
+        line = json.dumps(self.to_record(root), default=str)
+        self.exported += 1
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._write, line)
+        except RuntimeError:
+            self._write(line)
+
+    @staticmethod
+    def to_record(root: Span) -> dict:
+        trace = root.trace
+        return {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "start": datetime.fromtimestamp(root.started_at, timezone.utc).isoformat(),
+            "duration_ms": round(root.duration * 1000, 3),
+            "error": root.error,
+            "attributes": root.attributes,
+            "spans": [span.to_dict(root.started_at) for span in trace.spans if span is not root],
+            "dropped_spans": trace.dropped_spans,
+        }
+
+    def _write(self, line: str):
+        path = self.directory / f"traces-{datetime.utcnow():%Y%m%d}.jsonl"
+        try:
+            with self._lock:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as trace_file:
+                    trace_file.write(line + "\n")
+        except OSError as e:
+            self.write_errors += 1
+            logger.warning(f"Could not write trace to {path}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "directory": str(self.directory),
+            "sample_rate": self.sample_rate,
+            "slow_seconds": self.slow_seconds,
+            "exported": self.exported,
+            "sampled_out": self.sampled_out,
+            "write_errors": self.write_errors,
+        }
+
+
+_exporter: Optional[JsonlTraceExporter] = None
+
+
+def get_trace_exporter() -> JsonlTraceExporter:
+    global _exporter
+    if _exporter is None:
+        _exporter = JsonlTraceExporter()
+    return _exporter
+
+
+def install_log_trace_ids():
+    """
+    Give every log record a trace_id attribute ("-" outside a trace) for
+    use in log formats
+    """
+    base_factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs):
+        record = base_factory(*args, **kwargs)
+        record.trace_id = current_trace_id() or "-"
+        return record
+
+    logging.setLogRecordFactory(record_factory)
+
+
+_route_templates: Dict[object, str] = {}
+
+
+def route_template(scope) -> str:
+    """
+    Path template of the route that handled a request (e.g.
+    /api/upload/{upload_id}), or "unmatched"
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    template = _route_templates.get(endpoint)
+    if template is None:
+        for route in getattr(scope.get("app"), "routes", []):
+            if getattr(route, "endpoint", None) is endpoint:
+                template = route.path
+                break
+        template = _route_templates[endpoint] = template or "unmatched"
+    return template
+
+
+def _incoming_trace_id(scope) -> Optional[str]:
+    """
+    Trace id from a W3C traceparent header, so a caller's trace continues here
+    """
+    for name, value in scope.get("headers", []):
+        if name == b"traceparent":
+            parts = value.decode("latin-1").split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and parts[1] != "0" * 32:
+                try:
+                    int(parts[1], 16)
+                except ValueError:
+                    return None
+                return parts[1].lower()
+    return None
+
+
+class TracingMiddleware:
+    """
+    Opens the root span of every HTTP request and returns its id in an
+    X-Trace-Id header. Streaming responses are traced until their last byte.
+    """
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/api/metrics", "/api/health")):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        with start_trace(f"{scope['method']} {scope['path']}", _incoming_trace_id(scope)) as root:
+            trace_header = (b"x-trace-id", root.trace.trace_id.encode())
+
+            async def send_with_trace_id(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    message = {**message, "headers": list(message.get("headers", [])) + [trace_header]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                root.name = f"{scope['method']} {route_template(scope)}"
+                root.set_attribute("path", scope["path"])
+                root.set_attribute("status_code", status)
+                if status >= 500 and not root.error:
+                    root.error = f"HTTP {status}"
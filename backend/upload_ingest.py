@@ -0,0 +1,157 @@
+import os
+import codecs
+import hashlib
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+
+from storage import UPLOAD_STORAGE_DIR, get_storage
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB
+CHUNK_SIZE = 256 * 1024
+# Room for multipart boundaries/headers on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Leading bytes of the binary formats we accept
+_MAGIC_NUMBERS = [
+    (b'%PDF-', 'pdf'),
+    (b'PK\x03\x04', 'xlsx'),  # Office Open XML is a zip archive
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'xls'),  # OLE2 compound document
+]
+
+# Text in wide encodings (e.g. SAP GUI "Unicode" exports, UTF-16LE); their
+# NUL bytes are not a sign of binary data. UTF-32LE first: its BOM starts
+# with the UTF-16LE one.
+_WIDE_TEXT_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UnsupportedContent(Exception):
+    pass
+
+
+@dataclass
+class IngestedFile:
+    key: str  # storage key: the content hash
+    size: int
+    content_hash: str
+    detected_type: str
+
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """
+    Detect the file type from its first bytes; None for unrecognized binary data
+    """
+    for magic, file_type in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return file_type
+    for bom, encoding in _WIDE_TEXT_BOMS:
+        if head.startswith(bom):
+            # The head may end mid-character
+            decoded = head[len(bom):].decode(encoding, errors='ignore')
+            if '\x00' in decoded:
+                return None
+            return 'xml' if decoded.lstrip().startswith('<') else 'text'
+    if b'\x00' in head:
+        return None
+    text = head.lstrip(b'\xef\xbb\xbf').lstrip()
+    if text.startswith(b'<'):
+        return 'xml'
+    return 'text'
+
+
+async def ingest_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> IngestedFile:
+    """
+    Spool an upload to local disk chunk by chunk, hashing and sniffing it on
+    the way, then hand it to the storage backend. Aborts as soon as max_bytes
+    is crossed. Files are stored under their SHA-256, so identical uploads
+    share one stored copy.
+    """
+    UPLOAD_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    detected_type = None
+
+    spool = tempfile.NamedTemporaryFile(dir=UPLOAD_STORAGE_DIR, prefix='.incoming-', delete=False)
+    try:
+        with spool:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0:
+                    detected_type = sniff_file_type(chunk[:512])
+                    if detected_type is None:
+                        raise UnsupportedContent("File content is not a supported document type")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File size exceeds {max_bytes // (1024 * 1024)}MB limit")
+                digest.update(chunk)
+                spool.write(chunk)
+
+        content_hash = digest.hexdigest()
+        # Moves or uploads the spool; same content already stored is deduplicated
+        await get_storage().put(spool.name, content_hash)
+    except BaseException:
+        if os.path.exists(spool.name):
+            os.unlink(spool.name)
+        raise
+
+    return IngestedFile(
+        key=content_hash,
+        size=size,
+        content_hash=content_hash,
+        detected_type=detected_type or 'text'
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects oversized upload requests before the multipart body is parsed:
+    immediately from Content-Length, or as soon as the streamed body crosses
+    the limit when no length is declared.
+    """
+
+    detail = f"File size exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)}MB limit"
+
+    def __init__(self, app, paths, max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await JSONResponse(status_code=413, content={"detail": self.detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised while the route parses the body, so FastAPI's
+                    # exception handling turns it into a 413 response
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
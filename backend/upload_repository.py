@@ -0,0 +1,161 @@
+from typing import List, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+from metrics import timed_dependency
+
+# Fields left out of list views (analysis text can be large)
+LIST_PROJECTION = {"analysis_result": 0}
+
+
+class UploadRepository:
+    """
+    Owns the file_uploads collection. Every operation is scoped to the
+    owning user and costs a single indexed round trip.
+    """
+
+    def __init__(self, database):
+        self.collection = database.file_uploads
+
+    async def ensure_indexes(self):
+        # Legacy documents without an id get the string form of their _id, the
+        # id they are already listed under, so lookups and pagination find them
+        await self.collection.update_many(
+            {"id": {"$exists": False}},
+            [{"$set": {"id": {"$toString": "$_id"}}}]
+        )
+        # Point lookups by upload id (always combined with user_id);
+        # partial so legacy documents without an id can't break the build
+        await self.collection.create_index(
+            [("id", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"id": {"$exists": True}}
+        )
+        # Per-user, newest-first listing with a stable tie-breaker (keyset pagination)
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("upload_timestamp", DESCENDING), ("id", DESCENDING)]
+        )
+        # Whether a stored file is still referenced (identical content is stored once)
+        await self.collection.create_index(
+            [("storage_key", ASCENDING)],
+            partialFilterExpression={"storage_key": {"$exists": True}}
+        )
+
+    @staticmethod
+    def _query(upload_id: str, user_id: str, job_id: Optional[str] = None) -> dict:
+        query = {"id": upload_id, "user_id": user_id}
+        if job_id is not None:
+            # Only while this job is the upload's current analysis; a newer
+            # request replaces analysis_job_id and supersedes it
+            query["analysis_job_id"] = job_id
+        return query
+
+    @timed_dependency('mongo')
+    async def insert(self, upload: dict):
+        return await self.collection.insert_one(dict(upload))
+
+    @timed_dependency('mongo')
+    async def get(self, upload_id: str, user_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.collection.find_one({"id": upload_id, "user_id": user_id}, projection)
+
+    @timed_dependency('mongo')
+    async def get_many(
+        self,
+        upload_ids: List[str],
+        user_id: str,
+        projection: Optional[dict] = None
+    ) -> List[dict]:
+        """
+        The given uploads that belong to the user, in one $in query;
+        ids that don't exist or belong to someone else are simply absent
+        """
+        cursor = self.collection.find({"id": {"$in": list(upload_ids)}, "user_id": user_id}, projection)
+        return await cursor.to_list(len(upload_ids))
+
+    @timed_dependency('mongo')
+    async def list_page(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[tuple] = None,
+        projection: Optional[dict] = None
+    ) -> List[dict]:
+        """
+        One page of a user's uploads, newest first. `after` is the
+        (upload_timestamp, id) of the last item of the previous page.
+        """
+        query = {"user_id": user_id}
+        if after is not None:
+            last_timestamp, last_id = after
+            query["$or"] = [
+                {"upload_timestamp": {"$lt": last_timestamp}},
+                {"upload_timestamp": last_timestamp, "id": {"$lt": last_id}}
+            ]
+        cursor = self.collection.find(
+            query,
+            LIST_PROJECTION if projection is None else projection
+        ).sort([("upload_timestamp", DESCENDING), ("id", DESCENDING)]).limit(limit)
+        return await cursor.to_list(limit)
+
+    @timed_dependency('mongo')
+    async def update(
+        self,
+        upload_id: str,
+        user_id: str,
+        fields: dict,
+        projection: Optional[dict] = None,
+        job_id: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        Set fields on a user's upload; returns the updated document, or None
+        when the upload doesn't exist, belongs to someone else or (given
+        job_id) has been handed to another analysis
+        """
+        return await self.collection.find_one_and_update(
+            self._query(upload_id, user_id, job_id),
+            {"$set": fields},
+            projection=projection,
+            return_document=ReturnDocument.AFTER
+        )
+
+    @timed_dependency('mongo')
+    async def set_status(
+        self,
+        upload_id: str,
+        user_id: str,
+        status: str,
+        job_id: Optional[str] = None,
+        **fields
+    ) -> bool:
+        result = await self.collection.update_one(
+            self._query(upload_id, user_id, job_id),
+            {"$set": {"analysis_status": status, **fields}}
+        )
+        return result.matched_count == 1
+
+    @timed_dependency('mongo')
+    async def set_status_many(self, upload_ids: List[str], user_id: str, status: str, **fields) -> int:
+        result = await self.collection.update_many(
+            {"id": {"$in": list(upload_ids)}, "user_id": user_id},
+            {"$set": {"analysis_status": status, **fields}}
+        )
+        return result.modified_count
+
+    @timed_dependency('mongo')
+    async def delete(self, upload_id: str, user_id: str) -> Optional[dict]:
+        """
+        Delete a user's upload; returns the deleted document's storage_key
+        field (an empty dict for uploads without one), or None when nothing
+        was deleted
+        """
+        return await self.collection.find_one_and_delete(
+            {"id": upload_id, "user_id": user_id},
+            projection={"_id": 0, "storage_key": 1}
+        )
+
+    @timed_dependency('mongo')
+    async def storage_key_in_use(self, storage_key: str) -> bool:
+        """
+        Whether any upload (of any user) still references the stored file
+        """
+        return await self.collection.count_documents({"storage_key": storage_key}, limit=1) > 0
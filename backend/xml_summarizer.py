@@ -0,0 +1,143 @@
+import io
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Dict, IO, List, Optional
+
+from storage import open_mapped
+
+# Bounds that keep the summary (and its memory) constant in document size
+MAX_TAG_PATHS = 500
+SAMPLES_PER_PATH = 3
+SAMPLE_VALUE_CHARS = 80
+MAX_ATTRIBUTE_NAMES = 20
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+class PathStats:
+    def __init__(self, path: str, depth: int):
+        self.path = path
+        self.depth = depth
+        self.count = 0
+        # Occurrences within a single parent element
+        self.max_per_parent = 0
+        self.parents_with = 0
+        self.attributes: Counter = Counter()
+        self.with_text = 0
+        self.samples: List[str] = []
+
+    def add(self, attributes: Dict[str, str], text: str):
+        self.count += 1
+        for name in attributes:
+            name = _local_name(name)
+            if name in self.attributes or len(self.attributes) < MAX_ATTRIBUTE_NAMES:
+                self.attributes[name] += 1
+        if text:
+            self.with_text += 1
+            if len(self.samples) < SAMPLES_PER_PATH and text[:SAMPLE_VALUE_CHARS] not in self.samples:
+                self.samples.append(text[:SAMPLE_VALUE_CHARS])
+
+    def cardinality(self, parent: Optional['PathStats']) -> str:
+        if parent is None:
+            return "1"
+        lower = "1" if self.parents_with >= parent.count else "0"
+        upper = "1" if self.max_per_parent <= 1 else "n"
+        return f"{lower}..{upper}" if lower != upper else lower
+
+
+class XmlSummary:
+    """
+    Structural schema of an XML document: one entry per distinct tag path
+    """
+
+    def __init__(self):
+        self.root: Optional[str] = None
+        self.element_count = 0
+        self.max_depth = 0
+        self.paths: Dict[str, PathStats] = {}
+        # Elements whose path was not tracked once MAX_TAG_PATHS was reached
+        self.untracked_elements = 0
+
+
+def summarize_xml(source: IO[bytes]) -> XmlSummary:
+    """
+    Summarize an XML document with iterparse. Elements are cleared and
+    detached as soon as they end, so memory is bounded by document depth
+    and the number of distinct tag paths, not by document size.
+    """
+    summary = XmlSummary()
+    # Per open element: (element, path, occurrences of each child path)
+    stack: List[tuple] = []
+
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            name = _local_name(element.tag)
+            path = f"{stack[-1][1]}/{name}" if stack else f"/{name}"
+            if summary.root is None:
+                summary.root = name
+            # Registered on start so paths are listed in document order
+            if path not in summary.paths and len(summary.paths) < MAX_TAG_PATHS:
+                summary.paths[path] = PathStats(path, len(stack) + 1)
+            stack.append((element, path, Counter()))
+            summary.max_depth = max(summary.max_depth, len(stack))
+            continue
+
+        element, path, child_counts = stack.pop()
+        summary.element_count += 1
+
+        stats = summary.paths.get(path)
+        if stats is None:
+            summary.untracked_elements += 1
+        else:
+            stats.add(element.attrib, (element.text or '').strip())
+
+        for child_path, occurrences in child_counts.items():
+            child_stats = summary.paths.get(child_path)
+            if child_stats is not None:
+                child_stats.parents_with += 1
+                child_stats.max_per_parent = max(child_stats.max_per_parent, occurrences)
+
+        if stack:
+            parent, _, parent_child_counts = stack[-1]
+            parent_child_counts[path] += 1
+            element.clear()
+            parent.remove(element)
+        else:
+            element.clear()
+
+    return summary
+
+
+def summarize_xml_file(path: str) -> XmlSummary:
+    with open_mapped(path) as source:
+        return summarize_xml(source)
+
+
+def summarize_xml_text(text: str) -> XmlSummary:
+    return summarize_xml(io.BytesIO(text.encode('utf-8')))
+
+
+def format_xml_summary(summary: XmlSummary, filename: str) -> str:
+    """
+    Render the structural schema as the compact text sent to the model
+    """
+    text = f"XML File: {filename}\n"
+    text += f"Root element: {summary.root}\n"
+    text += f"Elements: {summary.element_count}, distinct tag paths: {len(summary.paths)}, max depth: {summary.max_depth}\n"
+    if summary.untracked_elements:
+        text += f"({summary.untracked_elements} elements under further tag paths not listed)\n"
+    text += "\nStructure (tag path [cardinality per parent] x occurrences):\n"
+
+    for stats in summary.paths.values():
+        parent = summary.paths.get(stats.path.rsplit('/', 1)[0])
+        line = f"{'  ' * (stats.depth - 1)}{stats.path} [{stats.cardinality(parent)}] x{stats.count}"
+        if stats.attributes:
+            line += f" @{', @'.join(stats.attributes)}"
+        if stats.samples:
+            line += f" e.g. {' | '.join(stats.samples)}"
+            if stats.with_text < stats.count:
+                line += f" ({100 * stats.with_text // stats.count}% populated)"
+        text += line + "\n"
+    return text
@@ -238,10 +238,40 @@ const FileUploadContent = ({ onAnalysisComplete }: FileUploadProps) => {
         });
 
         if (analysisResponse.ok) {
-          const analysisData = await analysisResponse.json();
+          const queuedJob = await analysisResponse.json();
+
+          // Analysis runs in a background job - poll until it finishes
+          let analysisData: { status?: string; analysis_result?: string; error?: string } = {};
+          for (let attempt = 0; attempt < 120; attempt++) {
+            await new Promise((resolveDelay) => setTimeout(resolveDelay, 2000));
+            const jobResponse = await fetch(`${backendUrl}/api/analyze/jobs/${queuedJob.job_id}`, {
+              headers: {
+                'Authorization': `Bearer ${idToken}`
+              }
+            });
+            if (!jobResponse.ok) {
+              throw new Error(`Failed to fetch analysis status: ${jobResponse.status}`);
+            }
+            analysisData = await jobResponse.json();
+            if (analysisData.status === 'completed' || analysisData.status === 'failed') {
+              break;
+            }
+          }
+
+          if (analysisData.status === 'failed') {
+            throw new Error(analysisData.error || 'Analysis failed');
+          }
+          if (analysisData.status !== 'completed') {
+            throw new Error('Analysis is taking longer than expected');
+          }
+
           setAnalysis(analysisData.analysis_result || "Analysis completed successfully!");
           onAnalysisComplete?.(analysisData.analysis_result || "");
           toast.success("Document analyzed successfully!");
+        } else if (analysisResponse.status === 429) {
+          // Rate limited or overloaded: the upload is saved, analysis can be retried later
+          const retryAfter = analysisResponse.headers.get('Retry-After');
+          toast.error(`File uploaded, but the analysis service is busy. Please try again ${retryAfter ? `in ${retryAfter} seconds` : 'shortly'}.`);
         } else {
           // Fallback to mock analysis if endpoint not implemented
           const errorText = await analysisResponse.text().catch(() => '');
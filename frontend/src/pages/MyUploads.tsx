@@ -82,19 +82,25 @@ const MyUploadsContent = () => {
   const [uploadToDelete, setUploadToDelete] = useState<string | null>(null);
   const [copiedUrl, setCopiedUrl] = useState(false);
   const [copiedResult, setCopiedResult] = useState(false);
+  // Cursor of the next page of uploads (X-Next-Cursor); null on the last page
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  const fetchUploads = useCallback(async () => {
+  const fetchUploads = useCallback(async (cursor?: string) => {
+    const setBusy = cursor ? setLoadingMore : setLoading;
     try {
-      setLoading(true);
+      setBusy(true);
       const token = await getIdToken();
       if (!token) {
         console.warn('No auth token available');
-        setLoading(false);
+        setBusy(false);
         return;
       }
 
       const backendUrl = import.meta.env.VITE_BACKEND_URL || 'http://localhost:8000';
-      const url = `${backendUrl}/api/my-uploads`;
+      const url = cursor
+        ? `${backendUrl}/api/my-uploads?cursor=${encodeURIComponent(cursor)}`
+        : `${backendUrl}/api/my-uploads`;
       
       const response = await fetch(url, {
         headers: {
@@ -104,7 +110,9 @@ const MyUploadsContent = () => {
 
       if (response.ok) {
         const data = await response.json();
-        setUploads(Array.isArray(data) ? data : []);
+        const page: FileUpload[] = Array.isArray(data) ? data : [];
+        setUploads(previous => cursor ? [...previous, ...page] : page);
+        setNextCursor(response.headers.get('X-Next-Cursor'));
       } else {
         const errorData = await response.json().catch(() => ({}));
         const errorMessage = errorData.detail || `Failed to fetch uploads (${response.status})`;
@@ -120,14 +128,21 @@ const MyUploadsContent = () => {
         } else {
           toast.error(errorMessage);
         }
-        setUploads([]);
+        // A failed "load more" keeps the uploads already shown
+        if (!cursor) {
+          setUploads([]);
+          setNextCursor(null);
+        }
       }
     } catch (error) {
       console.error('Error fetching uploads:', error);
       toast.error('Failed to fetch uploads');
-      setUploads([]);
+      if (!cursor) {
+        setUploads([]);
+        setNextCursor(null);
+      }
     } finally {
-      setLoading(false);
+      setBusy(false);
     }
   }, [getIdToken]);
 
@@ -517,6 +532,17 @@ const MyUploadsContent = () => {
                     ))}
                   </TableBody>
                 </Table>
+                {nextCursor && (
+                  <div className="flex justify-center pt-6">
+                    <Button
+                      variant="outline"
+                      onClick={() => fetchUploads(nextCursor)}
+                      disabled={loadingMore}
+                    >
+                      {loadingMore ? 'Loading...' : 'Load more'}
+                    </Button>
+                  </div>
+                )}
               </CardContent>
             </Card>
           )}